@@ -0,0 +1,191 @@
+"""Command line entry point of the data pipeline
+
+    python -m src.model_data build --seasons 2018 2019 --end-date 2023-07-28
+    python -m src.model_data plan --seasons 2023 --end-date 2023-07-28
+    python -m src.model_data status
+
+status and plan only read the cached metadata of the round partitions (see
+metadata.py), the data monitor and the quarantine, which only need the
+standard library. The heavy imports (pandas, fastf1 and the prepare modules)
+are deferred until build needs them, so checking what a run would do takes
+milliseconds
+"""
+from typing import List, Optional
+import argparse
+import os
+import sys
+
+from src.model_data.metadata import plan_rounds, read_json, read_manifest
+from src.model_data.session_loader import SessionQuarantine
+
+
+# Same as CONVENTIONAL_FORMATS in f1_season.py, which imports fastf1
+DEFAULT_EVENT_FORMATS: List[str] = ['conventional']
+DEFAULT_PARTITIONS: str = os.path.join('data', 'partitions')
+MONITOR_FILE: str = 'monitor.json'
+
+
+def get_quarantine(args: argparse.Namespace) -> SessionQuarantine:
+    return SessionQuarantine(
+        args.quarantine if args.quarantine
+        else os.path.join(args.partitions, 'quarantine.json')
+    )
+
+
+def build(args: argparse.Namespace) -> None:
+    # Heavy imports, only needed to pull data
+    from src.model_data.main import backfill, record_schedules
+    from src.model_data.monitor import DataMonitor
+    from src.model_data.partitions import RoundPartitions
+    from src.model_data.session_loader import SessionLoader
+
+    archive = None
+    if args.archive:
+        from src.model_data.season_objects.session_archive import SessionArchive
+        archive = SessionArchive(args.archive)
+
+    loader = SessionLoader(retries=args.retries,
+                           backoff_seconds=args.backoff,
+                           timeout_seconds=args.timeout,
+                           quarantine=get_quarantine(args))
+
+    record_schedules(args.seasons, args.end_date, args.partitions, archive)
+    summary = backfill(args.seasons,
+                       args.end_date,
+                       RoundPartitions(args.partitions),
+                       loader,
+                       archive,
+                       args.event_formats,
+                       args.engine,
+                       args.quarantined_only,
+                       DataMonitor(os.path.join(args.partitions, MONITOR_FILE)))
+
+    print(f"Written rounds: {len(summary['written'])}")
+    for season, round_number in summary['incomplete']:
+        print(f"Incomplete (quarantined): {season} round {round_number}")
+    for season, round_number in summary['bad']:
+        print(f"Bad (data monitor): {season} round {round_number}")
+
+
+def status(args: argparse.Namespace) -> None:
+    manifest = read_manifest(args.partitions)
+
+    seasons = {}
+    for partition in manifest.values():
+        season = seasons.setdefault(partition['SeasonYear'],
+                                    {'rounds': 0, 'rows': 0})
+        season['rounds'] += 1
+        season['rows'] += partition['Rows']
+
+    print(f"Partitions: {args.partitions}")
+    for season in sorted(seasons):
+        print(f"  {season}: {seasons[season]['rounds']} rounds, "
+              f"{seasons[season]['rows']} rows")
+
+    monitored = read_json(os.path.join(args.partitions, MONITOR_FILE))
+    bad_rounds = {
+        key: summary['Flags'] + summary.get('DriftFlags', [])
+        for key, summary in monitored.get('rounds', {}).items()
+        if summary['Flags'] or summary.get('DriftFlags')
+    }
+    print(f"Bad rounds (data monitor): {len(bad_rounds)}")
+    for key in sorted(bad_rounds):
+        print(f"  {key}: {'; '.join(bad_rounds[key])}")
+
+    entries = get_quarantine(args).entries()
+    print(f"Quarantined sessions: {len(entries)}")
+    for key in sorted(entries):
+        state = 'given up' if entries[key]['GivenUp'] else 'retry'
+        print(f"  {key} ({state}, {entries[key]['Runs']} runs): "
+              f"{entries[key]['Error']}")
+
+
+def plan(args: argparse.Namespace) -> None:
+    event_formats = (
+        args.event_formats if args.event_formats else DEFAULT_EVENT_FORMATS
+    )
+    season_plans = plan_rounds(args.partitions,
+                               args.seasons,
+                               args.end_date,
+                               event_formats,
+                               get_quarantine(args).rounds())
+
+    for season, season_plan in season_plans.items():
+        if not season_plan['schedule_cached']:
+            print(f"{season}: schedule not cached, build pulls the full "
+                  f"season ({len(season_plan['built'])} rounds built)")
+            continue
+
+        to_build = (
+            season_plan['retry'] if args.quarantined_only
+            else sorted(set(season_plan['build']) | set(season_plan['retry']))
+        )
+        print(f"{season}: {len(season_plan['built'])} rounds built, "
+              f"build {to_build}, retry {season_plan['retry']}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='python -m src.model_data',
+        description='Build the Formula 1 model data into round partitions'
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_common(subparser: argparse.ArgumentParser) -> None:
+        subparser.add_argument('--partitions', default=DEFAULT_PARTITIONS,
+                               help='root directory of the round partitions')
+        subparser.add_argument('--quarantine', default=None,
+                               help='quarantine file, defaults to '
+                                    '<partitions>/quarantine.json')
+
+    def add_run(subparser: argparse.ArgumentParser) -> None:
+        subparser.add_argument('--seasons', nargs='+', type=int, required=True)
+        subparser.add_argument('--end-date', required=True,
+                               help='last day a session could take place on, '
+                                    'e.g. 2023-07-28')
+        subparser.add_argument('--event-formats', nargs='+', default=None,
+                               help='EventFormat values, defaults to '
+                                    'conventional')
+        subparser.add_argument('--quarantined-only', action='store_true',
+                               help='only the rounds with a quarantined '
+                                    'session')
+
+    build_parser = subparsers.add_parser('build', help='pull and store rounds')
+    add_common(build_parser)
+    add_run(build_parser)
+    build_parser.add_argument('--archive', default=None,
+                              help='SessionArchive root to replay from')
+    build_parser.add_argument('--engine', choices=['pandas', 'numpy'],
+                              default='pandas')
+    build_parser.add_argument('--retries', type=int, default=2)
+    build_parser.add_argument('--backoff', type=float, default=5.0,
+                              help='seconds before the first retry')
+    build_parser.add_argument('--timeout', type=float, default=None,
+                              help='seconds per session load attempt')
+    build_parser.set_defaults(run=build)
+
+    status_parser = subparsers.add_parser(
+        'status', help='built rounds, bad rounds and quarantined sessions'
+    )
+    add_common(status_parser)
+    status_parser.set_defaults(run=status)
+
+    plan_parser = subparsers.add_parser(
+        'plan', help='rounds a build would pull, from cached metadata'
+    )
+    add_common(plan_parser)
+    add_run(plan_parser)
+    plan_parser.set_defaults(run=plan)
+
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    args.run(args)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
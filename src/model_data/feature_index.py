@@ -0,0 +1,344 @@
+from typing import Dict, List, Optional, Tuple
+from collections import deque
+import json
+import numpy as np
+import pandas as pd
+
+from src.model_data.partitions import RoundPartitions
+
+
+# Columns needed to add a race to the index
+RACE_COLUMNS: List[str] = [
+    'SeasonYear',
+    'RoundNumber',
+    'DriverNumber',
+    'Location',
+    'Points',
+    'Position'
+]
+
+# Historical features added to each row, see lookup()
+HISTORY_FEATURES: List[str] = [
+    'DriverRaces',
+    'DriverPoints_mean',
+    'DriverPoints_recent',
+    'DriverPosition_recent',
+    'TeamPoints_recent',
+    'DriverCircuitRaces',
+    'DriverCircuitPoints_mean',
+    'DriverCircuitPosition_best'
+]
+
+
+class HistoricalFeatureIndex:
+    """Rolling per-driver, per-team and per-circuit race history
+
+    The model only gets Location, EventName and Driver as raw categoricals.
+    Historical context, such as a driver's past results at a circuit or a
+    team's recent form, would otherwise need groupbys over the full history
+    for every prediction. The index keeps the running aggregates in
+    dictionaries instead:
+        1) Per driver (DriverNumber): races, total points and the points and
+           positions of the last `window` races
+        2) Per team (TeamId): points of the last `window` driver results.
+           Only filled from results with a TeamId column, see add_race()
+        3) Per driver and circuit (DriverNumber, Location): races, total
+           points and best position
+
+    so the features of a driver are an O(1) lookup (see lookup()). Races are
+    added in place, in round order, from prepare_race_data() outputs (see
+    add_race()). The last added round is the watermark, rounds at or before
+    the watermark are already in the index and are skipped, so the index
+    never needs to be rebuilt.
+
+    Training rows get point-in-time features: a row of a round only sees the
+    races before that round (see add_features()). The prediction path uses
+    the same index, after the latest race has been added
+
+    Args:
+        window: number of recent races in the rolling driver and team
+                aggregates
+
+    Returns:
+        historical features, see lookup() and add_features()
+
+    """
+
+    def __init__(self, window: int = 5) -> None:
+        self.window: int = window
+        self.watermark: Optional[Tuple[int, int]] = None
+
+        self.driver_races: Dict[int, int] = {}
+        self.driver_points: Dict[int, float] = {}
+        self.driver_recent_points: Dict[int, deque] = {}
+        self.driver_recent_positions: Dict[int, deque] = {}
+        self.team_recent_points: Dict[str, deque] = {}
+        self.circuit_races: Dict[Tuple[int, str], int] = {}
+        self.circuit_points: Dict[Tuple[int, str], float] = {}
+        self.circuit_best_position: Dict[Tuple[int, str], float] = {}
+
+    def recent(self, store: Dict, key) -> deque:
+        if key not in store:
+            store[key] = deque(maxlen=self.window)
+        return store[key]
+
+    def add_race(self, results: pd.DataFrame) -> bool:
+        """Add the results of one race to the index in place
+
+        Args:
+            results: prepare_race_data() output with SeasonYear and
+                     RoundNumber added (as in RunAllMethods). The team
+                     aggregates are only updated when a TeamId column is
+                     present. Model data from RunAllMethods has one (from
+                     the driver data), raw prepare_race_data() output does
+                     not: add the TeamId of session.results first, otherwise
+                     TeamPoints_recent stays missing
+
+        Returns:
+            added: False if the race is at or before the watermark (already
+                   in the index)
+
+        """
+
+        race_round = (
+            int(results['SeasonYear'].iloc[0]),
+            int(results['RoundNumber'].iloc[0])
+        )
+        if self.watermark is not None and race_round <= self.watermark:
+            return False
+
+        has_team = 'TeamId' in results.columns
+        for row in results.itertuples(index=False):
+            driver = int(row.DriverNumber)
+            circuit = (driver, str(row.Location))
+            points = 0.0 if pd.isna(row.Points) else float(row.Points)
+
+            self.driver_races[driver] = self.driver_races.get(driver, 0) + 1
+            self.driver_points[driver] = (
+                self.driver_points.get(driver, 0.0) + points
+            )
+            self.recent(self.driver_recent_points, driver).append(points)
+
+            self.circuit_races[circuit] = self.circuit_races.get(circuit, 0) + 1
+            self.circuit_points[circuit] = (
+                self.circuit_points.get(circuit, 0.0) + points
+            )
+
+            if not pd.isna(row.Position):
+                position = float(row.Position)
+                self.recent(self.driver_recent_positions,
+                            driver).append(position)
+                self.circuit_best_position[circuit] = min(
+                    self.circuit_best_position.get(circuit, np.inf), position
+                )
+
+            if has_team and not pd.isna(row.TeamId):
+                self.recent(self.team_recent_points,
+                            str(row.TeamId)).append(points)
+
+        self.watermark = race_round
+
+        return True
+
+    def lookup(self,
+               driver_number: int,
+               location: str,
+               team_id: Optional[str] = None) -> Dict[str, float]:
+        """Obtain the historical features of a driver at a circuit
+
+        Args:
+            driver_number: DriverNumber of the driver
+
+            location: Location of the event
+
+            team_id: optional TeamId of the driver's team
+
+        Returns:
+            features: the HISTORY_FEATURES, NaN when there is no history
+
+        """
+
+        driver = int(driver_number)
+        circuit = (driver, str(location))
+
+        def mean(values: Optional[deque]) -> float:
+            return float(np.mean(values)) if values else np.nan
+
+        races = self.driver_races.get(driver, 0)
+        circuit_races = self.circuit_races.get(circuit, 0)
+
+        return {
+            'DriverRaces': races,
+            'DriverPoints_mean': (
+                self.driver_points[driver] / races if races else np.nan
+            ),
+            'DriverPoints_recent': mean(self.driver_recent_points.get(driver)),
+            'DriverPosition_recent': mean(
+                self.driver_recent_positions.get(driver)
+            ),
+            'TeamPoints_recent': mean(
+                self.team_recent_points.get(str(team_id))
+                if team_id is not None and not pd.isna(team_id) else None
+            ),
+            'DriverCircuitRaces': circuit_races,
+            'DriverCircuitPoints_mean': (
+                self.circuit_points[circuit] / circuit_races
+                if circuit_races else np.nan
+            ),
+            'DriverCircuitPosition_best': (
+                self.circuit_best_position.get(circuit, np.nan)
+            )
+        }
+
+    def features_for(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """Look up the historical features of every row
+
+        Args:
+            rows: rows with DriverNumber and Location columns (and optionally
+                  TeamId), e.g. the rows of the race to predict
+
+        Returns:
+            features: HISTORY_FEATURES of each row, with the index of rows
+
+        """
+
+        team_ids = (
+            rows['TeamId'] if 'TeamId' in rows.columns
+            else pd.Series(None, index=rows.index)
+        )
+
+        return pd.DataFrame(
+            [self.lookup(driver_number, location, team_id)
+             for driver_number, location, team_id
+             in zip(rows['DriverNumber'], rows['Location'], team_ids)],
+            index=rows.index,
+            columns=HISTORY_FEATURES
+        )
+
+    @staticmethod
+    def race_results(round_rows: pd.DataFrame) -> pd.DataFrame:
+        """Obtain one result row per driver from the model data of a round"""
+
+        columns = RACE_COLUMNS + (
+            ['TeamId'] if 'TeamId' in round_rows.columns else []
+        )
+
+        return round_rows[columns].drop_duplicates('DriverNumber')
+
+    def add_features(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Add point-in-time historical features to model data
+
+        Rounds are processed in order. The rows of a round get the features
+        of the index before the round, then the round's race is added to the
+        index. Rounds already in the index (at or before the watermark) get
+        the current features, so only use those rows for prediction
+
+        Args:
+            data: model data (e.g. from RunAllMethods or RoundPartitions) with
+                  the RACE_COLUMNS and optionally TeamId
+
+        Returns:
+            data: copy of the model data with the HISTORY_FEATURES added
+
+        """
+
+        data = data.copy()
+        history = np.full((len(data), len(HISTORY_FEATURES)), np.nan)
+
+        # Row positions of each round, so duplicate index labels are fine
+        round_positions = (
+            data.groupby(['SeasonYear', 'RoundNumber']).indices
+        )
+        for data_round in sorted(round_positions):
+            positions = round_positions[data_round]
+            round_rows = data.iloc[positions]
+            history[positions] = (
+                self.features_for(round_rows).to_numpy(dtype=np.float64)
+            )
+
+            results = self.race_results(round_rows.dropna(subset=['Points']))
+            if len(results) > 0:
+                self.add_race(results)
+
+        data[HISTORY_FEATURES] = history
+
+        return data
+
+    def update_from_partitions(self, partitions: RoundPartitions) -> int:
+        """Add the stored rounds after the watermark to the index in place
+
+        Args:
+            partitions: RoundPartitions holding the model data
+
+        Returns:
+            added: number of races added
+
+        """
+
+        new_rounds = [
+            stored_round for stored_round in partitions.rounds()
+            if self.watermark is None or stored_round > self.watermark
+        ]
+
+        added = 0
+        for new_round in new_rounds:
+            round_rows = partitions.read([new_round])
+            round_rows = round_rows.dropna(subset=['Points'])
+            if len(round_rows) > 0:
+                added += int(self.add_race(self.race_results(round_rows)))
+
+        return added
+
+    def to_dict(self) -> Dict:
+        def items(store: Dict) -> List:
+            return [
+                [list(key) if isinstance(key, tuple) else key,
+                 list(value) if isinstance(value, deque) else value]
+                for key, value in store.items()
+            ]
+
+        return {
+            'window': self.window,
+            'watermark': list(self.watermark) if self.watermark else None,
+            'driver_races': items(self.driver_races),
+            'driver_points': items(self.driver_points),
+            'driver_recent_points': items(self.driver_recent_points),
+            'driver_recent_positions': items(self.driver_recent_positions),
+            'team_recent_points': items(self.team_recent_points),
+            'circuit_races': items(self.circuit_races),
+            'circuit_points': items(self.circuit_points),
+            'circuit_best_position': items(self.circuit_best_position)
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> 'HistoricalFeatureIndex':
+        index = cls(state['window'])
+        index.watermark = (
+            tuple(state['watermark']) if state['watermark'] else None
+        )
+
+        def key_of(key):
+            return tuple(key) if isinstance(key, list) else key
+
+        for name in ['driver_races', 'driver_points', 'circuit_races',
+                     'circuit_points', 'circuit_best_position']:
+            setattr(index, name, {
+                key_of(key): value for key, value in state[name]
+            })
+        for name in ['driver_recent_points', 'driver_recent_positions',
+                     'team_recent_points']:
+            setattr(index, name, {
+                key_of(key): deque(value, maxlen=index.window)
+                for key, value in state[name]
+            })
+
+        return index
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as index_file:
+            json.dump(self.to_dict(), index_file)
+
+    @classmethod
+    def load(cls, path: str) -> 'HistoricalFeatureIndex':
+        with open(path) as index_file:
+            return cls.from_dict(json.load(index_file))
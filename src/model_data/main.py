@@ -1,12 +1,21 @@
-from typing import List, Tuple
+from typing import TYPE_CHECKING, Dict, List, Tuple, Optional
+import numpy as np
 import pandas as pd
 
-from src.model_data.season_objects.f1_season import F1Season
-from src.model_data.prepare_data.lap_data import prepare_lap_data
-from src.model_data.prepare_data.weather_data import Weather
-from src.model_data.prepare_data.control_message_data import prepare_control_message_data
-from src.model_data.prepare_data.driver_data import prepare_driver_data
+from src.model_data.season_objects.f1_season import F1Season, SPRINT_FORMATS
+from src.model_data.season_objects.session_archive import SessionArchive
+from src.model_data.season_objects.session_objects import (
+    get_session_role,
+    RACE_SESSION,
+    SPRINT_SESSION
+)
 from src.model_data.prepare_data.race_data import prepare_race_data
+from src.model_data.session_loader import SessionLoader
+
+# Only used in annotations, imported where they are used
+if TYPE_CHECKING:
+    from src.model_data.monitor import DataMonitor
+    from src.model_data.partitions import RoundPartitions
 
 
 class RunAllMethods:
@@ -24,6 +33,15 @@ class RunAllMethods:
             f) Add session information
         3) Combine each session data into full dataset
 
+    Race results are the response variables. For sprint events, the sprint 
+    results are added as extra response variables (SprintPosition and 
+    SprintPoints), these columns are only present when sprint events are 
+    pulled (see append_sprint_events())
+
+    Session parts are combined by a MergePlanner (see merge_planner.py). 
+    Driver events that are left out by the join are kept per season in the 
+    unmatched dictionary
+
     Current procedure is only set up to work for seasons 2018 and beyond. This 
     is the time period in which fastf1 API is available. Fastf1 does provide 
     ergast api all the way back to 1950, but there is not the same level of 
@@ -36,14 +54,57 @@ class RunAllMethods:
                   training data cutoff. Only relevant for a season that is 
                   ongoing
 
+        archive: optional SessionArchive to serve every season from a local 
+                 archive instead of the fastf1 API. Seasons must be exported 
+                 first, see F1Season.export_to_archive()
+
+        event_formats: the EventFormat values of the events to pull. Defaults 
+                       to conventional events only
+
+        engine: "pandas" (default) or "numpy". The numpy engine prepares the 
+                lap, weather, control message and driver data of a session, 
+                and combines them, with vectorized NumPy kernels. Same 
+                output as the pandas engine, see numpy_engine.py
+
+        loader: optional SessionLoader with retries, timeouts and a quarantine 
+                (see session_loader.py). Defaults to a single load attempt 
+                that raises load errors and skips sessions without lap 
+                data. Rounds with a quarantined session that will be retried are 
+                left out of the output and kept per season in the 
+                incomplete_rounds dictionary
+
+        skip_rounds: optional (SeasonYear, RoundNumber) tuples of rounds that 
+                     are already built, these rounds are not pulled
+
+        only_rounds: optional (SeasonYear, RoundNumber) tuples, when given 
+                     only these rounds are pulled (e.g. quarantined rounds)
+
     Returns:
         merged_df: the full dataset for a single season
             
     """
 
-    def __init__(self, seasons: List[int], end_date: str) -> None:
+    def __init__(self,
+                 seasons: List[int],
+                 end_date: str,
+                 archive: Optional[SessionArchive] = None,
+                 event_formats: Optional[List[str]] = None,
+                 engine: str = 'pandas',
+                 loader: Optional[SessionLoader] = None,
+                 skip_rounds: Optional[List[Tuple[int, int]]] = None,
+                 only_rounds: Optional[List[Tuple[int, int]]] = None) -> None:
         self.seasons = seasons
         self.end_date = pd.to_datetime(end_date)
+        self.archive = archive
+        self.event_formats = event_formats
+        self.engine = engine
+        self.loader = (
+            loader if loader else SessionLoader(retries=0, backoff_seconds=0)
+        )
+        self.skip_rounds = set(skip_rounds) if skip_rounds else set()
+        self.only_rounds = set(only_rounds) if only_rounds is not None else None
+        self.unmatched: Dict[int, Dict[str, pd.DataFrame]] = {}
+        self.incomplete_rounds: Dict[int, List[int]] = {}
 
     def get_next_season(self) -> Tuple[int, List]:
         """Obtain season dataframe and combine all sessions into one for a 
@@ -66,7 +127,32 @@ class RunAllMethods:
         curr_season = self.seasons.pop(0)
 
         # Use F1Season class to pull valid season dataframe with session objects
-        f1_season = F1Season(curr_season, self.end_date)
+        f1_season = F1Season(curr_season,
+                             self.end_date,
+                             self.archive,
+                             self.event_formats)
+
+        # Seasons without valid events (e.g. no sprint events) have no sessions
+        if len(f1_season.valid_season_df) == 0:
+            return (curr_season, [])
+
+        # Leave out rounds that are already built or not requested
+        season_rounds = [
+            (curr_season, int(round_number))
+            for round_number in f1_season.valid_season_df['RoundNumber']
+        ]
+        keep_round = [
+            season_round not in self.skip_rounds and
+            (self.only_rounds is None or season_round in self.only_rounds)
+            for season_round in season_rounds
+        ]
+        # Boolean row mask, an empty or all False list would select columns
+        f1_season.valid_season_df = (
+            f1_season.valid_season_df.loc[np.asarray(keep_round, dtype=bool)]
+        )
+        if len(f1_season.valid_season_df) == 0:
+            return (curr_season, [])
+
         f1_season.update_season_dataframe()
 
         # Obtain a single list of all session names and objects
@@ -86,78 +172,73 @@ class RunAllMethods:
             raise StopIteration
         
         curr_season, combined_dict = self.get_next_season()
+
+        # Nothing to join for a season without sessions
+        if len(combined_dict) == 0:
+            self.unmatched[curr_season] = {'features': pd.DataFrame(),
+                                           'results': pd.DataFrame()}
+            self.incomplete_rounds[curr_season] = []
+            return pd.DataFrame()
         
-        feature_df = pd.DataFrame()
-        result_df = pd.DataFrame()
+        from src.model_data.merge_planner import MergePlanner
+        from src.model_data.prepare_data.numpy_engine import (
+            prepare_session_dataset
+        )
+
+        # Collects session parts, joined once after all sessions are prepared
+        merge_planner = MergePlanner()
+
+        incomplete_rounds = set()
 
         for session_name, session_object in combined_dict:
 
-            session_object.load()
-            # Catch when session cannot be loaded from fastf1
-            if not hasattr(session_object, '_laps'):
+            # Catch when session cannot be loaded from fastf1, after retries
+            round_number = int(session_object.event.RoundNumber)
+            session_object = self.loader.load(session_object,
+                                              curr_season,
+                                              round_number,
+                                              session_name)
+            if session_object is None:
+                # Round is pulled again in a later run
+                if self.loader.is_pending(curr_season,
+                                          round_number,
+                                          session_name):
+                    incomplete_rounds.add(round_number)
                 continue
-            else:
-                pass
+
+            # How the session is used depends on the event format
+            session_role = (
+                get_session_role(session_name,
+                                 session_object.event.EventFormat)
+            )
 
             if session_object == 'PredictingRace':
                 return session_object
-            elif session_name == 'Race':
+            elif session_role == RACE_SESSION:
                 # Prepare race data (results and information)
                 results = prepare_race_data(session_object)
                 results['SeasonYear'] = curr_season
                 results['EventName'] = session_object.event.EventName
                 results['RoundNumber'] = session_object.event.RoundNumber
 
-                # Merge race data
-                result_df = (
-                    pd.concat([results, result_df])
-                )
-            else:
-                # Prepare lap data
-                prepared_lap_data = prepare_lap_data(session_object)
-
-                # Prepare weather data and attach to lap data
-                added_weather_data = (
-                        Weather(prepared_lap_data, session_object)
+                merge_planner.add_results(results)
+            elif session_role == SPRINT_SESSION:
+                # Sprint results are extra response variables
+                sprint_results = (
+                    prepare_race_data(session_object)
+                    [['DriverNumber', 'Position', 'Points']]
+                    .rename(columns={'Position': 'SprintPosition',
+                                     'Points': 'SprintPoints'})
                 )
-                full_dataset = pd.DataFrame()
-                for row in added_weather_data:
-                    full_dataset = pd.concat([full_dataset, row])
+                sprint_results['SeasonYear'] = curr_season
+                sprint_results['EventName'] = session_object.event.EventName
 
-                # Prepare control message data
-                racer_flags = (
-                        prepare_control_message_data(session_object)
-                )
-                # Merge control message data with full dataset
-                updated_full_dataset = (
-                    pd.merge(full_dataset, 
-                             racer_flags, 
-                             on='DriverNumber', 
-                             how='left')
-                )
-
-                # Only include the most recent control message in the case the 
-                # driver has more than 1
-                columns_to_group = (
-                    [column for column in updated_full_dataset.columns 
-                     if column != 'Category']
-                )
-
-                updated_full_dataset = (
-                    updated_full_dataset
-                    .groupby(columns_to_group)['Category']
-                    .last()
-                    .reset_index()
-                )
-
-                # Prepare driver data
-                driver_data = prepare_driver_data(session_object)
-                # Merge driver data
+                merge_planner.add_sprint_results(sprint_results)
+            else:
+                # Prepare lap, weather, control message and driver data 
+                # with the selected engine, one row per driver
                 updated_full_dataset = (
-                    pd.merge(updated_full_dataset, 
-                             driver_data, 
-                             on='DriverNumber', 
-                             how='left')
+                    prepare_session_dataset(session_object, self.engine)
                 )
 
                 # Add session information
@@ -167,15 +248,214 @@ class RunAllMethods:
                     session_object.event.EventName
                 )
 
-                feature_df = pd.concat([feature_df, updated_full_dataset])
+                merge_planner.add_features(updated_full_dataset)
 
-        merged_df = (
-            pd.merge(feature_df,
-                     result_df,
-                     on=['DriverNumber',
-                         'EventName',
-                         'SeasonYear'],
-                         how='inner')
-        )
+        merged_df = merge_planner.merge()
+        self.unmatched[curr_season] = {
+            'features': merge_planner.unmatched_features,
+            'results': merge_planner.unmatched_results
+        }
+
+        # Incomplete rounds are not returned, so they are never stored as built
+        self.incomplete_rounds[curr_season] = sorted(incomplete_rounds)
+        if incomplete_rounds and len(merged_df) > 0:
+            merged_df = (
+                merged_df[~merged_df['RoundNumber'].isin(incomplete_rounds)]
+            )
 
         return merged_df.reset_index(drop=True)
+
+
+def append_sprint_events(built_df: pd.DataFrame,
+                         seasons: List[int],
+                         end_date: str,
+                         archive: Optional[SessionArchive] = None,
+                         event_formats: Optional[List[str]] = None
+                         ) -> pd.DataFrame:
+    """Pull sprint events and append them to already built data
+
+    Conventional data does not need to be rebuilt to add sprint events. Only 
+    the sprint events are pulled and appended, and the sprint response 
+    variables are left empty for the conventional events
+
+    Args:
+        built_df: already built data, e.g. from a conventional RunAllMethods 
+                  run
+
+        seasons: a list of one or more season years to pull sprint events for
+
+        end_date: the last day a session could take place on
+
+        archive: optional SessionArchive to serve sessions from
+
+        event_formats: the sprint EventFormat values to pull. Defaults to 
+                       SPRINT_FORMATS
+
+    Returns:
+        combined_df: the built data with the sprint events appended
+            
+    """
+
+    sprint_run = RunAllMethods(list(seasons),
+                               end_date,
+                               archive,
+                               event_formats if event_formats 
+                               else SPRINT_FORMATS)
+    # Seasons without sprint events (e.g. 2018 to 2020) give empty frames
+    sprint_seasons = [
+        season_df for season_df in sprint_run if len(season_df) > 0
+    ]
+
+    if len(sprint_seasons) == 0:
+        return built_df
+
+    if len(built_df) == 0:
+        return pd.concat(sprint_seasons, ignore_index=True)
+
+    # Skip events that are already in the built data
+    built_events = built_df[['SeasonYear', 'EventName']].drop_duplicates()
+    sprint_df = (
+        pd.concat(sprint_seasons)
+        .merge(built_events,
+               on=['SeasonYear', 'EventName'],
+               how='left',
+               indicator=True)
+        .query('_merge == "left_only"')
+        .drop(columns='_merge')
+    )
+
+    return pd.concat([built_df, sprint_df], ignore_index=True)
+
+
+def backfill(seasons: List[int],
+             end_date: str,
+             partitions: 'RoundPartitions',
+             loader: Optional[SessionLoader] = None,
+             archive: Optional[SessionArchive] = None,
+             event_formats: Optional[List[str]] = None,
+             engine: str = 'pandas',
+             quarantined_only: bool = False,
+             monitor: Optional['DataMonitor'] = None) -> Dict[str, List]:
+    """Build the model data into round partitions, resuming earlier runs
+
+    Rounds that are already in the partitions are not pulled again, and each 
+    season is written to the partitions as soon as it is built. A failed or 
+    interrupted backfill therefore resumes where it stopped. Rounds with a 
+    quarantined session are left out until a later run loads the session 
+    (see SessionLoader and SessionQuarantine in session_loader.py)
+
+    Args:
+        seasons: a list of one or more season years to build
+
+        end_date: the last day a session could take place on
+
+        partitions: RoundPartitions the rounds are written to
+
+        loader: optional SessionLoader, e.g. with retries and a quarantine
+
+        archive: optional SessionArchive to serve sessions from
+
+        event_formats: the EventFormat values of the events to pull
+
+        engine: "pandas" or "numpy", see RunAllMethods
+
+        quarantined_only: only pull the rounds with a quarantined session 
+                          that will be retried
+
+        monitor: optional DataMonitor, every written round is summarized and 
+                 checked (see monitor.py)
+
+    Returns:
+        summary: the written, incomplete and bad (flagged by the monitor) 
+                 (SeasonYear, RoundNumber) rounds
+
+    """
+
+    only_rounds = None
+    if quarantined_only:
+        if loader is None or loader.quarantine is None:
+            raise ValueError("quarantined_only needs a loader with a quarantine")
+        only_rounds = loader.quarantine.rounds()
+        seasons = sorted({season for season, _ in only_rounds} & set(seasons))
+
+    run = RunAllMethods(list(seasons),
+                        end_date,
+                        archive,
+                        event_formats,
+                        engine,
+                        loader,
+                        skip_rounds=partitions.rounds(),
+                        only_rounds=only_rounds)
+
+    written = []
+    bad = []
+    for season_df in run:
+        # Checkpoint every season as soon as it is built
+        if len(season_df) > 0:
+            written += partitions.write(season_df)
+
+            if monitor is not None:
+                report = monitor.update(season_df)
+                bad += list(
+                    report.loc[report['Bad'], ['SeasonYear', 'RoundNumber']]
+                    .itertuples(index=False, name=None)
+                )
+
+    incomplete = [
+        (season, round_number)
+        for season, round_numbers in run.incomplete_rounds.items()
+        for round_number in round_numbers
+    ]
+
+    return {'written': written, 'incomplete': incomplete, 'bad': bad}
+
+
+def record_schedules(seasons: List[int],
+                     end_date: str,
+                     root: str,
+                     archive: Optional[SessionArchive] = None) -> None:
+    """Cache the schedule of each season next to the round partitions
+
+    The cached schedules let the plan command work out which rounds a build 
+    would pull without importing fastf1 (see metadata.py and __main__.py)
+
+    Args:
+        seasons: a list of one or more season years
+
+        end_date: the last day a session could take place on
+
+        root: the root directory of the RoundPartitions
+
+        archive: optional SessionArchive to serve the schedules from
+
+    Returns:
+        None
+
+    """
+
+    from src.model_data.metadata import write_schedules
+
+    schedules = {}
+    for season in seasons:
+        season_df = pd.DataFrame(
+            F1Season(season, pd.to_datetime(end_date), archive).full_season
+        )
+        feature_cutoff = F1Season.get_feature_cutoff(season_df)
+
+        schedules[str(season)] = [
+            {
+                'RoundNumber': int(round_number),
+                'EventName': str(event_name),
+                'EventFormat': str(event_format),
+                'FeatureCutoff': (
+                    None if pd.isna(cutoff) else cutoff.isoformat()
+                )
+            }
+            for round_number, event_name, event_format, cutoff
+            in zip(season_df['RoundNumber'],
+                   season_df['EventName'],
+                   season_df['EventFormat'],
+                   feature_cutoff)
+        ]
+
+    write_schedules(root, schedules)
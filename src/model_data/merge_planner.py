@@ -0,0 +1,218 @@
+from typing import List, Tuple
+import logging
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+# Columns that identify a driver's race weekend
+KEY_COLUMNS: List[str] = ['DriverNumber', 'EventName', 'SeasonYear']
+
+# Suffix of non-key columns that are in both joined dataframes
+RIGHT_SUFFIX: str = '_right'
+
+# Output order, so the same input always gives the same rows in the same order
+SORT_COLUMNS: List[str] = [
+    'SeasonYear',
+    'RoundNumber',
+    'DriverNumber',
+    'SessionType'
+]
+
+
+class MergePlanner:
+    """Collect per-session data parts and join them once
+
+    Each session of a season adds a part: feature parts (aggregated lap,
+    weather, control message and driver data), race result parts and sprint
+    result parts. Parts are only collected in lists while the season is
+    pulled, and each list is concatenated once in merge(). This avoids copying
+    the growing dataframes again for every session.
+
+    The join itself uses integer-coded keys. The key columns (see KEY_COLUMNS)
+    of both sides are factorized together into a single int64 key, the result
+    side is indexed on that key and the features are joined to it. Feature
+    rows without results (e.g. a driver that did not start the race) and
+    results without features are still left out of the output, but they are
+    kept in unmatched_features and unmatched_results and logged instead of
+    being dropped silently
+
+    Args:
+        key_columns: the columns to join features and results on
+
+    Returns:
+        merged_df: the joined features and results, sorted by SORT_COLUMNS
+
+    """
+
+    def __init__(self, key_columns: List[str] = KEY_COLUMNS) -> None:
+        self.key_columns: List[str] = key_columns
+        self.feature_parts: List[pd.DataFrame] = []
+        self.result_parts: List[pd.DataFrame] = []
+        self.sprint_parts: List[pd.DataFrame] = []
+        self.unmatched_features: pd.DataFrame = pd.DataFrame()
+        self.unmatched_results: pd.DataFrame = pd.DataFrame()
+
+    def add_features(self, features: pd.DataFrame) -> None:
+        self.feature_parts.append(features)
+
+    def add_results(self, results: pd.DataFrame) -> None:
+        self.result_parts.append(results)
+
+    def add_sprint_results(self, sprint_results: pd.DataFrame) -> None:
+        self.sprint_parts.append(sprint_results)
+
+    def encode_keys(self,
+                    left: pd.DataFrame,
+                    right: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """Encode the key columns of two dataframes into shared integer keys
+
+        Each key column is factorized over both dataframes at once, so equal
+        values get equal codes on both sides. Missing values get their own
+        code (0, all other codes are shifted by 1), so they can not collide
+        with other values. The codes are then combined into a single int64
+        key (mixed radix)
+
+        Args:
+            left: dataframe holding the key columns
+
+            right: dataframe holding the key columns
+
+        Returns:
+            left_key: int64 key for each row in left
+
+            right_key: int64 key for each row in right
+
+        """
+
+        left_key = np.zeros(len(left), dtype=np.int64)
+        right_key = np.zeros(len(right), dtype=np.int64)
+
+        for column in self.key_columns:
+            codes, uniques = pd.factorize(
+                np.concatenate([left[column].to_numpy(dtype=object),
+                                right[column].to_numpy(dtype=object)])
+            )
+            # Missing values are coded -1 by factorize
+            codes = codes + 1
+            radix = len(uniques) + 1
+
+            left_key = left_key * radix + codes[:len(left)]
+            right_key = right_key * radix + codes[len(left):]
+
+        return left_key, right_key
+
+    def join(self,
+             left: pd.DataFrame,
+             right: pd.DataFrame,
+             how: str,
+             right_suffix: str = RIGHT_SUFFIX
+             ) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+        """Keyed indexed join of two dataframes on the key columns
+
+        Non-key columns that are in both dataframes are kept from both sides,
+        the right column gets right_suffix (and a warning is logged)
+
+        Args:
+            left: left dataframe, key values may repeat (e.g. one row per
+                  session)
+
+            right: right dataframe, key values must be unique
+
+            how: "inner" or "left", see pandas DataFrame.join()
+
+            right_suffix: suffix of overlapping non-key columns of right
+
+        Returns:
+            joined: the joined dataframe, keeping the key columns of left
+
+            left_matched: bool mask of the left rows that have a match
+
+            right_matched: bool mask of the right rows that have a match
+
+        """
+
+        left_key, right_key = self.encode_keys(left, right)
+
+        if len(np.unique(right_key)) != len(right_key):
+            raise ValueError(
+                f"Duplicate {self.key_columns} values in the right dataframe"
+            )
+
+        right_indexed = right.drop(columns=self.key_columns)
+        right_indexed.index = right_key
+
+        left_indexed = left.copy(deep=False)
+        left_indexed.index = left_key
+
+        overlap = sorted(set(left_indexed.columns) & set(right_indexed.columns))
+        if len(overlap) > 0:
+            logger.warning(f"Columns {overlap} are on both sides of the join, "
+                           f"the right columns get the suffix {right_suffix}")
+
+        joined = left_indexed.join(right_indexed,
+                                   how=how,
+                                   lsuffix='',
+                                   rsuffix=right_suffix)
+
+        return (
+            joined.reset_index(drop=True),
+            np.isin(left_key, right_key),
+            np.isin(right_key, left_key)
+        )
+
+    def merge(self) -> pd.DataFrame:
+        """Concatenate the collected parts and join features to results
+
+        Args:
+            None
+
+        Returns:
+            merged_df: the joined features and results
+
+        """
+
+        if len(self.feature_parts) == 0 or len(self.result_parts) == 0:
+            return pd.DataFrame()
+
+        features = pd.concat(self.feature_parts, ignore_index=True)
+        results = pd.concat(self.result_parts, ignore_index=True)
+
+        # Attach sprint results to the race results of sprint events
+        if len(self.sprint_parts) > 0:
+            sprint_results = pd.concat(self.sprint_parts, ignore_index=True)
+            results, _, _ = self.join(results, sprint_results, how='left')
+
+        merged_df, features_matched, results_matched = (
+            self.join(features, results, how='inner')
+        )
+
+        # Report what the inner join leaves out
+        self.unmatched_features = (
+            features.loc[~features_matched, self.key_columns]
+            .drop_duplicates()
+            .reset_index(drop=True)
+        )
+        self.unmatched_results = (
+            results.loc[~results_matched, self.key_columns]
+            .reset_index(drop=True)
+        )
+        if len(self.unmatched_features) > 0:
+            logger.warning(f"{len(self.unmatched_features)} driver events "
+                           f"have session data but no results")
+        if len(self.unmatched_results) > 0:
+            logger.warning(f"{len(self.unmatched_results)} driver events "
+                           f"have results but no session data")
+
+        # Stable output order
+        sort_columns = [
+            column for column in SORT_COLUMNS if column in merged_df.columns
+        ]
+        merged_df = (
+            merged_df
+            .sort_values(sort_columns, kind='stable')
+            .reset_index(drop=True)
+        )
+
+        return merged_df
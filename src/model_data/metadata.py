@@ -0,0 +1,126 @@
+from typing import Dict, List, Optional, Set, Tuple
+import datetime
+import json
+import os
+
+
+# Metadata files kept in the root of the RoundPartitions. This module only
+# uses the standard library, so the metadata can be read without importing
+# pandas or fastf1 (see __main__.py)
+MANIFEST_FILE: str = 'manifest.json'
+SCHEDULES_FILE: str = 'schedules.json'
+
+
+def read_json(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def write_json(path: str, content: Dict) -> None:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    # Write then rename, so an interrupted run never leaves a broken file
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w') as json_file:
+        json.dump(content, json_file, indent=2, sort_keys=True)
+    os.replace(temporary_path, path)
+
+
+def read_manifest(root: str) -> Dict[str, Dict]:
+    """Read the manifest of the round partitions, see RoundPartitions"""
+
+    return read_json(os.path.join(root, MANIFEST_FILE))
+
+
+def built_rounds(root: str) -> Set[Tuple[int, int]]:
+    return {
+        (partition['SeasonYear'], partition['RoundNumber'])
+        for partition in read_manifest(root).values()
+    }
+
+
+def read_schedules(root: str) -> Dict[str, List[Dict]]:
+    """Read the cached schedule of every season
+
+    Args:
+        root: the root directory of the RoundPartitions
+
+    Returns:
+        schedules: season (as a string) to a list of events, each with
+                   RoundNumber, EventName, EventFormat and FeatureCutoff (ISO
+                   date of the last feature session)
+
+    """
+
+    return read_json(os.path.join(root, SCHEDULES_FILE))
+
+
+def write_schedules(root: str, schedules: Dict[str, List[Dict]]) -> None:
+    # Seasons that are not passed in are kept
+    all_schedules = read_schedules(root)
+    all_schedules.update(schedules)
+
+    write_json(os.path.join(root, SCHEDULES_FILE), all_schedules)
+
+
+def plan_rounds(root: str,
+                seasons: List[int],
+                end_date: str,
+                event_formats: List[str],
+                quarantined: Optional[List[Tuple[int, int]]] = None
+                ) -> Dict[int, Dict]:
+    """Work out what a build would do from the cached metadata only
+
+    A round is built when its event format is requested, its last feature
+    session is before end_date (same cutoff as F1Season) and it is not in the
+    partitions yet. Rounds with a quarantined session are retried
+
+    Args:
+        root: the root directory of the RoundPartitions
+
+        seasons: seasons of the build
+
+        end_date: the last day a session could take place on, e.g. 2023-07-28
+
+        event_formats: the EventFormat values of the build
+
+        quarantined: (SeasonYear, RoundNumber) of quarantined rounds, see
+                     SessionQuarantine.rounds()
+
+    Returns:
+        plan: per season whether the schedule is cached and the built, to
+              build and to retry round numbers
+
+    """
+
+    end_date = datetime.datetime.fromisoformat(end_date)
+    schedules = read_schedules(root)
+    built = built_rounds(root)
+    quarantined = set(quarantined) if quarantined else set()
+
+    plan = {}
+    for season in seasons:
+        events = schedules.get(str(season))
+        valid_rounds = [
+            event['RoundNumber'] for event in (events or [])
+            if event['EventFormat'] in event_formats
+            and event['FeatureCutoff'] is not None
+            and datetime.datetime.fromisoformat(event['FeatureCutoff']) < end_date
+        ]
+
+        plan[season] = {
+            'schedule_cached': events is not None,
+            'built': sorted(round_number for built_season, round_number
+                            in built if built_season == season),
+            'build': [
+                round_number for round_number in valid_rounds
+                if (season, round_number) not in built
+            ],
+            'retry': sorted(round_number for quarantined_season, round_number
+                            in quarantined if quarantined_season == season)
+        }
+
+    return plan
@@ -0,0 +1,500 @@
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+# Quantiles kept per round and numeric column (the quantile sketch)
+SKETCH_QUANTILES: np.ndarray = np.linspace(0, 1, 21)
+
+# Bins of the drift score, baseline deciles
+DRIFT_QUANTILES: np.ndarray = np.linspace(0, 1, 11)[1:-1]
+
+# Categorical columns whose unseen categories are flagged. Other categorical
+# columns (e.g. EventName, Driver) get new values in normal seasons
+CATEGORICAL_DRIFT_COLUMNS: List[str] = ['SessionType', 'Category']
+
+# Column of the circuit, numeric drift is measured against earlier rounds at
+# the same circuit (lap times, speeds and weather depend on the circuit)
+CIRCUIT_COLUMN: str = 'Location'
+
+# Identifiers and response variables, not checked by default
+IGNORE_COLUMNS: List[str] = [
+    'SeasonYear',
+    'RoundNumber',
+    'DriverNumber',
+    'Points',
+    'Position',
+    'SprintPoints',
+    'SprintPosition'
+]
+
+
+def is_numeric_column(values: pd.Series) -> bool:
+    return (
+        (pd.api.types.is_numeric_dtype(values) and
+         not pd.api.types.is_bool_dtype(values)) or
+        pd.api.types.is_timedelta64_dtype(values)
+    )
+
+
+def to_numbers(values: pd.Series) -> np.ndarray:
+    if pd.api.types.is_timedelta64_dtype(values):
+        values = values.dt.total_seconds()
+
+    return values.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def summarize_round(round_df: pd.DataFrame) -> Dict[str, Any]:
+    """Summarize every column of one round
+
+    Args:
+        round_df: model data of one round
+
+    Returns:
+        summary: Rows, the round's circuit (CIRCUIT_COLUMN, None when not in
+                 the data) and per column the Kind (numeric or categorical),
+                 Count, Nulls and either Quantiles (numeric) or Categories
+                 (categorical value counts)
+
+    """
+
+    columns = {}
+    for column in round_df.columns:
+        values = round_df[column]
+        nulls = int(values.isna().sum())
+
+        if is_numeric_column(values):
+            numbers = to_numbers(values)
+            numbers = numbers[~np.isnan(numbers)]
+            columns[column] = {
+                'Kind': 'numeric',
+                'Count': int(len(numbers)),
+                'Nulls': nulls,
+                'Quantiles': (
+                    np.quantile(numbers, SKETCH_QUANTILES).tolist()
+                    if len(numbers) else []
+                )
+            }
+        else:
+            columns[column] = {
+                'Kind': 'categorical',
+                'Count': int(len(values) - nulls),
+                'Nulls': nulls,
+                'Categories': {
+                    str(value): int(count)
+                    for value, count in values.dropna().astype(str)
+                    .value_counts().items()
+                }
+            }
+
+    circuit = None
+    if CIRCUIT_COLUMN in round_df.columns:
+        circuits = round_df[CIRCUIT_COLUMN].dropna().astype(str)
+        if len(circuits) > 0:
+            circuit = circuits.mode().iloc[0]
+
+    return {'Rows': int(len(round_df)), 'Circuit': circuit, 'Columns': columns}
+
+
+def merge_sketches(sketches: List[Tuple[List[float], int]]) -> Tuple[np.ndarray,
+                                                                      np.ndarray]:
+    """Merge quantile sketches into one approximate distribution
+
+    Each sketch point stands for an equal share of its round's values
+
+    Args:
+        sketches: (quantiles, count) of each round
+
+    Returns:
+        values: sorted values of the merged sketch
+
+        cumulative: cumulative probability at each value
+
+    """
+
+    values = np.concatenate([
+        np.asarray(quantiles, dtype=np.float64)
+        for quantiles, count in sketches if count > 0
+    ])
+    weights = np.concatenate([
+        np.full(len(quantiles), count / len(quantiles))
+        for quantiles, count in sketches if count > 0
+    ])
+
+    order = np.argsort(values, kind='stable')
+    values = values[order]
+    cumulative = np.cumsum(weights[order]) / weights.sum()
+
+    return values, cumulative
+
+
+def population_stability_index(expected: np.ndarray,
+                               actual: np.ndarray) -> float:
+    expected = np.clip(expected, 1e-4, None)
+    actual = np.clip(actual, 1e-4, None)
+
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+class DataMonitor:
+    """Data-quality and drift monitor, updated incrementally per round
+
+    Each round of the model data (e.g. every round written by backfill()) is
+    summarized once: per column the count, null count and either a quantile
+    sketch (numeric) or the category counts (categorical), see
+    summarize_round(). Summaries are stored per round in a JSON file and are
+    never recomputed, so updating the monitor only costs a pass over the new
+    rounds.
+
+    A baseline (e.g. the training rounds of the production model) is merged
+    from the stored summaries, and every new round is checked against it:
+        1) Schema: columns that are missing, new or changed kind
+        2) Nulls: null rate increase above null_rate_increase
+        3) Unseen categories: share of unseen values above unseen_threshold,
+           for CATEGORICAL_DRIFT_COLUMNS only
+        4) Numeric drift: population stability index (PSI) over the baseline
+           deciles above the circuit's PSI threshold
+
+    Lap and sector times, speeds and weather depend on the circuit, so the
+    numeric drift of a round is measured against the baseline rounds at the
+    same circuit (CIRCUIT_COLUMN). A circuit without baseline rounds is
+    compared to the whole baseline. Some circuits change more between
+    seasons than others (e.g. resurfacing, or a street circuit with a new
+    layout), so the PSI threshold can be set per circuit with
+    circuit_psi_thresholds. Checks 1 to 3 give quality flags (Flags), check
+    4 gives drift flags (DriftFlags), kept apart so drift can be handled
+    differently (the IncrementalRetrainer retrains from scratch on drift).
+
+    Rounds with any flag, quality or drift, are bad rounds, see bad_rounds()
+
+    Args:
+        path: location of the monitor JSON file
+
+        psi_threshold: PSI that flags a numeric column
+
+        circuit_psi_thresholds: optional PSI threshold per circuit (value of
+                                CIRCUIT_COLUMN), overrides psi_threshold
+
+        null_rate_increase: increase of the null rate that flags a column
+
+        unseen_threshold: share of unseen categories that flags a column
+
+        ignore_columns: columns that are not checked. Defaults to
+                        IGNORE_COLUMNS
+
+    Returns:
+        per round checks, see update() and report()
+
+    """
+
+    def __init__(self,
+                 path: str,
+                 psi_threshold: float = 0.25,
+                 circuit_psi_thresholds: Optional[Dict[str, float]] = None,
+                 null_rate_increase: float = 0.2,
+                 unseen_threshold: float = 0.2,
+                 ignore_columns: Optional[List[str]] = None) -> None:
+        self.path: str = path
+        self.psi_threshold: float = psi_threshold
+        self.circuit_psi_thresholds: Dict[str, float] = (
+            circuit_psi_thresholds if circuit_psi_thresholds else {}
+        )
+        self.null_rate_increase: float = null_rate_increase
+        self.unseen_threshold: float = unseen_threshold
+        self.ignore_columns: List[str] = (
+            ignore_columns if ignore_columns is not None else IGNORE_COLUMNS
+        )
+        self.state: Dict[str, Any] = self.read()
+
+    def read(self) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            return {'rounds': {}, 'baseline': []}
+
+        with open(self.path) as monitor_file:
+            return json.load(monitor_file)
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w') as monitor_file:
+            json.dump(self.state, monitor_file)
+        os.replace(temporary_path, self.path)
+
+    @staticmethod
+    def round_key(season: int, round_number: int) -> str:
+        return f'{int(season)}-{int(round_number):02d}'
+
+    def set_baseline(self,
+                     rounds: Optional[List[Tuple[int, int]]] = None) -> None:
+        """Set the baseline rounds, e.g. the training rounds of a model
+
+        Args:
+            rounds: (SeasonYear, RoundNumber) tuples. Defaults to every
+                    summarized round
+
+        Returns:
+            None
+
+        """
+
+        self.state['baseline'] = (
+            [self.round_key(*baseline_round) for baseline_round in rounds]
+            if rounds is not None else sorted(self.state['rounds'])
+        )
+        self.save()
+
+    def circuit_psi_threshold(self, circuit: Optional[str]) -> float:
+        return self.circuit_psi_thresholds.get(circuit, self.psi_threshold)
+
+    def baseline(self,
+                 circuit: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Merge the summaries of the baseline rounds, per column
+
+        Args:
+            circuit: optional circuit, only the baseline rounds at this
+                     circuit are merged
+
+        Returns:
+            baseline: merged column summaries, empty without baseline rounds
+
+        """
+
+        summaries = [
+            self.state['rounds'][key]['Summary']
+            for key in self.state['baseline'] if key in self.state['rounds']
+        ]
+        if circuit is not None:
+            summaries = [summary for summary in summaries
+                         if summary.get('Circuit') == circuit]
+
+        merged = {}
+        for summary in summaries:
+            for column, column_summary in summary['Columns'].items():
+                merged_column = merged.setdefault(column, {
+                    'Kind': column_summary['Kind'],
+                    'Count': 0,
+                    'Nulls': 0,
+                    'Sketches': [],
+                    'Categories': {}
+                })
+                merged_column['Count'] += column_summary['Count']
+                merged_column['Nulls'] += column_summary['Nulls']
+                if column_summary['Kind'] == 'numeric':
+                    merged_column['Sketches'].append(
+                        (column_summary['Quantiles'], column_summary['Count'])
+                    )
+                else:
+                    for value, count in column_summary['Categories'].items():
+                        merged_column['Categories'][value] = (
+                            merged_column['Categories'].get(value, 0) + count
+                        )
+
+        return merged
+
+    def check_round(self,
+                    round_df: pd.DataFrame,
+                    summary: Dict[str, Any],
+                    baseline: Dict[str, Dict[str, Any]],
+                    drift_baseline: Optional[Dict[str, Dict[str, Any]]] = None
+                    ) -> Tuple[List[str], List[str], Dict[str, float]]:
+        """Check one round against the baseline
+
+        Args:
+            round_df: model data of the round
+
+            summary: the round's summary, see summarize_round()
+
+            baseline: merged baseline, see baseline()
+
+            drift_baseline: optional baseline of the numeric drift, e.g. the
+                            baseline at the round's circuit. Defaults to
+                            baseline
+
+        Returns:
+            flags: description of every failed quality check
+
+            drift_flags: description of every numeric drift above the PSI
+                         threshold of the round's circuit
+
+            drift: PSI of each numeric column
+
+        """
+
+        flags = []
+        drift_flags = []
+        drift = {}
+        if not baseline:
+            return flags, drift_flags, drift
+        if not drift_baseline:
+            drift_baseline = baseline
+        psi_threshold = self.circuit_psi_threshold(summary.get('Circuit'))
+
+        columns = {
+            column: column_summary
+            for column, column_summary in summary['Columns'].items()
+            if column not in self.ignore_columns
+        }
+        baseline_columns = [column for column in baseline
+                            if column not in self.ignore_columns]
+
+        for column in sorted(set(baseline_columns) - set(columns)):
+            flags.append(f'missing column {column}')
+        for column in sorted(set(columns) - set(baseline_columns)):
+            flags.append(f'new column {column}')
+
+        for column in sorted(set(columns) & set(baseline_columns)):
+            column_summary = columns[column]
+            baseline_column = baseline[column]
+
+            if column_summary['Kind'] != baseline_column['Kind']:
+                flags.append(f'{column} changed from {baseline_column["Kind"]} '
+                             f'to {column_summary["Kind"]}')
+                continue
+
+            rows = column_summary['Count'] + column_summary['Nulls']
+            baseline_rows = baseline_column['Count'] + baseline_column['Nulls']
+            null_rate = column_summary['Nulls'] / rows if rows else 0
+            baseline_null_rate = (
+                baseline_column['Nulls'] / baseline_rows if baseline_rows else 0
+            )
+            if null_rate - baseline_null_rate > self.null_rate_increase:
+                flags.append(f'{column} null rate {null_rate:.2f} '
+                             f'(baseline {baseline_null_rate:.2f})')
+
+            drift_column = drift_baseline.get(column, baseline_column)
+            if (column_summary['Kind'] == 'numeric' and
+                    drift_column['Kind'] == 'numeric' and
+                    column_summary['Count'] > 0 and
+                    drift_column['Count'] > 0):
+                values, cumulative = (
+                    merge_sketches(drift_column['Sketches'])
+                )
+                edges = np.unique(np.interp(DRIFT_QUANTILES,
+                                            cumulative,
+                                            values))
+                expected = np.diff(np.concatenate([
+                    [0], np.interp(edges, values, cumulative), [1]
+                ]))
+
+                numbers = to_numbers(round_df[column])
+                numbers = numbers[~np.isnan(numbers)]
+                actual = (
+                    np.bincount(np.searchsorted(edges, numbers, side='right'),
+                                minlength=len(edges) + 1) / len(numbers)
+                )
+
+                drift[column] = population_stability_index(expected, actual)
+                if drift[column] > psi_threshold:
+                    drift_flags.append(f'{column} drift PSI '
+                                       f'{drift[column]:.2f}')
+
+            elif (column_summary['Kind'] == 'categorical' and
+                    column in CATEGORICAL_DRIFT_COLUMNS and
+                    column_summary['Count'] > 0):
+                unseen = sum(
+                    count for value, count
+                    in column_summary['Categories'].items()
+                    if value not in baseline_column['Categories']
+                )
+                unseen_rate = unseen / column_summary['Count']
+                if unseen_rate > self.unseen_threshold:
+                    flags.append(f'{column} unseen categories {unseen_rate:.2f}')
+
+        return flags, drift_flags, drift
+
+    def update(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Summarize and check the rounds of new model data
+
+        Rounds that are already summarized are replaced. When no baseline is
+        set yet, the first rounds become the baseline
+
+        Args:
+            data: model data with SeasonYear and RoundNumber columns
+
+        Returns:
+            report: one row per updated round, see report()
+
+        """
+
+        baseline = self.baseline()
+        circuit_baselines: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        updated = []
+
+        for (season, round_number), round_df in (
+                data.groupby(['SeasonYear', 'RoundNumber'], sort=True)):
+            summary = summarize_round(round_df)
+
+            circuit = summary['Circuit']
+            if circuit is not None and circuit not in circuit_baselines:
+                circuit_baselines[circuit] = self.baseline(circuit)
+
+            flags, drift_flags, drift = self.check_round(
+                round_df,
+                summary,
+                baseline,
+                circuit_baselines.get(circuit)
+            )
+
+            key = self.round_key(season, round_number)
+            self.state['rounds'][key] = {
+                'SeasonYear': int(season),
+                'RoundNumber': int(round_number),
+                'Summary': summary,
+                'Flags': flags,
+                'DriftFlags': drift_flags,
+                'Drift': drift
+            }
+            updated.append(key)
+
+        if not self.state['baseline']:
+            self.state['baseline'] = updated
+        self.save()
+
+        return self.report(updated)
+
+    def report(self, keys: Optional[List[str]] = None) -> pd.DataFrame:
+        """Checks of every (or the given) round
+
+        Args:
+            keys: optional round keys, e.g. "2023-05"
+
+        Returns:
+            report: SeasonYear, RoundNumber, Rows, MaxPSI, Flags,
+                    DriftFlags and Bad per round
+
+        """
+
+        keys = sorted(keys if keys is not None else self.state['rounds'])
+
+        return pd.DataFrame(
+            [{'SeasonYear': self.state['rounds'][key]['SeasonYear'],
+              'RoundNumber': self.state['rounds'][key]['RoundNumber'],
+              'Rows': self.state['rounds'][key]['Summary']['Rows'],
+              'MaxPSI': max(self.state['rounds'][key]['Drift'].values(),
+                            default=np.nan),
+              'Flags': self.state['rounds'][key]['Flags'],
+              'DriftFlags': self.state['rounds'][key].get('DriftFlags', []),
+              'Bad': self.is_bad(self.state['rounds'][key])}
+             for key in keys],
+            columns=['SeasonYear', 'RoundNumber', 'Rows', 'MaxPSI', 'Flags',
+                     'DriftFlags', 'Bad']
+        )
+
+    @staticmethod
+    def is_bad(round_state: Dict[str, Any], drift: bool = True) -> bool:
+        return bool(
+            round_state['Flags'] or
+            (drift and round_state.get('DriftFlags'))
+        )
+
+    def bad_rounds(self, drift: bool = True) -> List[Tuple[int, int]]:
+        """Rounds with a quality flag (or a drift flag when drift is True)"""
+
+        return sorted(
+            (summary['SeasonYear'], summary['RoundNumber'])
+            for summary in self.state['rounds'].values()
+            if self.is_bad(summary, drift)
+        )
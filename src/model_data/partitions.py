@@ -0,0 +1,155 @@
+from typing import Dict, List, Optional, Tuple
+import os
+import pandas as pd
+
+from src.model_data.metadata import MANIFEST_FILE, read_manifest, write_json
+
+
+# Columns that identify a partition
+PARTITION_COLUMNS: List[str] = ['SeasonYear', 'RoundNumber']
+
+
+class RoundPartitions:
+    """Model data stored as one partition per season round
+
+    Each round of the model data (as pulled by RunAllMethods) is written to
+    its own parquet file, so a round can be read back on its own and rounds
+    that are already built do not need to be pulled again. A manifest with
+    the rows and events of each partition is kept next to the files and can
+    be read without opening any partition.
+
+    Layout:
+        <root>/manifest.json
+        <root>/season=<year>/round=<round>.parquet
+
+    Args:
+        root: the directory holding the partitions. Created if it does not
+              exist
+
+    Returns:
+        model data for the requested rounds, see read()
+
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root: str = root
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.root, MANIFEST_FILE)
+
+    def partition_path(self, season: int, round_number: int) -> str:
+        return os.path.join(self.root,
+                            f'season={int(season)}',
+                            f'round={int(round_number):02d}.parquet')
+
+    def manifest(self) -> Dict[str, Dict]:
+        return read_manifest(self.root)
+
+    def rounds(self) -> List[Tuple[int, int]]:
+        """Obtain the (season, round) of every stored partition, in order
+
+        Args:
+            None
+
+        Returns:
+            rounds: sorted list of (SeasonYear, RoundNumber) tuples
+
+        """
+
+        return sorted(
+            (partition['SeasonYear'], partition['RoundNumber'])
+            for partition in self.manifest().values()
+        )
+
+    def write(self, data: pd.DataFrame) -> List[Tuple[int, int]]:
+        """Write model data, one partition per season round
+
+        Partitions that already exist for a round are replaced
+
+        Args:
+            data: model data with SeasonYear and RoundNumber columns
+
+        Returns:
+            written: the (SeasonYear, RoundNumber) of the written partitions
+
+        """
+
+        manifest = self.manifest()
+        written = []
+
+        for (season, round_number), round_df in (
+                data.groupby(PARTITION_COLUMNS, sort=True)):
+            path = self.partition_path(season, round_number)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Session columns can be object dtype after the row-wise weather 
+            # concat, store them with their actual types
+            (
+                round_df.infer_objects()
+                .reset_index(drop=True)
+                .to_parquet(path, index=False)
+            )
+
+            manifest[f'{int(season)}-{int(round_number):02d}'] = {
+                'SeasonYear': int(season),
+                'RoundNumber': int(round_number),
+                'EventName': str(round_df['EventName'].iloc[0]),
+                'Rows': int(len(round_df))
+            }
+            written.append((int(season), int(round_number)))
+
+        write_json(self.manifest_path, manifest)
+
+        return written
+
+    def read(self,
+             rounds: Optional[List[Tuple[int, int]]] = None,
+             columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Read the model data of the requested rounds
+
+        Args:
+            rounds: (SeasonYear, RoundNumber) tuples to read. Defaults to all
+                    stored rounds
+
+            columns: optional subset of columns to read
+
+        Returns:
+            data: model data of the rounds, in round order
+
+        """
+
+        rounds = sorted(rounds) if rounds is not None else self.rounds()
+        if len(rounds) == 0:
+            return pd.DataFrame(columns=columns)
+
+        return pd.concat(
+            [pd.read_parquet(self.partition_path(season, round_number),
+                             columns=columns)
+             for season, round_number in rounds],
+            ignore_index=True
+        )
+
+    def read_before(self,
+                    season: int,
+                    round_number: int,
+                    columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Read the model data of every round before the given round
+
+        Args:
+            season: season of the round
+
+            round_number: round number of the round
+
+            columns: optional subset of columns to read
+
+        Returns:
+            data: model data of all earlier rounds
+
+        """
+
+        earlier_rounds = [
+            stored_round for stored_round in self.rounds()
+            if stored_round < (season, round_number)
+        ]
+
+        return self.read(earlier_rounds, columns)
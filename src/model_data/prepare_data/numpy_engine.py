@@ -0,0 +1,549 @@
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+from fastf1.core import Session
+
+from src.model_data.prepare_data.lap_data import prepare_lap_data
+from src.model_data.prepare_data.weather_data import Weather
+from src.model_data.prepare_data.driver_data import prepare_driver_data
+from src.model_data.prepare_data.control_message_data import (
+    prepare_control_message_data
+)
+
+
+# Same aggregations as prepare_lap_data() in lap_data.py
+LAP_TIME_COLUMNS: List[str] = [
+    'LapTime',
+    'Sector1Time',
+    'Sector2Time',
+    'Sector3Time'
+]
+LAP_SPEED_COLUMNS: List[str] = ['SpeedI1', 'SpeedI2', 'SpeedFL', 'SpeedST']
+
+# Same aggregations as Weather in weather_data.py
+WEATHER_COLUMNS: List[str] = [
+    'AirTemp',
+    'Humidity',
+    'Pressure',
+    'TrackTemp',
+    'WindDirection',
+    'WindSpeed'
+]
+AGGREGATIONS: List[str] = ['min', 'max', 'mean', 'std']
+
+
+def segment_aggregates(values: np.ndarray,
+                       starts: np.ndarray,
+                       ends: np.ndarray) -> Dict[str, np.ndarray]:
+    """Aggregate the rows of each [start, end) segment of a 2d array
+
+    Missing values (NaN) are skipped, same as pandas. Segments may overlap
+    and may be empty (start == end), in which case every aggregate is NaN.
+    min and max use ufunc.reduceat on interleaved start/end indices, mean and
+    std use prefix sums of the values centered on the column means (which
+    keeps the sums of squares accurate)
+
+    Args:
+        values: float array of shape (rows, columns)
+
+        starts: first row of each segment
+
+        ends: one past the last row of each segment
+
+    Returns:
+        aggregates: count, min, max, mean and std (ddof=1), each of shape
+                    (segments, columns)
+
+    """
+
+    is_valid = ~np.isnan(values)
+
+    # Sentinel row, so end indices equal to the number of rows are valid
+    def padded(fill_value: float) -> np.ndarray:
+        filled = np.where(is_valid, values, fill_value)
+        return np.vstack([filled, np.full((1, values.shape[1]), fill_value)])
+
+    interleaved = np.empty(2 * len(starts), dtype=np.int64)
+    interleaved[0::2] = starts
+    interleaved[1::2] = ends
+
+    minimum = np.minimum.reduceat(padded(np.inf), interleaved, axis=0)[0::2]
+    maximum = np.maximum.reduceat(padded(-np.inf), interleaved, axis=0)[0::2]
+
+    # Prefix sums, row i holds the sum of rows [0, i)
+    def prefix(array: np.ndarray) -> np.ndarray:
+        return np.vstack([np.zeros((1, array.shape[1])),
+                          np.cumsum(array, axis=0)])
+
+    count_prefix = prefix(is_valid.astype(np.float64))
+    count = count_prefix[ends] - count_prefix[starts]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        valid_total = is_valid.sum(axis=0)
+        center = (
+            np.where(is_valid, values, 0).sum(axis=0) /
+            np.maximum(valid_total, 1)
+        )
+        centered = np.where(is_valid, values - center, 0)
+        sum_prefix = prefix(centered)
+        square_prefix = prefix(centered ** 2)
+        centered_sum = sum_prefix[ends] - sum_prefix[starts]
+        square_sum = square_prefix[ends] - square_prefix[starts]
+
+        mean = centered_sum / count + center
+        variance = (square_sum - centered_sum ** 2 / count) / (count - 1)
+        std = np.sqrt(np.maximum(variance, 0))
+
+    is_empty = count == 0
+
+    return {
+        'count': count.astype(np.int64),
+        'min': np.where(is_empty, np.nan, minimum),
+        'max': np.where(is_empty, np.nan, maximum),
+        'mean': np.where(is_empty, np.nan, mean),
+        'std': np.where(count < 2, np.nan, std)
+    }
+
+
+def prepare_lap_data_numpy(data: Session) -> pd.DataFrame:
+    """NumPy engine version of prepare_lap_data() in lap_data.py
+
+    Laps are sorted once by driver and lap number, and every aggregate is
+    computed for all drivers at once on the sorted segments. Returns the same
+    columns, in the same order, as the pandas engine
+
+    Args:
+        data: passed in as a fastf1 Session type
+
+    Returns:
+        aggregated_lap_data: data for each driver within a session with their
+                             laps information. Returns a pandas dataframe
+
+    """
+
+    lap_data = data.laps
+
+    driver = lap_data['Driver'].to_numpy(dtype=str)
+    driver_number = lap_data['DriverNumber'].to_numpy(dtype=str)
+    lap_number = lap_data['LapNumber'].to_numpy(dtype=np.float64)
+
+    # Same row order as groupby(['Driver', 'DriverNumber']) after sorting by
+    # DriverNumber and LapNumber
+    order = np.lexsort((lap_number, driver_number, driver))
+    driver = driver[order]
+    driver_number = driver_number[order]
+
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = (
+        (driver[1:] != driver[:-1]) | (driver_number[1:] != driver_number[:-1])
+    )
+    starts = np.flatnonzero(new_group)
+    ends = np.append(starts[1:], len(order))
+
+    aggregated_lap_data = pd.DataFrame({
+        'Driver': lap_data['Driver'].to_numpy()[order][starts],
+        'DriverNumber': lap_data['DriverNumber'].to_numpy()[order][starts]
+    })
+
+    # Session time of the first and last lap, kept as timedelta
+    time_ns = lap_data['Time'].to_numpy(dtype='timedelta64[ns]')[order]
+    time_values = np.where(np.isnat(time_ns),
+                           np.nan,
+                           time_ns.astype(np.int64).astype(np.float64))
+    time_aggregates = segment_aggregates(time_values[:, None], starts, ends)
+    for aggregation in ['min', 'max']:
+        aggregated_lap_data[f'Time_{aggregation}'] = pd.to_timedelta(
+            time_aggregates[aggregation][:, 0], unit='ns'
+        )
+
+    # Lap/sector times in seconds and speeds, all columns at once
+    value_columns = (
+        [f'{column}Seconds' for column in LAP_TIME_COLUMNS] + LAP_SPEED_COLUMNS
+    )
+    values = np.column_stack(
+        [lap_data[column].dt.total_seconds().to_numpy(dtype=np.float64)
+         for column in LAP_TIME_COLUMNS] +
+        [lap_data[column].to_numpy(dtype=np.float64)
+         for column in LAP_SPEED_COLUMNS]
+    )[order]
+    aggregates = segment_aggregates(values, starts, ends)
+
+    for index, column in enumerate(value_columns):
+        for aggregation in AGGREGATIONS:
+            aggregated_lap_data[f'{column}_{aggregation}'] = (
+                aggregates[aggregation][:, index]
+            )
+        if column == 'LapTimeSeconds':
+            aggregated_lap_data[f'{column}_count'] = (
+                aggregates['count'][:, index]
+            )
+
+    # Lap number (position in the driver's laps) of the last personal best
+    is_personal_best = (
+        (lap_data['IsPersonalBest'] == True).to_numpy(dtype=bool)[order]
+    )
+    position = np.arange(len(order)) - np.repeat(starts, ends - starts) + 1
+    aggregated_lap_data['IsPersonalBest_pr_lap'] = np.maximum.reduceat(
+        np.where(is_personal_best, position, -1), starts
+    ) if len(starts) else np.array([], dtype=np.int64)
+
+    return aggregated_lap_data
+
+
+def prepare_weather_data_numpy(lap_data_prepared: pd.DataFrame,
+                               data: Session) -> pd.DataFrame:
+    """NumPy engine version of the Weather iterator in weather_data.py
+
+    Each driver's session window [Time_min, Time_max] is located in the
+    sorted weather samples with a binary search, and the weather aggregates
+    of all drivers are computed at once on those windows (see
+    segment_aggregates()). Returns the same rows and columns as
+    concatenating every row of the Weather iterator
+
+    Args:
+        lap_data_prepared: the already prepared lap data
+
+        data: passed in as a fastf1 Session type
+
+    Returns:
+        full_dataset: lap data with the weather aggregates of each driver
+
+    """
+
+    weather_data = data.weather_data
+    weather_time = weather_data['Time'].to_numpy(dtype='timedelta64[ns]')
+    order = np.argsort(weather_time, kind='stable')
+    weather_time = weather_time[order]
+    values = (
+        weather_data[WEATHER_COLUMNS].to_numpy(dtype=np.float64)[order]
+    )
+
+    start_time = lap_data_prepared['Time_min'].to_numpy(
+        dtype='timedelta64[ns]'
+    )
+    end_time = lap_data_prepared['Time_max'].to_numpy(
+        dtype='timedelta64[ns]'
+    )
+
+    # Inclusive window, same as '@start_time <= Time <= @end_time'
+    starts = np.searchsorted(weather_time, start_time, side='left')
+    ends = np.searchsorted(weather_time, end_time, side='right')
+    has_window = ~(np.isnat(start_time) | np.isnat(end_time))
+    ends = np.where(has_window, np.maximum(ends, starts), starts)
+
+    aggregates = segment_aggregates(values, starts, ends)
+    weather_df = pd.DataFrame({
+        f'{column}_{aggregation}': aggregates[aggregation][:, index]
+        for index, column in enumerate(WEATHER_COLUMNS)
+        for aggregation in AGGREGATIONS
+    }, index=lap_data_prepared.index)
+
+    full_dataset = pd.concat([lap_data_prepared, weather_df], axis=1)
+
+    # Keep identifier name and datatype consistent with rest of data
+    full_dataset['DriverNumber'] = full_dataset['DriverNumber'].astype(int)
+
+    return full_dataset
+
+
+def prepare_driver_data_numpy(data: Session) -> pd.DataFrame:
+    """NumPy engine version of prepare_driver_data() in driver_data.py
+
+    Selects the driver rows from the session results in one step instead of
+    one get_driver() call and concat per driver. Same row order as the
+    pandas engine (reverse of data.drivers)
+
+    Args:
+        data: passed in as a fastf1 Session type
+
+    Returns:
+        full_driver_data: DriverNumber, TeamId and CountryCode per driver
+
+    """
+
+    results = data.results.set_index('DriverNumber', drop=False)
+    full_driver_data = (
+        results.loc[list(data.drivers)[::-1],
+                    ['DriverNumber', 'TeamId', 'CountryCode']]
+        .astype(object)
+    )
+
+    # Keep identifier name and datatype consistent with rest of data
+    full_driver_data['DriverNumber'] = (
+        full_driver_data['DriverNumber'].astype(int)
+    )
+
+    return full_driver_data.reset_index(drop=True)
+
+
+def prepare_control_message_data_numpy(data: Session) -> pd.DataFrame:
+    """NumPy engine version of prepare_control_message_data()
+
+    Args:
+        data: passed in as a fastf1 Session type
+
+    Returns:
+        racer_flags: DriverNumber and Category of every control message that
+                     involves a driver, in message order
+
+    """
+
+    control_message_data = data.race_control_messages
+    racing_number = control_message_data['RacingNumber'].to_numpy(
+        dtype=object
+    )
+    involves_racer = ~pd.isna(racing_number)
+
+    # Keep identifier name and datatype consistent with rest of data
+    return pd.DataFrame({
+        'DriverNumber': racing_number[involves_racer].astype(int),
+        'Category': (
+            control_message_data['Category'].to_numpy(dtype=object)
+            [involves_racer]
+        )
+    })
+
+
+def combine_session_data(full_dataset: pd.DataFrame,
+                         racer_flags: pd.DataFrame,
+                         driver_data: pd.DataFrame) -> pd.DataFrame:
+    """Combine the prepared data of a session into one row per driver
+
+    Pandas engine: merge the control messages, keep the most recent message
+    of each driver with a groupby over every other column, then merge the
+    driver data. The groupby leaves out drivers with a missing value in any
+    lap/weather column and sorts the rows by driver
+
+    Args:
+        full_dataset: lap data with weather aggregates per driver
+
+        racer_flags: control messages per driver
+
+        driver_data: driver information per driver
+
+    Returns:
+        updated_full_dataset: one row per driver with the most recent control
+                              message Category and the driver information
+
+    """
+
+    # Merge control message data with full dataset
+    updated_full_dataset = (
+        pd.merge(full_dataset,
+                 racer_flags,
+                 on='DriverNumber',
+                 how='left')
+    )
+
+    # Only include the most recent control message in the case the
+    # driver has more than 1
+    columns_to_group = (
+        [column for column in updated_full_dataset.columns
+         if column != 'Category']
+    )
+
+    updated_full_dataset = (
+        updated_full_dataset
+        .groupby(columns_to_group)['Category']
+        .last()
+        .reset_index()
+    )
+
+    # Merge driver data
+    return pd.merge(updated_full_dataset,
+                    driver_data,
+                    on='DriverNumber',
+                    how='left')
+
+
+def sorted_lookup(sorted_keys: np.ndarray,
+                  keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Locate keys in sorted unique keys with a binary search
+
+    Args:
+        sorted_keys: sorted, unique keys
+
+        keys: keys to locate
+
+    Returns:
+        position: index of each key in sorted_keys (0 when not found)
+
+        found: whether each key is in sorted_keys
+
+    """
+
+    if len(sorted_keys) == 0:
+        return (np.zeros(len(keys), dtype=np.int64),
+                np.zeros(len(keys), dtype=bool))
+
+    position = np.clip(np.searchsorted(sorted_keys, keys),
+                       0,
+                       len(sorted_keys) - 1)
+
+    return position, sorted_keys[position] == keys
+
+
+def combine_session_data_numpy(full_dataset: pd.DataFrame,
+                               racer_flags: pd.DataFrame,
+                               driver_data: pd.DataFrame) -> pd.DataFrame:
+    """NumPy engine version of combine_session_data()
+
+    Every row of the full dataset is one driver, so the groupby over every
+    other column is a row filter and sort: drivers with a missing value are
+    left out (same as groupby's dropna), the rest are sorted by Driver and
+    DriverNumber. The most recent non-missing Category of each driver is
+    found with one np.unique over the reversed messages, and the driver
+    data is joined with a binary search instead of a merge
+
+    Args:
+        full_dataset: lap data with weather aggregates per driver
+
+        racer_flags: control messages per driver
+
+        driver_data: driver information per driver
+
+    Returns:
+        updated_full_dataset: same rows and columns as combine_session_data()
+
+    """
+
+    # Groupby keys with a missing value are dropped
+    is_complete = ~full_dataset.isna().to_numpy().any(axis=1)
+    complete_rows = np.flatnonzero(is_complete)
+    order = complete_rows[np.lexsort((
+        full_dataset['DriverNumber'].to_numpy()[complete_rows],
+        full_dataset['Driver'].to_numpy(dtype=str)[complete_rows]
+    ))]
+    updated_full_dataset = (
+        full_dataset.iloc[order].reset_index(drop=True)
+    )
+    driver_number = updated_full_dataset['DriverNumber'].to_numpy(
+        dtype=np.int64
+    )
+
+    # Last non-missing message per driver: first occurrence when reversed
+    category = racer_flags['Category'].to_numpy(dtype=object)
+    has_category = ~pd.isna(category)
+    flag_number = (
+        racer_flags['DriverNumber'].to_numpy(dtype=np.int64)[has_category]
+        [::-1]
+    )
+    flag_category = category[has_category][::-1]
+    flag_number, first_index = np.unique(flag_number, return_index=True)
+
+    position, has_flag = sorted_lookup(flag_number, driver_number)
+    latest_category = np.full(len(driver_number), np.nan, dtype=object)
+    latest_category[has_flag] = (
+        flag_category[first_index][position[has_flag]]
+    )
+    updated_full_dataset['Category'] = latest_category
+
+    # Left join of the driver data on DriverNumber
+    driver_numbers = driver_data['DriverNumber'].to_numpy(dtype=np.int64)
+    driver_order = np.argsort(driver_numbers, kind='stable')
+    position, has_driver = (
+        sorted_lookup(driver_numbers[driver_order], driver_number)
+    )
+    for column in driver_data.columns.drop('DriverNumber'):
+        values = np.full(len(driver_number), np.nan, dtype=object)
+        values[has_driver] = (
+            driver_data[column].to_numpy(dtype=object)
+            [driver_order][position[has_driver]]
+        )
+        updated_full_dataset[column] = values
+
+    return updated_full_dataset
+
+
+def prepare_session_features(data: Session,
+                             engine: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Prepare the lap/weather and driver data of a session with an engine
+
+    Args:
+        data: passed in as a fastf1 Session type
+
+        engine: "pandas" or "numpy"
+
+    Returns:
+        full_dataset: lap data with weather aggregates per driver
+
+        driver_data: driver information per driver
+
+    """
+
+    if engine == 'numpy':
+        prepared_lap_data = prepare_lap_data_numpy(data)
+        full_dataset = prepare_weather_data_numpy(prepared_lap_data, data)
+        driver_data = prepare_driver_data_numpy(data)
+    elif engine == 'pandas':
+        prepared_lap_data = prepare_lap_data(data)
+        full_dataset = pd.concat(list(Weather(prepared_lap_data, data)))
+        driver_data = prepare_driver_data(data)
+    else:
+        raise ValueError(f"Unknown engine {engine}, use 'pandas' or 'numpy'")
+
+    return full_dataset, driver_data
+
+
+def prepare_session_dataset(data: Session, engine: str) -> pd.DataFrame:
+    """Prepare all feature data of a session with an engine
+
+    Lap, weather, control message and driver data, combined into one row
+    per driver (see combine_session_data())
+
+    Args:
+        data: passed in as a fastf1 Session type
+
+        engine: "pandas" or "numpy"
+
+    Returns:
+        updated_full_dataset: one row per driver with all session features
+
+    """
+
+    full_dataset, driver_data = prepare_session_features(data, engine)
+
+    if engine == 'numpy':
+        return combine_session_data_numpy(
+            full_dataset, prepare_control_message_data_numpy(data), driver_data
+        )
+
+    return combine_session_data(
+        full_dataset, prepare_control_message_data(data), driver_data
+    )
+
+
+def check_engine_parity(data: Session, rtol: float = 1e-6) -> None:
+    """Check that the numpy engine gives the same output as the pandas engine
+
+    Works with fastf1 sessions and with archived sessions (see
+    session_archive.py), so the engines can be compared offline on every
+    archived session. Compares the lap/weather and driver data, and the
+    combined session dataset (see prepare_session_dataset())
+
+    Args:
+        data: a loaded fastf1 Session or ArchivedSession
+
+        rtol: relative tolerance for float columns
+
+    Returns:
+        None, raises an AssertionError on the first difference
+
+    """
+
+    pandas_dfs = (
+        list(prepare_session_features(data, 'pandas')) +
+        [prepare_session_dataset(data, 'pandas')]
+    )
+    numpy_dfs = (
+        list(prepare_session_features(data, 'numpy')) +
+        [prepare_session_dataset(data, 'numpy')]
+    )
+
+    for pandas_df, numpy_df in zip(pandas_dfs, numpy_dfs):
+        pd.testing.assert_frame_equal(
+            pandas_df.infer_objects().reset_index(drop=True),
+            numpy_df.infer_objects().reset_index(drop=True),
+            check_dtype=False,
+            rtol=rtol
+        )
@@ -88,6 +88,9 @@ class Weather:
                  'TrackTemp',
                  'WindDirection',
                  'WindSpeed']].apply(weather_agg_dict)
+            # An empty window aggregates to no rows, keep the columns (as
+            # missing values) so the schema does not depend on the data
+            .reindex(['min', 'max', 'mean', 'std'])
         )
 
         # Reshape the DataFrame into a single row
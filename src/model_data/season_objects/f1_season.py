@@ -1,12 +1,23 @@
-from typing import Dict
+from typing import Dict, List, Optional
 import datetime
+import numpy as np
 import pandas as pd
 from fastf1.events import get_event_schedule, EventSchedule
 from fastf1.core import Session
 
-from src.model_data.season_objects.session_objects import SessionObjects
+from src.model_data.season_objects.session_objects import (
+    SessionObjects,
+    get_session_role,
+    FEATURE_SESSION
+)
+from src.model_data.season_objects.session_archive import SessionArchive
 
 
+# Supported event formats. Sprint formats can be pulled on their own and 
+# appended to already built conventional data
+CONVENTIONAL_FORMATS: List[str] = ['conventional']
+SPRINT_FORMATS: List[str] = ['sprint', 'sprint_shootout', 'sprint_qualifying']
+
 class F1Season:
     """Obtain fastf1 season dataframe with session objects in each event
 
@@ -19,30 +30,86 @@ class F1Season:
                   training data cutoff. Only relevant for a season that is 
                   ongoing
 
+        archive: optional SessionArchive. When passed in, the schedule and 
+                 sessions are served from the local archive instead of the 
+                 fastf1 API
+
+        event_formats: the EventFormat values of the events to include. 
+                       Defaults to conventional events only, see 
+                       CONVENTIONAL_FORMATS and SPRINT_FORMATS
+
     Returns:
         valid_season_df: holds the event info for valid events in a season with 
                          session names and objects within dataframe
             
     """
 
-    def __init__(self, year: int, end_date: datetime) -> None:
+    def __init__(self,
+                 year: int,
+                 end_date: datetime,
+                 archive: Optional[SessionArchive] = None,
+                 event_formats: Optional[List[str]] = None) -> None:
         self.year: int = year
         self.end_date: datetime = end_date
-        self.full_season: EventSchedule = get_event_schedule(self.year)
+        self.archive: Optional[SessionArchive] = archive
+        self.event_formats: List[str] = (
+            event_formats if event_formats else CONVENTIONAL_FORMATS
+        )
+        self.full_season: EventSchedule = (
+            archive.load_schedule(self.year) if archive
+            else get_event_schedule(self.year)
+        )
         self.valid_season_df: pd.DataFrame = self.get_season_dataframe() 
 
+    @staticmethod
+    def get_feature_cutoff(season_df: pd.DataFrame) -> pd.Series:
+        """Obtain the start of the last feature session for each event
+
+        The feature sessions are the sessions before the race that are used 
+        for the features (see get_session_role() in session_objects.py). Which 
+        session is last depends on the event format, e.g. Qualifying 
+        (Session4) for conventional events, Practice 2 or Sprint Shootout 
+        (Session3) for sprint events
+
+        Args:
+            season_df: season schedule dataframe
+
+        Returns:
+            feature_cutoff: the UTC date of the last feature session per event
+                
+        """
+
+        feature_cutoff = pd.Series(pd.NaT, index=season_df.index)
+
+        # Sessions are in chronological order, so the last feature session wins
+        for session_number in range(1, 6):
+            is_feature_session = np.array([
+                isinstance(session_name, str) and session_name != '' and 
+                get_session_role(session_name, event_format) == FEATURE_SESSION
+                for session_name, event_format
+                in zip(season_df[f'Session{session_number}'],
+                       season_df['EventFormat'])
+            ], dtype=bool)
+
+            feature_cutoff = feature_cutoff.mask(
+                is_feature_session,
+                season_df[f'Session{session_number}DateUtc']
+            )
+
+        return feature_cutoff
+
     def get_season_dataframe(self) -> pd.DataFrame:
         # TODO: Doctring
 
-        # Currently testing without Sprint races
         season_df = (
             pd.DataFrame(self.full_season)
-            .query('EventFormat in ["conventional"]')
+            .query('EventFormat in @self.event_formats')
         )
 
-        # Only obtain finished events, for training data
+        # Only obtain finished events, for training data. Cutoff depends on 
+        # the event format
         finished_events = (
-            season_df.query("Session4DateUtc < @self.end_date")
+            season_df[self.get_feature_cutoff(season_df) < self.end_date]
         )
 
         return finished_events
@@ -51,7 +118,7 @@ class F1Season:
         # TODO: Doctring
 
         # Get all sessions in an event
-        session_class = SessionObjects(self.year, round_number)
+        session_class = SessionObjects(self.year, round_number, self.archive)
         
         # Returned event dict that holds session names and objects
         event_dict = {
@@ -70,3 +137,38 @@ class F1Season:
             self.valid_season_df['RoundNumber']
             .apply(lambda round_number: self.get_season_sessions(round_number))
         )
+
+    def export_to_archive(self, archive: SessionArchive) -> int:
+        """Export the season schedule and valid sessions to a local archive
+
+        Loads every session of the valid events from fastf1 and saves the 
+        tables used by the prepare_data functions, so later runs can be served 
+        from the archive without any network access. Sessions that cannot be 
+        loaded by fastf1 are left out, same as in RunAllMethods
+
+        Args:
+            archive: the SessionArchive to write to
+
+        Returns:
+            sessions_saved: number of sessions written to the archive
+                
+        """
+
+        # Full schedule is kept, so the cutoff can be changed on replay
+        archive.save_schedule(self.year, self.full_season)
+
+        if 'SeasonEvents' not in self.valid_season_df.columns:
+            self.update_season_dataframe()
+
+        sessions_saved = 0
+        for round_number, events in zip(self.valid_season_df['RoundNumber'],
+                                        self.valid_season_df['SeasonEvents']):
+            for session_name, session_object in events.items():
+                # Telemetry is not used by the prepare_data functions
+                session_object.load(telemetry=False)
+                sessions_saved += archive.save_session(self.year,
+                                                       round_number,
+                                                       session_name,
+                                                       session_object)
+
+        return sessions_saved
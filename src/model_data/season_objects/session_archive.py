@@ -0,0 +1,283 @@
+from typing import Dict, List, Union
+import os
+import re
+import pandas as pd
+from fastf1.core import Session
+
+
+# Session tables used by the prepare_data functions. Everything else on a
+# fastf1 Session (telemetry, position data, etc.) is left out of the archive
+ARCHIVED_TABLES: List[str] = [
+    'laps',
+    'weather_data',
+    'race_control_messages',
+    'results'
+]
+
+
+class ArchivedSession:
+    """Stand-in for a fastf1 Session that is served from a SessionArchive
+
+    Mirrors the small part of the fastf1 Session interface that is used by
+    RunAllMethods and the prepare_data functions (load, laps, weather_data,
+    race_control_messages, results, drivers, get_driver and event). Like a
+    fastf1 Session, the tables are only read from disk once load() is called.
+    If the session is not in the archive, load() leaves the object without a
+    "_laps" attribute, which is how a failed fastf1 load is detected
+
+    Args:
+        path: location of the archived session file
+
+        event: the schedule row of the event the session belongs to
+
+        name: the name of the session, e.g. Practice 1
+
+    """
+
+    def __init__(self, path: str, event: pd.Series, name: str) -> None:
+        self.path: str = path
+        self.event: pd.Series = event
+        self.name: str = name
+
+    def load(self, **kwargs) -> None:
+        """Read the archived session tables from disk
+
+        Keyword arguments are accepted (and ignored) so this can be called
+        exactly like fastf1's Session.load()
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        """
+
+        # Same behavior as a failed fastf1 load, i.e. no _laps attribute
+        if not os.path.exists(self.path):
+            return
+
+        tables = pd.read_pickle(self.path)
+
+        self._weather_data = tables['weather_data']
+        self._race_control_messages = tables['race_control_messages']
+        self._results = tables['results']
+        self._laps = tables['laps']
+
+    @property
+    def laps(self) -> pd.DataFrame:
+        return self._laps
+
+    @property
+    def weather_data(self) -> pd.DataFrame:
+        return self._weather_data
+
+    @property
+    def race_control_messages(self) -> pd.DataFrame:
+        return self._race_control_messages
+
+    @property
+    def results(self) -> pd.DataFrame:
+        return self._results
+
+    @property
+    def drivers(self) -> List[str]:
+        return list(self._results['DriverNumber'])
+
+    def get_driver(self, identifier: str) -> pd.Series:
+        """Get a driver's result row, same as fastf1's Session.get_driver()
+
+        Args:
+            identifier: driver number or three letter abbreviation
+
+        Returns:
+            driver_result: the row of the session results for the driver
+
+        """
+
+        identifier = str(identifier)
+        driver_mask = (
+            (self._results['DriverNumber'].astype(str) == identifier) |
+            (self._results['Abbreviation'] == identifier)
+        )
+
+        return self._results[driver_mask].iloc[0]
+
+
+class SessionArchive:
+    """Local mirror of the fastf1 data used to build the model data
+
+    The archive holds the event schedule of each season along with the
+    session tables the prepare_data functions use (see ARCHIVED_TABLES). A
+    season is exported once while fastf1 can reach the live timing and Ergast
+    services (see F1Season.export_to_archive()), and every later run can be
+    served entirely from disk by passing the archive into RunAllMethods,
+    F1Season or SessionObjects. Sessions are replayed through ArchivedSession
+    objects, so the rest of the pipeline is unchanged.
+
+    Archive layout:
+        <root>/schedule/<year>.pkl.gz
+        <root>/sessions/<year>/<round>/<session_name>.pkl.gz
+
+    Args:
+        root: the directory holding the archive. Created if it does not exist
+
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root: str = root
+        self.schedules: Dict[int, pd.DataFrame] = {}
+
+    def schedule_path(self, year: int) -> str:
+        return os.path.join(self.root, 'schedule', f'{year}.pkl.gz')
+
+    def session_path(self,
+                     year: int,
+                     round_number: int,
+                     session_name: str) -> str:
+        # Session names include spaces, e.g. Practice 1 -> practice_1
+        file_name = re.sub(r'\W+', '_', session_name).lower()
+
+        return os.path.join(self.root,
+                            'sessions',
+                            str(year),
+                            f'{int(round_number):02d}',
+                            f'{file_name}.pkl.gz')
+
+    def has_schedule(self, year: int) -> bool:
+        return os.path.exists(self.schedule_path(year))
+
+    def has_session(self,
+                    year: int,
+                    round_number: int,
+                    session_name: str) -> bool:
+        return os.path.exists(
+            self.session_path(year, round_number, session_name)
+        )
+
+    def save_schedule(self, year: int, schedule: pd.DataFrame) -> None:
+        """Save the full event schedule of a season to the archive
+
+        Args:
+            year: the year of the season
+
+            schedule: fastf1 EventSchedule (or dataframe) of the season
+
+        Returns:
+            None
+
+        """
+
+        path = self.schedule_path(year)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Store as plain dataframe, fastf1 types are not needed for replay
+        schedule_df = pd.DataFrame(schedule)
+        schedule_df.to_pickle(path, compression='gzip')
+        self.schedules[year] = schedule_df
+
+    def load_schedule(self, year: int) -> pd.DataFrame:
+        """Load the event schedule of a season from the archive
+
+        Args:
+            year: the year of the season
+
+        Returns:
+            schedule: the archived schedule as a pandas dataframe
+
+        """
+
+        if year not in self.schedules:
+            path = self.schedule_path(year)
+            if not os.path.exists(path):
+                raise FileNotFoundError(
+                    f"No archived schedule for season {year} in {self.root}"
+                )
+            self.schedules[year] = pd.read_pickle(path)
+
+        return self.schedules[year].copy()
+
+    def get_event(self, year: int, gp: Union[int, str]) -> pd.Series:
+        """Archived counterpart of fastf1's get_event()
+
+        Args:
+            year: the year of the season
+
+            gp: either the round number or the full name of the Grand Prix
+
+        Returns:
+            event: the schedule row of the event
+
+        """
+
+        schedule = self.load_schedule(year)
+        if isinstance(gp, str):
+            event_df = schedule[schedule['EventName'] == gp]
+        else:
+            event_df = schedule[schedule['RoundNumber'] == gp]
+
+        if len(event_df) == 0:
+            raise ValueError(f"No archived event {gp} in season {year}")
+
+        return event_df.iloc[0]
+
+    def save_session(self,
+                     year: int,
+                     round_number: int,
+                     session_name: str,
+                     session: Session) -> bool:
+        """Save the tables of a loaded session to the archive
+
+        Args:
+            year: the year of the season
+
+            round_number: the round number of the event
+
+            session_name: the name of the session, e.g. Practice 1
+
+            session: a fastf1 Session that has already been loaded
+
+        Returns:
+            saved: False when the session could not be loaded by fastf1, in
+                   which case nothing is written
+
+        """
+
+        # Catch when session cannot be loaded from fastf1
+        if not hasattr(session, '_laps'):
+            return False
+
+        tables = {
+            table: pd.DataFrame(getattr(session, table))
+            for table in ARCHIVED_TABLES
+        }
+
+        path = self.session_path(year, round_number, session_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pd.to_pickle(tables, path, compression='gzip')
+
+        return True
+
+    def get_session(self,
+                    year: int,
+                    round_number: int,
+                    session_name: str) -> ArchivedSession:
+        """Get the stand-in Session object for an archived session
+
+        Args:
+            year: the year of the season
+
+            round_number: the round number of the event
+
+            session_name: the name of the session, e.g. Practice 1
+
+        Returns:
+            session: ArchivedSession, which must be loaded before use (same
+                     as a fastf1 Session)
+
+        """
+
+        event = self.get_event(year, round_number)
+        path = self.session_path(year, round_number, session_name)
+
+        return ArchivedSession(path, event, session_name)
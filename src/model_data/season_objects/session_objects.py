@@ -1,13 +1,51 @@
-from typing import List, Union, Tuple
+from typing import List, Union, Tuple, Optional
 import re
 import pandas as pd
 from fastf1.events import Event, get_event
 from fastf1 import set_log_level
 from fastf1.core import Session
 
+from src.model_data.season_objects.session_archive import SessionArchive
+
 
 set_log_level("ERROR") # Set fastf1 logging to errors only
 
+# Session roles used to build the model data. Feature sessions are aggregated 
+# into the features, race and sprint sessions provide the response variables
+FEATURE_SESSION = 'feature'
+SPRINT_SESSION = 'sprint'
+RACE_SESSION = 'race'
+
+
+def get_session_role(session_name: str, event_format: str) -> str:
+    """Determine how a session is used to build the model data
+
+    Session names depend on the event format and the season. In the 2021 
+    sprint format the sprint race itself was named "Sprint Qualifying", 
+    whereas from 2024 on "Sprint Qualifying" is the shootout that sets the 
+    sprint grid (event format "sprint_qualifying")
+
+    Args:
+        session_name: the name of the session, e.g. Practice 1
+
+        event_format: the EventFormat of the event, e.g. conventional, sprint 
+                      or sprint_shootout
+
+    Returns:
+        session_role: one of FEATURE_SESSION, SPRINT_SESSION or RACE_SESSION
+
+    """
+
+    if session_name == 'Race':
+        return RACE_SESSION
+    elif session_name == 'Sprint':
+        return SPRINT_SESSION
+    elif session_name == 'Sprint Qualifying' and event_format == 'sprint':
+        return SPRINT_SESSION
+    else:
+        return FEATURE_SESSION
+
+
 class SessionObjects:
     """Obtain fastf1 Session objects for a event in a season
 
@@ -23,6 +61,10 @@ class SessionObjects:
             full or the race rank in a season (i.e. what order the race is in 
             the season)
 
+        archive: optional SessionArchive. When passed in, the event and its 
+                 sessions are served from the local archive instead of the 
+                 fastf1 API
+
     Returns:
         session_name: the name of the session, e.g. Practice 1
         
@@ -31,8 +73,15 @@ class SessionObjects:
             
     """
 
-    def __init__(self, year: int, gp: Union[int, str]) -> None:
-        self.event: Event = get_event(year, gp)
+    def __init__(self,
+                 year: int,
+                 gp: Union[int, str],
+                 archive: Optional[SessionArchive] = None) -> None:
+        self.year: int = year
+        self.archive: Optional[SessionArchive] = archive
+        self.event: Event = (
+            archive.get_event(year, gp) if archive else get_event(year, gp)
+        )
         self.session_names: List[str] = self.get_session_names()
         self.current_index: int = 0
 
@@ -77,31 +126,21 @@ class SessionObjects:
 
         # Get current session name
         session_name = self.session_names[self.current_index]
-        splits = session_name.split(' ')
-
-        # Logic to obtain session type and number if relevant
-        # Sprint logic is included, although may not be used
-        if splits[0] == 'Sprint' and len(splits) > 1:
-            session_type = splits[0].lower() + '_' + splits[1].lower()
-            session_round = None
-        elif len(splits) > 1:
-            session_type, session_round = splits
-        else:
-            session_type = splits[0]
-            session_round = None
-
-        # Obtain the fastf1 function to get session data. Either 
-        # get_qualifying, get_practice, get_sprint, or get_sprint_shootout
-        function_name = f"get_{session_type.lower()}"
-        if hasattr(self.event, function_name):
-            session_func = getattr(self.event, function_name)
-
-        # Will have to change get_season_dataframe() method in f1_season.py if  
-        # Sprint races are desired. Currently only pulls conventional races
-        if session_round and session_type not in ['Sprint', 'Sprint Shootout']:
-            session_object = session_func(session_round)
-        else:
-            session_object = session_func()
+
+        # Replay from local archive, no fastf1 API calls
+        if self.archive:
+            session_object = (
+                self.archive.get_session(self.year,
+                                         self.event.RoundNumber,
+                                         session_name)
+            )
+            self.current_index += 1
+
+            return session_name, session_object
+
+        # Obtain the fastf1 session by its name. Handles every event format, 
+        # e.g. Practice 2, Sprint Qualifying (2021), Sprint Shootout (2023)
+        session_object = self.event.get_session(session_name)
 
         # Go to next index
         self.current_index += 1
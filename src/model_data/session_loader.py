@@ -0,0 +1,295 @@
+from typing import Any, Dict, List, Optional, Tuple
+import datetime
+import json
+import os
+import threading
+import time
+
+
+def get_session_key(year: int, round_number: int, session_name: str) -> str:
+    return f'{int(year)}-{int(round_number):02d}-{session_name}'
+
+
+class MissingLapDataError(RuntimeError):
+    """A session loaded without lap data, fastf1 logs its load errors"""
+
+
+def new_session(session_object, session_name: str):
+    """Build a new, not yet loaded object of the same session
+
+    fastf1 Sessions are built again from their event, the same way as in
+    SessionObjects. ArchivedSessions (see session_archive.py) are built again
+    from their archive path
+
+    Args:
+        session_object: fastf1 Session or ArchivedSession
+
+        session_name: the name of the session, e.g. Practice 1
+
+    Returns:
+        session_object: a new session object that shares no loaded state
+
+    """
+
+    if hasattr(session_object, 'path'):
+        return type(session_object)(session_object.path,
+                                    session_object.event,
+                                    session_name)
+
+    return session_object.event.get_session(session_name)
+
+
+class SessionQuarantine:
+    """Sessions that failed to load, kept in a JSON file between runs
+
+    Each failed session is recorded under its (year, round, session) key with
+    the last error, the number of runs it failed in and when it last failed.
+    A session that fails in max_runs runs is given up: it stays in the
+    quarantine for reference, but is no longer retried and its round is
+    built without it
+
+    Args:
+        path: location of the quarantine JSON file
+
+        max_runs: number of failed runs before a session is given up
+
+    Returns:
+        quarantined sessions, see entries() and rounds()
+
+    """
+
+    def __init__(self, path: str, max_runs: int = 3) -> None:
+        self.path: str = path
+        self.max_runs: int = max_runs
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return {}
+
+        with open(self.path) as quarantine_file:
+            return json.load(quarantine_file)
+
+    def save(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Write then rename, so an interrupted run never leaves a broken file
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w') as quarantine_file:
+            json.dump(entries, quarantine_file, indent=2, sort_keys=True)
+        os.replace(temporary_path, self.path)
+
+    def add(self,
+            year: int,
+            round_number: int,
+            session_name: str,
+            error: str,
+            attempts: int) -> Dict[str, Any]:
+        """Record a failed session
+
+        Args:
+            year: the year of the season
+
+            round_number: the round number of the event
+
+            session_name: the name of the session, e.g. Practice 1
+
+            error: the last error
+
+            attempts: load attempts made in this run
+
+        Returns:
+            entry: the quarantine entry of the session
+
+        """
+
+        entries = self.entries()
+        key = get_session_key(year, round_number, session_name)
+        runs = entries.get(key, {}).get('Runs', 0) + 1
+
+        entries[key] = {
+            'SeasonYear': int(year),
+            'RoundNumber': int(round_number),
+            'SessionName': session_name,
+            'Error': error,
+            'Attempts': attempts,
+            'Runs': runs,
+            'GivenUp': runs >= self.max_runs,
+            'LastFailure': datetime.datetime.now().isoformat(timespec='seconds')
+        }
+        self.save(entries)
+
+        return entries[key]
+
+    def remove(self, year: int, round_number: int, session_name: str) -> None:
+        entries = self.entries()
+        key = get_session_key(year, round_number, session_name)
+        if key in entries:
+            del entries[key]
+            self.save(entries)
+
+    def is_pending(self,
+                   year: int,
+                   round_number: int,
+                   session_name: str) -> bool:
+        """Check if a session is quarantined and will be retried"""
+
+        entry = self.entries().get(
+            get_session_key(year, round_number, session_name)
+        )
+
+        return entry is not None and not entry['GivenUp']
+
+    def rounds(self) -> List[Tuple[int, int]]:
+        """Obtain the (season, round) of every session that will be retried
+
+        Args:
+            None
+
+        Returns:
+            rounds: sorted list of (SeasonYear, RoundNumber) tuples
+
+        """
+
+        return sorted({
+            (entry['SeasonYear'], entry['RoundNumber'])
+            for entry in self.entries().values()
+            if not entry['GivenUp']
+        })
+
+
+class SessionLoader:
+    """Load sessions with bounded retries, timeouts and a quarantine
+
+    fastf1 logs load errors instead of raising them, a session that failed to
+    load only lacks its laps. The loader treats a missing _laps attribute, an
+    exception or a load taking longer than timeout_seconds as a failed
+    attempt. Failed attempts are retried with exponential backoff
+    (backoff_seconds, 2 * backoff_seconds, ...). When every attempt fails
+    the session is recorded in the quarantine (if given), and a session that
+    loads removes its quarantine entry. Without a quarantine, the error of
+    the last attempt is raised (a session without lap data is skipped),
+    same as a single Session.load() call
+
+    A timed out load cannot be stopped, it is left running in a background
+    thread and its result is not used. Every retry therefore builds a new
+    session object (see new_session()), so an abandoned load never writes
+    to the session that is returned
+
+    Returns:
+        session_object: the loaded session, or None, see load()
+
+    Args:
+        retries: number of retries after the first attempt
+
+        backoff_seconds: wait before the first retry, doubled for every retry
+
+        timeout_seconds: optional time limit of one load attempt
+
+        quarantine: optional SessionQuarantine recording failed sessions
+
+        load_kwargs: optional keyword arguments of Session.load(), e.g.
+                     {'telemetry': False}
+
+    """
+
+    def __init__(self,
+                 retries: int = 2,
+                 backoff_seconds: float = 5.0,
+                 timeout_seconds: Optional[float] = None,
+                 quarantine: Optional[SessionQuarantine] = None,
+                 load_kwargs: Optional[Dict[str, Any]] = None) -> None:
+        self.retries: int = retries
+        self.backoff_seconds: float = backoff_seconds
+        self.timeout_seconds: Optional[float] = timeout_seconds
+        self.quarantine: Optional[SessionQuarantine] = quarantine
+        self.load_kwargs: Dict[str, Any] = load_kwargs if load_kwargs else {}
+
+    def load_once(self, session_object) -> None:
+        errors = []
+
+        def load_session() -> None:
+            try:
+                session_object.load(**self.load_kwargs)
+            except Exception as error:
+                errors.append(error)
+
+        load_thread = threading.Thread(target=load_session, daemon=True)
+        load_thread.start()
+        load_thread.join(self.timeout_seconds)
+
+        if load_thread.is_alive():
+            raise TimeoutError(
+                f"Session load took longer than {self.timeout_seconds}s"
+            )
+        if errors:
+            raise errors[0]
+        # Catch when session cannot be loaded from fastf1
+        if not hasattr(session_object, '_laps'):
+            raise MissingLapDataError("Session loaded without lap data")
+
+    def load(self,
+             session_object,
+             year: int,
+             round_number: int,
+             session_name: str):
+        """Load a session, retrying failed attempts
+
+        Args:
+            session_object: fastf1 Session or ArchivedSession to load, must
+                            not be loaded yet
+
+            year: the year of the season
+
+            round_number: the round number of the event
+
+            session_name: the name of the session, e.g. Practice 1
+
+        Returns:
+            session_object: the session object that loaded with lap data (a
+                            new one after a retry). None when every attempt
+                            failed and the session is quarantined, or when
+                            it has no lap data
+
+        """
+
+        last_error = None
+        for attempt in range(self.retries + 1):
+            try:
+                if attempt > 0:
+                    time.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+                    # An abandoned attempt keeps its own session object
+                    session_object = new_session(session_object, session_name)
+
+                self.load_once(session_object)
+            except Exception as error:
+                last_error = error
+                continue
+
+            if self.quarantine is not None:
+                self.quarantine.remove(year, round_number, session_name)
+
+            return session_object
+
+        if self.quarantine is not None:
+            self.quarantine.add(year,
+                                round_number,
+                                session_name,
+                                f'{type(last_error).__name__}: {last_error}',
+                                self.retries + 1)
+        elif not isinstance(last_error, MissingLapDataError):
+            raise last_error
+
+        return None
+
+    def is_pending(self,
+                   year: int,
+                   round_number: int,
+                   session_name: str) -> bool:
+        """Check if a failed session will be retried in a later run"""
+
+        if self.quarantine is None:
+            return False
+
+        return self.quarantine.is_pending(year, round_number, session_name)
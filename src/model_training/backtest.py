@@ -0,0 +1,271 @@
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from importlib import import_module
+import os
+import numpy as np
+import pandas as pd
+
+from src.model_data.partitions import RoundPartitions
+from src.model_training.preprocessing import FeaturePreprocessor
+
+
+def backtest_round(partitions_root: str,
+                   season: int,
+                   round_number: int,
+                   model_module: str,
+                   model_class_str: str,
+                   params: Dict[str, Any],
+                   target: str = 'Points') -> Dict[str, Any]:
+    """Train on every round before a given round and evaluate on that round
+
+    Reads the training and test rounds from the round partitions, fits a new
+    FeaturePreprocessor and model on the earlier rounds and predicts the
+    round. Session predictions are averaged per driver to obtain one
+    prediction per driver for the race. Runs in its own process, so only
+    picklable arguments are passed in
+
+    Args:
+        partitions_root: the root directory of the RoundPartitions
+
+        season: season of the round to predict
+
+        round_number: round number of the round to predict
+
+        model_module: string name of the module of the model, e.g. "catboost"
+
+        model_class_str: string name of the model class, e.g.
+                         "CatBoostRegressor"
+
+        params: params passed in as **params to the model class
+
+        target: the response variable
+
+    Returns:
+        metrics: one row of the backtest metrics table, with missing metrics
+                 when the round has no rows with a target (e.g. a cancelled
+                 round) or no earlier rounds to train on
+
+    """
+
+    partitions = RoundPartitions(partitions_root)
+    train = (
+        partitions.read_before(season, round_number)
+        .dropna(subset=[target])
+    )
+    test = (
+        partitions.read([(season, round_number)])
+        .dropna(subset=[target])
+        .reset_index(drop=True)
+    )
+
+    # Cancelled or partial rounds (no target) and rounds without history
+    if len(test) == 0 or len(train) == 0:
+        return {
+            'SeasonYear': season,
+            'RoundNumber': round_number,
+            'EventName': None,
+            'TrainRows': len(train),
+            'TestRows': len(test),
+            'Drivers': 0,
+            'SessionRMSE': np.nan,
+            'RMSE': np.nan,
+            'MAE': np.nan,
+            'Spearman': np.nan,
+            'Top10Hits': 0
+        }
+
+    # Allow for dynamic model definitions
+    model_class = getattr(import_module(model_module), model_class_str)
+
+    preprocessor = FeaturePreprocessor().fit(train)
+    model = model_class(**params)
+    model.fit(preprocessor.transform_for(train, model_module), train[target])
+
+    test['Predicted'] = (
+        model.predict(preprocessor.transform_for(test, model_module))
+    )
+
+    # One prediction per driver, average of the driver's session predictions
+    driver_results = (
+        test.groupby('DriverNumber')
+        .agg(Actual=(target, 'first'),
+             Position=('Position', 'first'),
+             Predicted=('Predicted', 'mean'))
+    )
+    driver_results['PredictedRank'] = (
+        driver_results['Predicted'].rank(ascending=False, method='first')
+    )
+    errors = driver_results['Predicted'] - driver_results['Actual']
+    predicted_top_10 = driver_results['PredictedRank'] <= 10
+    actual_top_10 = driver_results['Position'] <= 10
+
+    return {
+        'SeasonYear': season,
+        'RoundNumber': round_number,
+        'EventName': test['EventName'].iloc[0],
+        'TrainRows': len(train),
+        'TestRows': len(test),
+        'Drivers': len(driver_results),
+        'SessionRMSE': float(
+            np.sqrt(np.mean((test['Predicted'] - test[target]) ** 2))
+        ),
+        'RMSE': float(np.sqrt(np.mean(errors ** 2))),
+        'MAE': float(np.mean(np.abs(errors))),
+        'Spearman': float(
+            driver_results['PredictedRank']
+            .corr(driver_results['Position'], method='spearman')
+        ),
+        'Top10Hits': int((predicted_top_10 & actual_top_10).sum())
+    }
+
+
+class WalkForwardBacktest:
+    """Walk-forward backtest over historical rounds
+
+    For every round that is backtested, a model is trained on all earlier
+    rounds and used to predict that round, the way it would have been used
+    at the time. Rounds are independent of each other, so they run in
+    parallel, either in a local process pool or as Ray tasks. Each worker
+    reads its rounds from the cached round partitions (see
+    src/model_data/partitions.py), so the model data is never pulled again
+    or passed between processes.
+
+    The output is a metrics table with one row per round (see
+    backtest_round()), which replaces checking results/2023-roundN.md by hand
+
+    Args:
+        partitions_root: the root directory of the RoundPartitions
+
+        model_module: string name of the module of the model, e.g. "catboost"
+
+        model_class_str: string name of the model class, e.g.
+                         "CatBoostRegressor"
+
+        params: params passed in as **params to the model class, e.g. the
+                tuned params from RayTune
+
+        target: the response variable
+
+        min_train_rounds: minimum number of earlier rounds needed to backtest
+                          a round
+
+    Returns:
+        metrics: backtest metrics table, see run()
+
+    """
+
+    def __init__(self,
+                 partitions_root: str,
+                 model_module: str,
+                 model_class_str: str,
+                 params: Dict[str, Any],
+                 target: str = 'Points',
+                 min_train_rounds: int = 10) -> None:
+        self.partitions_root: str = partitions_root
+        self.model_module: str = model_module
+        self.model_class_str: str = model_class_str
+        self.params: Dict[str, Any] = params
+        self.target: str = target
+        self.min_train_rounds: int = min_train_rounds
+
+    def target_rounds(self, seasons: List[int]) -> List[tuple]:
+        """Obtain the rounds to backtest in the given seasons
+
+        Args:
+            seasons: seasons to backtest
+
+        Returns:
+            rounds: (SeasonYear, RoundNumber) of the rounds with at least
+                    min_train_rounds earlier rounds
+
+        """
+
+        stored_rounds = RoundPartitions(self.partitions_root).rounds()
+
+        return [
+            stored_round for index, stored_round in enumerate(stored_rounds)
+            if stored_round[0] in seasons and index >= self.min_train_rounds
+        ]
+
+    def run(self,
+            seasons: List[int],
+            max_workers: Optional[int] = None,
+            use_ray: bool = False) -> pd.DataFrame:
+        """Backtest every round of the given seasons in parallel
+
+        Each worker gets an equal share of the cpus through the model's
+        thread_count (if not set in params), so parallel rounds do not
+        oversubscribe the cpus
+
+        Args:
+            seasons: seasons to backtest, e.g. [2021, 2022, 2023]
+
+            max_workers: number of rounds to run at the same time. Defaults
+                         to the number of cpus
+
+            use_ray: run rounds as Ray tasks instead of a local process pool,
+                     e.g. to spread them over a Ray cluster
+
+        Returns:
+            metrics: backtest metrics table, one row per round
+
+        """
+
+        rounds = self.target_rounds(seasons)
+        if len(rounds) == 0:
+            return pd.DataFrame()
+
+        max_workers = max_workers if max_workers else os.cpu_count()
+
+        params = dict(self.params)
+        if self.model_module == 'catboost':
+            params.setdefault('thread_count',
+                              max(1, os.cpu_count() // max_workers))
+
+        round_args = [
+            (self.partitions_root,
+             season,
+             round_number,
+             self.model_module,
+             self.model_class_str,
+             params,
+             self.target)
+            for season, round_number in rounds
+        ]
+
+        if use_ray:
+            ray = import_module('ray')
+            remote_round = (
+                ray.remote(num_cpus=params.get('thread_count', 1))
+                (backtest_round)
+            )
+            metrics = ray.get([remote_round.remote(*args)
+                               for args in round_args])
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                metrics = list(executor.map(backtest_round, *zip(*round_args)))
+
+        return (
+            pd.DataFrame(metrics)
+            .sort_values(['SeasonYear', 'RoundNumber'])
+            .reset_index(drop=True)
+        )
+
+    @staticmethod
+    def save(metrics: pd.DataFrame, path: str) -> None:
+        """Save the backtest metrics table as markdown or csv
+
+        Args:
+            metrics: backtest metrics table from run()
+
+            path: output path, markdown if it ends with .md, csv otherwise
+
+        Returns:
+            None
+
+        """
+
+        if path.endswith('.md'):
+            metrics.to_markdown(path)
+        else:
+            metrics.to_csv(path, index=False)
@@ -0,0 +1,268 @@
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import os
+import pandas as pd
+from catboost import Pool
+
+from src.model_training.registry import ModelRegistry, RegisteredModel
+
+
+# Columns that identify a row of the explanations
+ROW_COLUMNS: List[str] = [
+    'SeasonYear',
+    'RoundNumber',
+    'EventName',
+    'DriverNumber',
+    'SessionType'
+]
+
+# Suffix of the SHAP value columns, e.g. LapTimeSeconds_min_shap
+SHAP_SUFFIX: str = '_shap'
+
+
+class ExplanationService:
+    """Per-prediction SHAP explanations per event, cached per model version
+
+    Explanations are tree SHAP values from catboost's own implementation
+    (get_feature_importance with type ShapValues), computed from the
+    version's preprocessor features. Every row of an event is explained in
+    one batched call that runs on thread_count cores, and when several events
+    are requested, all events that are not cached yet share that one call.
+
+    The explanations of each event are cached in the model version's
+    directory of the registry:
+        <registry root>/<version>/explanations/<season>-<round>-<rows>.parquet
+
+    so dashboards re-read them without recomputing. <rows> is a hash of the
+    explained rows (see rows_hash()): the rows of an event grow over the
+    weekend (after each practice session, after qualifying), and a different
+    set of rows gets its own cache file. Registered versions are never
+    changed, so a cache file never needs to be invalidated
+
+    Args:
+        registry: the ModelRegistry holding the model versions
+
+        thread_count: cores used for the SHAP computation, -1 for all cores
+
+    Returns:
+        explanations: one row per model data row with the ROW_COLUMNS, one
+                      <feature>_shap column per feature, ExpectedValue and
+                      Prediction, see explain_events()
+
+    """
+
+    def __init__(self, registry: ModelRegistry, thread_count: int = -1) -> None:
+        self.registry: ModelRegistry = registry
+        self.thread_count: int = thread_count
+
+    @staticmethod
+    def rows_hash(registered: RegisteredModel, rows: pd.DataFrame) -> str:
+        """Hash of the row identifiers and features of an event's rows"""
+
+        columns = [
+            column for column in
+            ROW_COLUMNS + registered.preprocessor.feature_names
+            if column in rows.columns
+        ]
+        row_hashes = pd.util.hash_pandas_object(rows[columns], index=False)
+
+        return hashlib.sha256(row_hashes.to_numpy().tobytes()).hexdigest()[:16]
+
+    @staticmethod
+    def cache_path(registered: RegisteredModel,
+                   season: int,
+                   round_number: int,
+                   rows_hash: str) -> str:
+        return os.path.join(
+            registered.path,
+            'explanations',
+            f'{int(season)}-{int(round_number):02d}-{rows_hash}.parquet'
+        )
+
+    def compute(self,
+                registered: RegisteredModel,
+                data: pd.DataFrame) -> pd.DataFrame:
+        """Compute the SHAP values of every row in one batched call
+
+        Args:
+            registered: the model version
+
+            data: model data rows to explain
+
+        Returns:
+            explanations: see the class docstring
+
+        """
+
+        if registered.metadata['model_module'] != 'catboost':
+            raise ValueError(
+                "SHAP explanations are only supported for catboost models"
+            )
+
+        preprocessor = registered.preprocessor
+        shap_values = registered.model.get_feature_importance(
+            Pool(preprocessor.to_features_data(data)),
+            type='ShapValues',
+            thread_count=self.thread_count
+        )
+
+        # Last column is the expected value, the SHAP values add up to the
+        # prediction
+        explanations = pd.DataFrame(
+            shap_values[:, :-1],
+            columns=[f'{feature}{SHAP_SUFFIX}'
+                     for feature in preprocessor.feature_names]
+        )
+        explanations['ExpectedValue'] = shap_values[:, -1]
+        explanations['Prediction'] = shap_values.sum(axis=1)
+
+        row_columns = [column for column in ROW_COLUMNS
+                       if column in data.columns]
+
+        return pd.concat(
+            [data[row_columns].reset_index(drop=True), explanations],
+            axis=1
+        )
+
+    def explain_events(self,
+                       data: pd.DataFrame,
+                       version: Optional[str] = 'production',
+                       use_cache: bool = True) -> pd.DataFrame:
+        """Explain every row of one or more events
+
+        Args:
+            data: model data of the events, with SeasonYear and RoundNumber
+
+            version: model version or alias, see ModelRegistry.load()
+
+            use_cache: read cached events instead of recomputing them
+
+        Returns:
+            explanations: explanations of every row, in event order
+
+        """
+
+        registered = self.registry.load(version)
+
+        events: Dict[Tuple[int, int], pd.DataFrame] = {}
+        paths: Dict[Tuple[int, int], str] = {}
+        missing = []
+        for (season, round_number), event_rows in (
+                data.groupby(['SeasonYear', 'RoundNumber'], sort=True)):
+            path = self.cache_path(registered,
+                                   season,
+                                   round_number,
+                                   self.rows_hash(registered, event_rows))
+            paths[(season, round_number)] = path
+            if use_cache and os.path.exists(path):
+                events[(season, round_number)] = pd.read_parquet(path)
+            else:
+                missing.append(event_rows)
+
+        if missing:
+            # One batched call for all events that are not cached
+            computed = self.compute(registered,
+                                    pd.concat(missing, ignore_index=True))
+
+            for (season, round_number), event_explanations in (
+                    computed.groupby(['SeasonYear', 'RoundNumber'], sort=True)):
+                event_explanations = event_explanations.reset_index(drop=True)
+                path = paths[(season, round_number)]
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                # Write then rename, readers never see a partial file
+                temporary_path = f'{path}.tmp'
+                event_explanations.to_parquet(temporary_path, index=False)
+                os.replace(temporary_path, path)
+
+                events[(season, round_number)] = event_explanations
+
+        if len(events) == 0:
+            return pd.DataFrame()
+
+        return pd.concat([events[event] for event in sorted(events)],
+                         ignore_index=True)
+
+    def explain_event(self,
+                      data: pd.DataFrame,
+                      version: Optional[str] = 'production') -> pd.DataFrame:
+        """Explain the rows of a single event, see explain_events()"""
+
+        if len(data[['SeasonYear', 'RoundNumber']].drop_duplicates()) != 1:
+            raise ValueError("data must hold exactly one event")
+
+        return self.explain_events(data, version)
+
+    @staticmethod
+    def driver_explanations(explanations: pd.DataFrame) -> pd.DataFrame:
+        """Average the session explanations per driver and event
+
+        Same as the race prediction of a driver (see backtest_round()), the
+        average of the driver's session predictions
+
+        Args:
+            explanations: output of explain_events()
+
+        Returns:
+            driver_explanations: one row per driver and event
+
+        """
+
+        value_columns = [
+            column for column in explanations.columns
+            if column.endswith(SHAP_SUFFIX)
+            or column in ['ExpectedValue', 'Prediction']
+        ]
+
+        return (
+            explanations
+            .groupby(['SeasonYear', 'RoundNumber', 'DriverNumber'])
+            [value_columns]
+            .mean()
+            .reset_index()
+        )
+
+    @staticmethod
+    def top_features(explanations: pd.DataFrame,
+                     n: int = 5) -> pd.DataFrame:
+        """Obtain the features with the largest absolute SHAP value per row
+
+        Args:
+            explanations: output of explain_events() or driver_explanations()
+
+            n: number of features per row
+
+        Returns:
+            top_features: long table with the row's identifier columns,
+                          Feature, SHAP and Rank
+
+        """
+
+        shap_columns = [column for column in explanations.columns
+                        if column.endswith(SHAP_SUFFIX)]
+        id_columns = [column for column in explanations.columns
+                      if column in ROW_COLUMNS]
+
+        long_explanations = (
+            explanations[id_columns + shap_columns]
+            .reset_index()
+            .melt(id_vars=['index'] + id_columns,
+                  var_name='Feature',
+                  value_name='SHAP')
+        )
+        long_explanations['Feature'] = (
+            long_explanations['Feature'].str[:-len(SHAP_SUFFIX)]
+        )
+        long_explanations['Rank'] = (
+            long_explanations['SHAP'].abs()
+            .groupby(long_explanations['index'])
+            .rank(ascending=False, method='first')
+            .astype(int)
+        )
+
+        return (
+            long_explanations[long_explanations['Rank'] <= n]
+            .sort_values(['index', 'Rank'])
+            .drop(columns='index')
+            .reset_index(drop=True)
+        )
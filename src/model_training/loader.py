@@ -0,0 +1,364 @@
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
+from catboost import FeaturesData, Pool
+
+from src.model_data.partitions import PARTITION_COLUMNS, RoundPartitions
+from src.model_training.preprocessing import (
+    FeaturePreprocessor,
+    to_category_strings
+)
+
+
+class EventDataLoader:
+    """Load the round partitions into one set of pre-allocated typed arrays
+
+    Reading the full dataset as one dataframe and copying it through
+    training_data, X, X_train/X_val and then Pool objects holds several full
+    copies of a wide frame. The loader instead reads the round partitions
+    (see src/model_data/partitions.py) one round at a time and writes each
+    round's features straight into arrays allocated once for all rounds:
+        1) numeric: float32 array of the numeric features
+        2) categorical: object array of the categorical features. Every cell
+           references the shared vocabulary string, so the array only holds
+           pointers
+        3) label, SeasonYear and RoundNumber arrays
+
+    Rows are stored in round order, so every round, and every chronological
+    train/validation/test split, is a contiguous block of rows. Splits are
+    returned as slices, and the arrays of a split are views of the loaded
+    arrays, not copies. Peak memory is roughly one copy of the features plus
+    one round while loading
+
+    Rows with a missing target are skipped. Rounds without a feature column
+    (e.g. rounds built before the feature was added) hold missing values in
+    that column
+
+    Args:
+        partitions: RoundPartitions holding the model data
+
+        preprocessor: optional fitted FeaturePreprocessor. When not given, a
+                      new preprocessor is fitted in one pass over the rounds
+                      (see fit_preprocessor())
+
+        target: the response variable
+
+        rounds: (SeasonYear, RoundNumber) tuples to load. Defaults to all
+                stored rounds
+
+    Returns:
+        split slices, array views, FeaturesData and Pools, see split(),
+        arrays(), features() and to_pool()
+
+    """
+
+    def __init__(self,
+                 partitions: RoundPartitions,
+                 preprocessor: Optional[FeaturePreprocessor] = None,
+                 target: str = 'Points',
+                 rounds: Optional[List[Tuple[int, int]]] = None) -> None:
+        self.partitions: RoundPartitions = partitions
+        self.preprocessor: Optional[FeaturePreprocessor] = preprocessor
+        self.target: str = target
+        self.rounds: List[Tuple[int, int]] = (
+            sorted(rounds) if rounds is not None else partitions.rounds()
+        )
+
+        # Filled in load()
+        self.numeric: Optional[np.ndarray] = None
+        self.categorical: Optional[np.ndarray] = None
+        self.label: Optional[np.ndarray] = None
+        self.season: Optional[np.ndarray] = None
+        self.round_number: Optional[np.ndarray] = None
+        self.round_slices: Dict[Tuple[int, int], slice] = {}
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.numeric is not None
+
+    def read_round(self,
+                   season: int,
+                   round_number: int,
+                   columns: Optional[List[str]] = None) -> pd.DataFrame:
+        return (
+            self.partitions.read([(season, round_number)], columns)
+            .dropna(subset=[self.target])
+        )
+
+    def fit_preprocessor(self) -> Tuple[FeaturePreprocessor, List[int]]:
+        """Fit a FeaturePreprocessor in one pass over the rounds
+
+        Every round is read once. The feature schema is learned from the
+        union of the columns of all rounds (in the order they first appear)
+        and the category vocabularies are the union over all rounds. Rows of
+        a round without a column hold missing values in that column, so the
+        missing category is part of its vocabulary. This gives the same
+        schema and vocabularies as fitting on all rounds concatenated
+
+        Args:
+            None
+
+        Returns:
+            preprocessor: the fitted preprocessor
+
+            round_rows: rows (with a target) of each round
+
+        """
+
+        preprocessor = FeaturePreprocessor()
+        missing = preprocessor.missing_category
+        columns = {}
+        category_values = {}
+        round_rows = []
+
+        for season, round_number in self.rounds:
+            round_df = self.read_round(season, round_number)
+            earlier_rows = sum(round_rows)
+
+            for column in round_df.columns:
+                if column in preprocessor.categorical_features:
+                    values = category_values.setdefault(column, set())
+                    values.update(to_category_strings(round_df[column],
+                                                      missing))
+                    # Earlier rows do not have the new column
+                    if column not in columns and earlier_rows > 0:
+                        values.add(missing)
+                columns[column] = None
+
+            # This round's rows do not have the columns of earlier rounds
+            if len(round_df) > 0:
+                for column in set(category_values) - set(round_df.columns):
+                    category_values[column].add(missing)
+
+            round_rows.append(len(round_df))
+
+        preprocessor.fit_schema(list(columns))
+        preprocessor.vocabularies = {
+            column: sorted(category_values[column])
+            for column in preprocessor.categorical_columns
+        }
+
+        return preprocessor, round_rows
+
+    def count_rows(self) -> List[int]:
+        """Obtain the rows (with a target) of each round, reading the target only"""
+
+        return [
+            len(self.read_round(season, round_number, [self.target]))
+            for season, round_number in self.rounds
+        ]
+
+    def load(self) -> 'EventDataLoader':
+        """Read every round into the pre-allocated arrays
+
+        Args:
+            None
+
+        Returns:
+            self: the loaded loader
+
+        """
+
+        if self.preprocessor is None:
+            self.preprocessor, round_rows = self.fit_preprocessor()
+        else:
+            round_rows = self.count_rows()
+
+        preprocessor = self.preprocessor
+        total_rows = int(np.sum(round_rows))
+
+        # Allocate once for all rounds
+        self.numeric = np.empty(
+            (total_rows, len(preprocessor.numeric_columns)), dtype=np.float32
+        )
+        self.categorical = np.empty(
+            (total_rows, len(preprocessor.categorical_columns)), dtype=object
+        )
+        self.label = np.empty(total_rows, dtype=np.float32)
+        self.season = np.empty(total_rows, dtype=np.int32)
+        self.round_number = np.empty(total_rows, dtype=np.int32)
+
+        # Shared vocabulary strings, so cells reference one object per value
+        vocabulary_arrays = {
+            column: np.array(vocabulary, dtype=object)
+            for column, vocabulary in preprocessor.vocabularies.items()
+        }
+
+        columns = list(dict.fromkeys(
+            preprocessor.feature_names + [self.target] + PARTITION_COLUMNS
+        ))
+        start = 0
+        self.round_slices = {}
+        for (season, round_number), rows in zip(self.rounds, round_rows):
+            if rows == 0:
+                continue
+
+            # Columns a round does not have are missing values
+            round_df = (
+                self.read_round(season, round_number)
+                .reindex(columns=columns)
+            )
+            numeric, categorical = preprocessor.transform_arrays(round_df)
+            end = start + len(round_df)
+
+            self.numeric[start:end] = numeric
+            for index, column in enumerate(preprocessor.categorical_columns):
+                codes = pd.Categorical(
+                    categorical[:, index],
+                    categories=preprocessor.vocabularies[column]
+                ).codes
+                # Unseen categories (with a given preprocessor) stay as is
+                self.categorical[start:end, index] = np.where(
+                    codes >= 0,
+                    vocabulary_arrays[column][codes],
+                    categorical[:, index]
+                )
+            self.label[start:end] = round_df[self.target].to_numpy()
+            self.season[start:end] = season
+            self.round_number[start:end] = round_number
+
+            self.round_slices[(season, round_number)] = slice(start, end)
+            start = end
+
+        return self
+
+    def split(self,
+              validation_rounds: int,
+              test_rounds: int = 0) -> Dict[str, slice]:
+        """Split the loaded rounds chronologically
+
+        The last test_rounds rounds are the test set, the validation_rounds
+        rounds before those are the validation set and every earlier round is
+        the training set. A round is never split between sets
+
+        Args:
+            validation_rounds: number of rounds in the validation set
+
+            test_rounds: number of rounds in the test set
+
+        Returns:
+            splits: slice of the rows of each of train, validation and test
+
+        """
+
+        if not self.is_loaded:
+            raise ValueError("EventDataLoader must be loaded first")
+
+        loaded_rounds = list(self.round_slices)
+        if validation_rounds + test_rounds >= len(loaded_rounds):
+            raise ValueError(
+                f"{len(loaded_rounds)} rounds loaded, too few for "
+                f"{validation_rounds} validation and {test_rounds} test rounds"
+            )
+
+        def start_of(rounds_from_end: int) -> int:
+            if rounds_from_end == 0:
+                return len(self.label)
+            return self.round_slices[loaded_rounds[-rounds_from_end]].start
+
+        validation_start = start_of(validation_rounds + test_rounds)
+        test_start = start_of(test_rounds)
+
+        return {
+            'train': slice(0, validation_start),
+            'validation': slice(validation_start, test_start),
+            'test': slice(test_start, len(self.label))
+        }
+
+    def arrays(self,
+               rows: slice) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Obtain views of the numeric, categorical and label arrays
+
+        Args:
+            rows: slice of rows, e.g. from split() or round_slices
+
+        Returns:
+            numeric: float32 view of the numeric features
+
+            categorical: object view of the categorical features
+
+            label: float32 view of the target
+
+        """
+
+        return self.numeric[rows], self.categorical[rows], self.label[rows]
+
+    def features(self,
+                 rows: slice,
+                 model_module: str = 'catboost'
+                 ) -> Union[FeaturesData, np.ndarray]:
+        """Obtain the features of a slice of rows for a model library
+
+        For catboost the FeaturesData wraps the array views. Other libraries
+        get the encoded float32 array of FeaturePreprocessor.encode(), which
+        is a new array
+
+        Args:
+            rows: slice of rows, e.g. from split()
+
+            model_module: module of the model, e.g. "catboost"
+
+        Returns:
+            features: FeaturesData for catboost, encoded array otherwise
+
+        """
+
+        numeric, categorical, _ = self.arrays(rows)
+        preprocessor = self.preprocessor
+
+        if model_module == 'catboost':
+            return FeaturesData(
+                num_feature_data=numeric,
+                cat_feature_data=categorical,
+                num_feature_names=preprocessor.numeric_columns,
+                cat_feature_names=preprocessor.categorical_columns
+            )
+
+        codes = np.empty(categorical.shape, dtype=np.float32)
+        for index, column in enumerate(preprocessor.categorical_columns):
+            codes[:, index] = (
+                pd.Categorical(categorical[:, index],
+                               categories=preprocessor.vocabularies[column])
+                .codes
+            )
+
+        return np.hstack([numeric, codes])
+
+    def to_pool(self, rows: slice, **pool_params) -> Pool:
+        """Build a catboost Pool of a slice of rows from the array views
+
+        Args:
+            rows: slice of rows, e.g. from split()
+
+            pool_params: additional Pool parameters, e.g. weight
+
+        Returns:
+            pool: catboost Pool
+
+        """
+
+        return Pool(self.features(rows, 'catboost'),
+                    label=self.label[rows],
+                    **pool_params)
+
+    def to_pools(self,
+                 validation_rounds: int,
+                 test_rounds: int = 0) -> Dict[str, Pool]:
+        """Build the Pools of a chronological split once
+
+        Args:
+            validation_rounds: number of rounds in the validation set
+
+            test_rounds: number of rounds in the test set
+
+        Returns:
+            pools: catboost Pool of each non-empty split
+
+        """
+
+        return {
+            name: self.to_pool(rows)
+            for name, rows in self.split(validation_rounds,
+                                         test_rounds).items()
+            if rows.stop > rows.start
+        }
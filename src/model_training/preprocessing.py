@@ -0,0 +1,371 @@
+from typing import Dict, List, Optional, Tuple, Union
+import json
+import numpy as np
+import pandas as pd
+from catboost import FeaturesData, Pool
+
+
+# Feature types of the model data pulled by src/model_data. SeasonYear is used
+# as an integer feature
+CATEGORICAL_FEATURES: List[str] = [
+    'Driver',
+    'DriverNumber',
+    'Category',
+    'TeamId',
+    'CountryCode',
+    'Country',
+    'Location',
+    'EventName',
+    'SessionType'
+]
+INTEGER_FEATURES: List[str] = [
+    'IsPersonalBest_pr_lap',
+    'RoundNumber',
+    'SeasonYear'
+]
+
+# Columns that are never features
+DROP_COLUMNS: List[str] = ['Time_min', 'Time_max']
+TARGET_COLUMNS: List[str] = [
+    'Points',
+    'Position',
+    'SprintPoints',
+    'SprintPosition'
+]
+
+
+def to_category_strings(values: pd.Series, missing: str) -> np.ndarray:
+    """Convert a column to category strings
+
+    Numeric columns with whole numbers (e.g. DriverNumber read back with
+    missing values as float) are written without decimals, so 44.0 and 44
+    are the same category
+
+    Args:
+        values: the column to convert
+
+        missing: the category used for missing values
+
+    Returns:
+        categories: object array of strings
+
+    """
+
+    if (pd.api.types.is_numeric_dtype(values) and
+            not pd.api.types.is_bool_dtype(values)):
+        non_missing = values.dropna()
+        if (non_missing % 1 == 0).all():
+            values = values.astype('Int64')
+
+    values = values.astype(object)
+
+    return (
+        values.where(values.notna(), missing)
+        .astype(str)
+        .to_numpy(dtype=object)
+    )
+
+
+class FeaturePreprocessor:
+    """Turn model data into model-ready features
+
+    The preprocessor is fitted once on the training data and learns the
+    feature schema (feature names and types) and the vocabulary of each
+    categorical feature. The same fitted preprocessor is then used for
+    tuning (see RayTune), cross-validation, training and inference, so every
+    stage sees exactly the same features in the same order. It is saved to
+    and loaded from JSON.
+
+    Features are ordered numeric first, then categorical. This is the order
+    catboost uses for FeaturesData, so the dataframe and array outputs can be
+    used interchangeably. Missing categorical values are filled with "-1" and
+    missing numeric values with -1
+
+    Args:
+        categorical_features: names of the categorical features. Defaults to
+                              CATEGORICAL_FEATURES
+
+        integer_features: names of the integer features. Defaults to
+                          INTEGER_FEATURES. All other columns that are not
+                          dropped or a target are float features
+
+        drop_columns: columns that are not used as features
+
+        target_columns: response variables, never used as features
+
+    Returns:
+        FeaturesData, Pool, dataframe or encoded array of the features, see
+        transform(), transform_arrays(), to_pool() and encode()
+
+    """
+
+    def __init__(self,
+                 categorical_features: Optional[List[str]] = None,
+                 integer_features: Optional[List[str]] = None,
+                 drop_columns: Optional[List[str]] = None,
+                 target_columns: Optional[List[str]] = None) -> None:
+        self.categorical_features: List[str] = (
+            categorical_features if categorical_features is not None
+            else CATEGORICAL_FEATURES
+        )
+        self.integer_features: List[str] = (
+            integer_features if integer_features is not None
+            else INTEGER_FEATURES
+        )
+        self.drop_columns: List[str] = (
+            drop_columns if drop_columns is not None else DROP_COLUMNS
+        )
+        self.target_columns: List[str] = (
+            target_columns if target_columns is not None else TARGET_COLUMNS
+        )
+        self.missing_category: str = '-1'
+        self.missing_number: float = -1
+
+        # Learned in fit()
+        self.numeric_columns: List[str] = []
+        self.categorical_columns: List[str] = []
+        self.vocabularies: Dict[str, List[str]] = {}
+
+    @property
+    def is_fitted(self) -> bool:
+        return len(self.numeric_columns) + len(self.categorical_columns) > 0
+
+    @property
+    def feature_names(self) -> List[str]:
+        return self.numeric_columns + self.categorical_columns
+
+    @property
+    def cat_feature_indices(self) -> List[int]:
+        return list(range(len(self.numeric_columns), len(self.feature_names)))
+
+    def fit(self, data: pd.DataFrame) -> 'FeaturePreprocessor':
+        """Learn the feature schema and category vocabularies
+
+        Args:
+            data: model data, may include the target and dropped columns
+
+        Returns:
+            self: the fitted preprocessor
+
+        """
+
+        self.fit_schema(list(data.columns))
+
+        self.vocabularies = {
+            column: sorted(set(
+                to_category_strings(data[column], self.missing_category)
+            ))
+            for column in self.categorical_columns
+        }
+
+        return self
+
+    def fit_schema(self, columns: List[str]) -> 'FeaturePreprocessor':
+        """Learn the feature schema (names and types) from the data columns
+
+        Args:
+            columns: columns of the model data, in order
+
+        Returns:
+            self: the preprocessor with its feature schema
+
+        """
+
+        excluded = set(self.drop_columns) | set(self.target_columns)
+        features = [column for column in columns if column not in excluded]
+
+        # Integer features are numeric, even if also listed as categorical
+        self.categorical_columns = [
+            column for column in features
+            if column in self.categorical_features
+            and column not in self.integer_features
+        ]
+        self.numeric_columns = [
+            column for column in features
+            if column not in self.categorical_columns
+        ]
+
+        return self
+
+    def transform_arrays(self,
+                         data: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """Transform model data into numeric and categorical arrays
+
+        Args:
+            data: model data with (at least) the fitted feature columns
+
+        Returns:
+            numeric: C-contiguous float32 array of the numeric features
+
+            categorical: object array of the categorical features as strings
+
+        """
+
+        if not self.is_fitted:
+            raise ValueError("FeaturePreprocessor must be fitted first")
+
+        missing_columns = set(self.feature_names) - set(data.columns)
+        if missing_columns:
+            raise KeyError(f"Missing feature columns: {sorted(missing_columns)}")
+
+        # One pass over all numeric columns
+        numeric = np.ascontiguousarray(
+            data[self.numeric_columns].to_numpy(dtype=np.float32,
+                                                na_value=np.nan)
+        )
+        numeric[np.isnan(numeric)] = self.missing_number
+
+        categorical = np.empty((len(data), len(self.categorical_columns)),
+                               dtype=object)
+        for index, column in enumerate(self.categorical_columns):
+            categorical[:, index] = (
+                to_category_strings(data[column], self.missing_category)
+            )
+
+        return numeric, categorical
+
+    def transform(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Transform model data into a model-ready dataframe
+
+        Args:
+            data: model data with (at least) the fitted feature columns
+
+        Returns:
+            features: dataframe of the features in feature_names order
+
+        """
+
+        numeric, categorical = self.transform_arrays(data)
+        features = pd.concat(
+            [pd.DataFrame(numeric,
+                          columns=self.numeric_columns,
+                          index=data.index),
+             pd.DataFrame(categorical,
+                          columns=self.categorical_columns,
+                          index=data.index)],
+            axis=1
+        )
+
+        return features
+
+    def to_features_data(self, data: pd.DataFrame) -> FeaturesData:
+        """Transform model data into catboost FeaturesData
+
+        FeaturesData holds the numeric and categorical arrays without any
+        further conversion and can be passed to catboost fit(), predict() or
+        Pool() in place of a dataframe (without cat_features)
+
+        Args:
+            data: model data with (at least) the fitted feature columns
+
+        Returns:
+            features_data: catboost FeaturesData
+
+        """
+
+        numeric, categorical = self.transform_arrays(data)
+
+        return FeaturesData(num_feature_data=numeric,
+                            cat_feature_data=categorical,
+                            num_feature_names=self.numeric_columns,
+                            cat_feature_names=self.categorical_columns)
+
+    def to_pool(self,
+                data: pd.DataFrame,
+                label: Optional[Union[pd.Series, np.ndarray]] = None,
+                **pool_params) -> Pool:
+        """Transform model data into a catboost Pool
+
+        Args:
+            data: model data with (at least) the fitted feature columns
+
+            label: optional response variable
+
+            pool_params: additional Pool parameters, e.g. weight or group_id
+
+        Returns:
+            pool: catboost Pool
+
+        """
+
+        return Pool(self.to_features_data(data),
+                    label=None if label is None else np.asarray(label),
+                    **pool_params)
+
+    def encode(self, data: pd.DataFrame) -> np.ndarray:
+        """Transform model data into a single float32 array
+
+        Categorical features are encoded with the index of the category in
+        the fitted vocabulary (-1 for unseen categories). Used for models
+        without native categorical support, e.g. sklearn or lightgbm
+
+        Args:
+            data: model data with (at least) the fitted feature columns
+
+        Returns:
+            encoded: float32 array of the features in feature_names order
+
+        """
+
+        numeric, categorical = self.transform_arrays(data)
+
+        codes = np.empty(categorical.shape, dtype=np.float32)
+        for index, column in enumerate(self.categorical_columns):
+            codes[:, index] = (
+                pd.Categorical(categorical[:, index],
+                               categories=self.vocabularies[column]).codes
+            )
+
+        return np.hstack([numeric, codes])
+
+    def transform_for(self,
+                      data: pd.DataFrame,
+                      model_module: str) -> Union[FeaturesData, np.ndarray]:
+        """Transform model data into the input type of a model library
+
+        Args:
+            data: model data with (at least) the fitted feature columns
+
+            model_module: module of the model, e.g. "catboost"
+
+        Returns:
+            features: FeaturesData for catboost, encoded array otherwise
+
+        """
+
+        if model_module == 'catboost':
+            return self.to_features_data(data)
+        else:
+            return self.encode(data)
+
+    def to_dict(self) -> Dict:
+        return {
+            'categorical_features': self.categorical_features,
+            'integer_features': self.integer_features,
+            'drop_columns': self.drop_columns,
+            'target_columns': self.target_columns,
+            'numeric_columns': self.numeric_columns,
+            'categorical_columns': self.categorical_columns,
+            'vocabularies': self.vocabularies
+        }
+
+    @classmethod
+    def from_dict(cls, schema: Dict) -> 'FeaturePreprocessor':
+        preprocessor = cls(schema['categorical_features'],
+                           schema['integer_features'],
+                           schema['drop_columns'],
+                           schema['target_columns'])
+        preprocessor.numeric_columns = schema['numeric_columns']
+        preprocessor.categorical_columns = schema['categorical_columns']
+        preprocessor.vocabularies = schema['vocabularies']
+
+        return preprocessor
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as schema_file:
+            json.dump(self.to_dict(), schema_file)
+
+    @classmethod
+    def load(cls, path: str) -> 'FeaturePreprocessor':
+        with open(path) as schema_file:
+            return cls.from_dict(json.load(schema_file))
@@ -0,0 +1,304 @@
+from typing import Any, Dict, Optional
+from importlib import import_module
+import numpy as np
+import pandas as pd
+
+from src.model_training.preprocessing import FeaturePreprocessor
+
+
+# Race points of positions 1 to 10, every other position scores 0
+POINTS_BY_POSITION: np.ndarray = np.array([25, 18, 15, 12, 10, 8, 6, 4, 2, 1])
+
+# Positions with a relevance above 0, relevance of position p is
+# RELEVANT_POSITIONS + 1 - p
+RELEVANT_POSITIONS: int = 20
+
+
+def event_group_ids(data: pd.DataFrame) -> np.ndarray:
+    """Query group of every row, one group per event (SeasonYear+RoundNumber)"""
+
+    return (
+        data['SeasonYear'].to_numpy(dtype=np.int64) * 100 +
+        data['RoundNumber'].to_numpy(dtype=np.int64)
+    )
+
+
+def position_relevance(position: pd.Series) -> np.ndarray:
+    """Ranking label of a finishing position, higher is better
+
+    Args:
+        position: finishing positions, missing for drivers without one
+
+    Returns:
+        relevance: RELEVANT_POSITIONS + 1 - position, at least 0 (also for
+                   missing positions)
+
+    """
+
+    position = position.to_numpy(dtype=np.float64, na_value=np.nan)
+    relevance = np.clip(RELEVANT_POSITIONS + 1 - position, 0, None)
+
+    return np.nan_to_num(relevance, nan=0)
+
+
+def position_points(position: np.ndarray) -> np.ndarray:
+    """Map positions (1 = winner) to race points"""
+
+    position = np.asarray(position, dtype=np.int64)
+    scores_points = (position >= 1) & (position <= len(POINTS_BY_POSITION))
+
+    return np.where(
+        scores_points,
+        POINTS_BY_POSITION[np.clip(position - 1, 0, len(POINTS_BY_POSITION) - 1)],
+        0
+    )
+
+
+def rank_within_groups(groups: np.ndarray,
+                       values: np.ndarray,
+                       ascending: bool = True) -> np.ndarray:
+    """Rank values within each group in one vectorized pass
+
+    Missing values are ranked last, ties keep their row order
+
+    Args:
+        groups: group of every row
+
+        values: values to rank
+
+        ascending: rank 1 is the smallest value when True, else the largest
+
+    Returns:
+        ranks: rank (1, 2, ...) of every row within its group
+
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    is_missing = np.isnan(values)
+    sort_values = np.where(is_missing, 0, values if ascending else -values)
+
+    # Sort by group, then missing last, then value
+    order = np.lexsort((sort_values, is_missing, groups))
+    sorted_groups = groups[order]
+
+    group_start = np.ones(len(order), dtype=bool)
+    group_start[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    start_index = np.maximum.accumulate(
+        np.where(group_start, np.arange(len(order)), 0)
+    )
+
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - start_index + 1
+
+    return ranks
+
+
+def rank_events(data: pd.DataFrame, scores: np.ndarray) -> pd.DataFrame:
+    """Rank all drivers of every event at once
+
+    The session scores of a driver are averaged to one score per driver and
+    event (same as backtest_round()), then every event is ranked in one
+    vectorized call and the predicted positions are mapped to points
+
+    Args:
+        data: model data rows, with SeasonYear, RoundNumber and DriverNumber
+              (and Position/Points when known)
+
+        scores: ranking score of every row, higher is better
+
+    Returns:
+        ranked: one row per driver and event with Score, PredictedPosition,
+                ExpectedPoints and (when known) Position and Points
+
+    """
+
+    driver_data = data[['SeasonYear', 'RoundNumber', 'DriverNumber']].copy()
+    driver_data['Score'] = np.asarray(scores, dtype=np.float64)
+
+    aggregations = {'Score': ('Score', 'mean')}
+    for column in ['EventName', 'Position', 'Points']:
+        if column in data.columns:
+            driver_data[column] = data[column].to_numpy()
+            aggregations[column] = (column, 'first')
+
+    ranked = (
+        driver_data
+        .groupby(['SeasonYear', 'RoundNumber', 'DriverNumber'], sort=True)
+        .agg(**aggregations)
+        .reset_index()
+    )
+
+    ranked['PredictedPosition'] = rank_within_groups(
+        event_group_ids(ranked), ranked['Score'].to_numpy(), ascending=False
+    )
+    ranked['ExpectedPoints'] = position_points(ranked['PredictedPosition'])
+
+    return ranked
+
+
+def event_ranking_metrics(ranked: pd.DataFrame, k: int = 10) -> pd.DataFrame:
+    """Ranking metrics of every event, computed for all events at once
+
+    Args:
+        ranked: output of rank_events() with the actual Position and Points
+
+        k: cutoff of NDCG@k and the top-k hits
+
+    Returns:
+        metrics: one row per event with Drivers, Spearman, NDCG@k, TopKHits,
+                 WinnerHit and PointsMAE
+
+    """
+
+    groups = event_group_ids(ranked)
+    event_ids, event_index = np.unique(groups, return_inverse=True)
+    n_events = len(event_ids)
+
+    def event_sum(values: np.ndarray) -> np.ndarray:
+        return np.bincount(event_index, weights=values, minlength=n_events)
+
+    predicted = ranked['PredictedPosition'].to_numpy(dtype=np.float64)
+    actual = rank_within_groups(
+        groups, ranked['Position'].to_numpy(dtype=np.float64)
+    ).astype(np.float64)
+    drivers = np.bincount(event_index, minlength=n_events)
+
+    # Spearman: Pearson correlation of the ranks per event
+    predicted_centered = predicted - (event_sum(predicted) / drivers)[event_index]
+    actual_centered = actual - (event_sum(actual) / drivers)[event_index]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        spearman = (
+            event_sum(predicted_centered * actual_centered) /
+            np.sqrt(event_sum(predicted_centered ** 2) *
+                    event_sum(actual_centered ** 2))
+        )
+
+    # NDCG@k with the position relevance as gain
+    gain = position_relevance(ranked['Position'])
+    dcg = event_sum(np.where(predicted <= k, gain / np.log2(predicted + 1), 0))
+    ideal_dcg = event_sum(np.where(actual <= k, gain / np.log2(actual + 1), 0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ndcg = dcg / ideal_dcg
+
+    top_k_hits = event_sum(((predicted <= k) & (actual <= k)).astype(float))
+    winner_hit = event_sum(((predicted == 1) & (actual == 1)).astype(float))
+    points_error = np.abs(
+        ranked['ExpectedPoints'].to_numpy(dtype=np.float64) -
+        ranked['Points'].to_numpy(dtype=np.float64, na_value=0)
+    )
+
+    return pd.DataFrame({
+        'SeasonYear': event_ids // 100,
+        'RoundNumber': event_ids % 100,
+        'Drivers': drivers,
+        'Spearman': spearman,
+        f'NDCG@{k}': ndcg,
+        f'Top{k}Hits': top_k_hits.astype(int),
+        'WinnerHit': winner_hit.astype(bool),
+        'PointsMAE': event_sum(points_error) / drivers
+    })
+
+
+class EventRanker:
+    """Ranking mode: rank the drivers of each event instead of predicting points
+
+    The model is trained with a ranking objective (e.g. catboost YetiRank)
+    with one query group per event (SeasonYear+RoundNumber), so it learns
+    the order of the drivers within an event directly. The label is the
+    position relevance (see position_relevance()). Every session row of a
+    driver is part of the event's group.
+
+    Scoring is batched: all rows of all requested events are scored in one
+    predict call and ranked per event at once (see rank_events()), and the
+    predicted positions are mapped to points. The model and preprocessor
+    can be registered in the ModelRegistry like any other catboost model
+
+    Args:
+        params: params of the ranking model, e.g. {'loss_function':
+                'YetiRank'}
+
+        model_module: string name of the module of the model
+
+        model_class_str: string name of the ranking model class
+
+        preprocessor: optional fitted FeaturePreprocessor, fitted on the
+                      training data when not given
+
+    Returns:
+        ranked drivers per event, see rank() and evaluate()
+
+    """
+
+    def __init__(self,
+                 params: Dict[str, Any],
+                 model_module: str = 'catboost',
+                 model_class_str: str = 'CatBoostRanker',
+                 preprocessor: Optional[FeaturePreprocessor] = None) -> None:
+        self.params: Dict[str, Any] = params
+        self.model_module: str = model_module
+        self.model_class_str: str = model_class_str
+        self.preprocessor: Optional[FeaturePreprocessor] = preprocessor
+        self.model = None
+
+    def to_pool(self, data: pd.DataFrame):
+        """Event-grouped catboost Pool, rows sorted by group"""
+
+        # Groups must be contiguous
+        data = data.iloc[np.argsort(event_group_ids(data), kind='stable')]
+
+        return self.preprocessor.to_pool(
+            data,
+            position_relevance(data['Position']),
+            group_id=event_group_ids(data)
+        )
+
+    def fit(self,
+            data: pd.DataFrame,
+            eval_data: Optional[pd.DataFrame] = None) -> 'EventRanker':
+        """Train the ranking model
+
+        Args:
+            data: model data with Position, SeasonYear and RoundNumber
+
+            eval_data: optional model data of later events for evaluation
+                       (e.g. early stopping)
+
+        Returns:
+            self: the fitted ranker
+
+        """
+
+        if self.preprocessor is None:
+            self.preprocessor = FeaturePreprocessor().fit(data)
+
+        # Allow for dynamic model definitions
+        model_class = getattr(import_module(self.model_module),
+                              self.model_class_str)
+        self.model = model_class(**self.params)
+
+        if eval_data is not None:
+            self.model.fit(self.to_pool(data), eval_set=self.to_pool(eval_data))
+        else:
+            self.model.fit(self.to_pool(data))
+
+        return self
+
+    def rank(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Score all rows in one call and rank the drivers of every event
+
+        Args:
+            data: model data of one or more events
+
+        Returns:
+            ranked: see rank_events()
+
+        """
+
+        scores = self.model.predict(self.preprocessor.to_features_data(data))
+
+        return rank_events(data, scores)
+
+    def evaluate(self, data: pd.DataFrame, k: int = 10) -> pd.DataFrame:
+        """Ranking metrics of every event in the data, see event_ranking_metrics()"""
+
+        return event_ranking_metrics(self.rank(data), k)
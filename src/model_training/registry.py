@@ -0,0 +1,398 @@
+from typing import Any, Dict, List, Optional
+from importlib import import_module
+import datetime
+import json
+import os
+import re
+import shutil
+import tempfile
+import pandas as pd
+
+from src.model_training.preprocessing import FeaturePreprocessor
+
+
+def get_data_watermark(data: pd.DataFrame) -> Dict[str, int]:
+    """Obtain the last season and round (and size) of a training dataset
+
+    Args:
+        data: model data with SeasonYear and RoundNumber columns
+
+    Returns:
+        watermark: dictionary with SeasonYear, RoundNumber and Rows
+
+    """
+
+    last_event = (
+        data[['SeasonYear', 'RoundNumber']]
+        .drop_duplicates()
+        .sort_values(['SeasonYear', 'RoundNumber'])
+        .iloc[-1]
+    )
+
+    return {
+        'SeasonYear': int(last_event['SeasonYear']),
+        'RoundNumber': int(last_event['RoundNumber']),
+        'Rows': int(len(data))
+    }
+
+
+class RegisteredModel:
+    """A model version stored in a ModelRegistry
+
+    Only the metadata is read when a version is opened. The model itself, the
+    preprocessor and the feature importance are loaded from disk the first
+    time they are used, so opening a version (or switching between versions)
+    is cheap. Models are stored in the native format of their library (e.g.
+    .cbm for catboost) and loaded with the library's own loader, which reads
+    the binary file directly. Models without a native format are stored with
+    joblib and memory-mapped on load
+
+    Args:
+        path: the directory of the model version
+
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        with open(os.path.join(path, 'metadata.json')) as metadata_file:
+            self.metadata: Dict[str, Any] = json.load(metadata_file)
+        self.version: str = self.metadata['version']
+        self._model = None
+        self._preprocessor: Optional[FeaturePreprocessor] = None
+        self._feature_importance: Optional[pd.DataFrame] = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            # Allow for dynamic model definitions
+            model_module = import_module(self.metadata['model_module'])
+            model_class = getattr(model_module,
+                                  self.metadata['model_class_str'])
+            model_path = os.path.join(self.path, self.metadata['model_file'])
+
+            if self.metadata['model_file'].endswith('.joblib'):
+                joblib = import_module('joblib')
+                self._model = joblib.load(model_path, mmap_mode='r')
+            else:
+                self._model = model_class()
+                self._model.load_model(model_path)
+
+        return self._model
+
+    @property
+    def preprocessor(self) -> FeaturePreprocessor:
+        if self._preprocessor is None:
+            self._preprocessor = FeaturePreprocessor.load(
+                os.path.join(self.path, 'preprocessor.json')
+            )
+
+        return self._preprocessor
+
+    @property
+    def feature_importance(self) -> pd.DataFrame:
+        if self._feature_importance is None:
+            self._feature_importance = pd.read_csv(
+                os.path.join(self.path, 'feature_importance.csv')
+            )
+
+        return self._feature_importance
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return self.metadata['params']
+
+    @property
+    def data_watermark(self) -> Dict[str, int]:
+        return self.metadata['data_watermark']
+
+    def predict(self, data: pd.DataFrame):
+        """Predict model data with the version's preprocessor and model
+
+        Args:
+            data: model data with (at least) the feature columns
+
+        Returns:
+            predictions: the model predictions
+
+        """
+
+        features = (
+            self.preprocessor.transform_for(data,
+                                            self.metadata['model_module'])
+        )
+
+        return self.model.predict(features)
+
+
+class ModelRegistry:
+    """Local registry of trained model versions
+
+    Each registered version is a directory holding everything needed to use
+    the model without retraining:
+        model.<format>: the trained model in the library's native format
+        preprocessor.json: the fitted FeaturePreprocessor (feature schema)
+        feature_importance.csv: feature importance of the trained model
+        tuning_trials.csv: one row per RayTune trial (if tuning results are
+                           passed in)
+        metadata.json: model class, params, metrics, data watermark and
+                       tuning lineage (best config and score)
+
+    Versions are numbered (v0001, v0002, ...). A version is written to a
+    temporary directory and renamed into place, so a crashed or concurrent
+    registration never leaves (or takes) a half-written version. Aliases
+    such as "production"
+    can point to a version, see promote(). Ray is not imported by the
+    registry, tuning results are only read when a model is registered, which
+    keeps a prediction process quick to start
+
+    Args:
+        root: the directory holding the registry. Created if it does not exist
+
+    Returns:
+        RegisteredModel objects, see load()
+
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root: str = root
+        self.loaded: Dict[str, RegisteredModel] = {}
+
+    @property
+    def aliases_path(self) -> str:
+        return os.path.join(self.root, 'aliases.json')
+
+    def versions(self) -> List[str]:
+        if not os.path.exists(self.root):
+            return []
+
+        return sorted(
+            name for name in os.listdir(self.root)
+            if name.startswith('v') and
+            os.path.exists(os.path.join(self.root, name, 'metadata.json'))
+        )
+
+    def next_version_number(self) -> int:
+        """One more than the highest vNNNN directory, complete or not"""
+
+        if not os.path.exists(self.root):
+            return 1
+
+        numbers = [
+            int(match.group(1)) for match in
+            (re.fullmatch(r'v(\d+)', name) for name in os.listdir(self.root))
+            if match
+        ]
+
+        return max(numbers, default=0) + 1
+
+    def aliases(self) -> Dict[str, str]:
+        if not os.path.exists(self.aliases_path):
+            return {}
+
+        with open(self.aliases_path) as aliases_file:
+            return json.load(aliases_file)
+
+    def promote(self, version: str, alias: str = 'production') -> None:
+        """Point an alias, e.g. "production", to a model version
+
+        Args:
+            version: the model version, e.g. v0003
+
+            alias: name of the alias
+
+        Returns:
+            None
+
+        """
+
+        if version not in self.versions():
+            raise ValueError(f"Unknown model version {version}")
+
+        aliases = self.aliases()
+        aliases[alias] = version
+        with open(self.aliases_path, 'w') as aliases_file:
+            json.dump(aliases, aliases_file, indent=2)
+
+    @staticmethod
+    def tuning_lineage(tuning_results,
+                       metric: str,
+                       mode: str) -> Dict[str, Any]:
+        """Summarize the RayTune results that produced the model params
+
+        Args:
+            tuning_results: the ResultGrid returned by RayTune.tuner()
+
+            metric: the metric the tuning optimized
+
+            mode: "min" or "max"
+
+        Returns:
+            lineage: the tuning metric, best config and score, and number of
+                     trials
+
+        """
+
+        best_result = tuning_results.get_best_result(metric=metric, mode=mode)
+
+        return {
+            'metric': metric,
+            'mode': mode,
+            'best_config': best_result.config,
+            'best_score': best_result.metrics.get(metric),
+            'num_trials': len(tuning_results)
+        }
+
+    def register(self,
+                 model,
+                 preprocessor: FeaturePreprocessor,
+                 model_module: str,
+                 model_class_str: str,
+                 params: Dict[str, Any],
+                 data_watermark: Dict[str, int],
+                 metrics: Optional[Dict[str, float]] = None,
+                 tuning_results=None,
+                 tuning_metric: Optional[str] = None,
+                 tuning_mode: str = 'min',
+                 parent_version: Optional[str] = None,
+                 retraining: Optional[Dict[str, Any]] = None) -> str:
+        """Save a trained model as a new version
+
+        Args:
+            model: the trained model
+
+            preprocessor: the fitted FeaturePreprocessor used for training
+
+            model_module: string name of the module of the model, e.g.
+                          "catboost"
+
+            model_class_str: string name of the model class, e.g.
+                             "CatBoostRegressor"
+
+            params: the params the model was trained with
+
+            data_watermark: the last season/round of the training data, see
+                            get_data_watermark()
+
+            metrics (optional): evaluation metrics of the model
+
+            tuning_results (optional): ResultGrid returned by RayTune.tuner()
+
+            tuning_metric (optional): the metric the tuning optimized.
+                                      Required with tuning_results
+
+            tuning_mode (optional): "min" or "max"
+
+            parent_version (optional): version the model was trained from,
+                                       e.g. for warm-started models
+
+            retraining (optional): retraining information, see
+                                   IncrementalRetrainer in retrain.py
+
+        Returns:
+            version: the new model version, e.g. v0003
+
+        """
+
+        # Written to a temporary directory, renamed into place at the end
+        os.makedirs(self.root, exist_ok=True)
+        path = tempfile.mkdtemp(prefix='.register-', dir=self.root)
+
+        try:
+            # Native model format where the library has one
+            if hasattr(model, 'save_model'):
+                model_file = (
+                    'model.cbm' if model_module == 'catboost' else 'model.bin'
+                )
+                model.save_model(os.path.join(path, model_file))
+            else:
+                joblib = import_module('joblib')
+                model_file = 'model.joblib'
+                joblib.dump(model, os.path.join(path, model_file))
+
+            preprocessor.save(os.path.join(path, 'preprocessor.json'))
+
+            feature_importance = (
+                pd.DataFrame({'Feature': preprocessor.feature_names,
+                              'Importance': model.feature_importances_})
+                .sort_values('Importance', ascending=False)
+                .reset_index(drop=True)
+            )
+            feature_importance.to_csv(
+                os.path.join(path, 'feature_importance.csv'), index=False
+            )
+
+            lineage = None
+            if tuning_results is not None:
+                if tuning_metric is None:
+                    raise ValueError(
+                        "tuning_metric is required with tuning_results"
+                    )
+                lineage = self.tuning_lineage(tuning_results,
+                                              tuning_metric,
+                                              tuning_mode)
+                tuning_results.get_dataframe().to_csv(
+                    os.path.join(path, 'tuning_trials.csv'), index=False
+                )
+
+            metadata = {
+                'version': None,
+                'created': datetime.datetime.utcnow().isoformat(),
+                'model_module': model_module,
+                'model_class_str': model_class_str,
+                'model_file': model_file,
+                'params': params,
+                'metrics': metrics if metrics else {},
+                'data_watermark': data_watermark,
+                'tuning_lineage': lineage,
+                'parent_version': parent_version,
+                'retraining': retraining if retraining else {}
+            }
+
+            # A concurrent registration can take the same number first
+            while True:
+                version = f'v{self.next_version_number():04d}'
+                metadata['version'] = version
+                with open(os.path.join(path, 'metadata.json'),
+                          'w') as metadata_file:
+                    json.dump(metadata, metadata_file, indent=2, default=str)
+
+                try:
+                    os.rename(path, os.path.join(self.root, version))
+                    return version
+                except OSError:
+                    if not os.path.exists(os.path.join(self.root, version)):
+                        raise
+        except BaseException:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+
+    def load(self, version: Optional[str] = None) -> RegisteredModel:
+        """Open a model version
+
+        Opened versions are kept, so switching back to a version does not
+        read it again
+
+        Args:
+            version: model version (e.g. v0003) or alias (e.g. production).
+                     Defaults to the latest version
+
+        Returns:
+            registered_model: the RegisteredModel, loaded lazily
+
+        """
+
+        versions = self.versions()
+        if len(versions) == 0:
+            raise FileNotFoundError(f"No registered models in {self.root}")
+
+        version = version if version else versions[-1]
+        version = self.aliases().get(version, version)
+        if version not in versions:
+            raise ValueError(f"Unknown model version {version}")
+
+        if version not in self.loaded:
+            self.loaded[version] = (
+                RegisteredModel(os.path.join(self.root, version))
+            )
+
+        return self.loaded[version]
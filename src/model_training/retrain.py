@@ -0,0 +1,349 @@
+from typing import Any, Dict, List, Optional, Tuple
+from importlib import import_module
+import numpy as np
+import pandas as pd
+
+from src.model_data.monitor import DataMonitor
+from src.model_data.partitions import RoundPartitions
+from src.model_training.preprocessing import FeaturePreprocessor
+from src.model_training.registry import (
+    ModelRegistry,
+    RegisteredModel,
+    get_data_watermark
+)
+
+
+# catboost can only continue training (init_model) on CPU
+GPU_PARAMS: List[str] = ['task_type', 'gpu_ram_part', 'devices']
+
+FULL_RETRAIN = 'full'
+WARM_START = 'warm_start'
+
+
+class IncrementalRetrainer:
+    """Retrain the model after each race weekend
+
+    Instead of retraining on the full multi-season history every week, the
+    registered previous model is warm-started: new trees are added on the
+    rows of the new rounds only (catboost init_model), with the previous
+    model's preprocessor so the features stay the same. Weekly retrain cost
+    then scales with the new rounds instead of the whole history.
+
+    A full retrain on every stored round is done instead when:
+        1) There is no previous model, or the model is not a catboost model
+        2) full_retrain_every warm starts have been done since the last full
+           retrain (schedule)
+        3) The new rounds add columns the previous preprocessor does not know,
+           or miss one of its feature columns (schema change). The
+           out-of-sample RMSE is then not computed
+        4) Data drift: the DataMonitor (if given) flags numeric drift in a
+           new round
+        5) Drift: the previous model's RMSE on the new rounds (which it has
+           not seen) is more than drift_threshold times its reference RMSE.
+           The reference is the first such out-of-sample RMSE after the last
+           full retrain
+
+    Older seasons can be weighted down with season_decay in a full retrain,
+    the weight of a row is season_decay ** (latest season - SeasonYear). A
+    warm start only trains on the new rounds, which are the latest season,
+    so its rows are not weighted
+
+    With a DataMonitor, the new rounds are checked before retraining and
+    retrain() raises a ValueError for rounds with quality flags (schema
+    change, null rate increase or unseen categories, see
+    src/model_data/monitor.py). Rounds with drift flags are retrained on
+    from scratch (4). After a full retrain the training rounds become the
+    monitor's baseline
+
+    Args:
+        registry: the ModelRegistry holding the previous model, new models
+                  are registered to it
+
+        partitions: RoundPartitions holding the model data
+
+        params: the (tuned) params of the model
+
+        model_module: string name of the module of the model
+
+        model_class_str: string name of the model class
+
+        target: the response variable
+
+        warm_start_iterations: number of trees added per warm start
+
+        season_decay: optional weight decay per season in a full retrain,
+                      e.g. 0.8
+
+        full_retrain_every: number of warm starts before a scheduled full
+                            retrain
+
+        drift_threshold: ratio of out-of-sample RMSE to reference RMSE that
+                         triggers a full retrain
+
+        monitor: optional DataMonitor checking the new rounds
+
+    Returns:
+        version: the registered model version, see retrain()
+
+    """
+
+    def __init__(self,
+                 registry: ModelRegistry,
+                 partitions: RoundPartitions,
+                 params: Dict[str, Any],
+                 model_module: str = 'catboost',
+                 model_class_str: str = 'CatBoostRegressor',
+                 target: str = 'Points',
+                 warm_start_iterations: int = 20,
+                 season_decay: Optional[float] = None,
+                 full_retrain_every: int = 10,
+                 drift_threshold: float = 1.25,
+                 monitor: Optional[DataMonitor] = None) -> None:
+        self.registry: ModelRegistry = registry
+        self.partitions: RoundPartitions = partitions
+        self.params: Dict[str, Any] = params
+        self.model_module: str = model_module
+        self.model_class_str: str = model_class_str
+        self.target: str = target
+        self.warm_start_iterations: int = warm_start_iterations
+        self.season_decay: Optional[float] = season_decay
+        self.full_retrain_every: int = full_retrain_every
+        self.drift_threshold: float = drift_threshold
+        self.monitor: Optional[DataMonitor] = monitor
+
+    @property
+    def model_class(self):
+        # Allow for dynamic model definitions
+        return getattr(import_module(self.model_module), self.model_class_str)
+
+    def new_rounds(self, previous: RegisteredModel) -> List[Tuple[int, int]]:
+        """Obtain the stored rounds after the previous model's watermark"""
+
+        watermark = (
+            previous.data_watermark['SeasonYear'],
+            previous.data_watermark['RoundNumber']
+        )
+
+        return [
+            stored_round for stored_round in self.partitions.rounds()
+            if stored_round > watermark
+        ]
+
+    def season_weights(self, data: pd.DataFrame) -> Optional[np.ndarray]:
+        if self.season_decay is None:
+            return None
+
+        seasons_back = data['SeasonYear'].max() - data['SeasonYear']
+
+        return np.power(self.season_decay, seasons_back.to_numpy())
+
+    def out_of_sample_rmse(self,
+                           previous: RegisteredModel,
+                           new_data: pd.DataFrame) -> float:
+        predictions = previous.predict(new_data)
+
+        return float(
+            np.sqrt(np.mean((predictions - new_data[self.target]) ** 2))
+        )
+
+    @staticmethod
+    def schema_changed(previous: RegisteredModel,
+                       new_data: pd.DataFrame) -> bool:
+        """Whether the new rounds have unknown columns or miss a feature"""
+
+        known_columns = (
+            set(previous.preprocessor.feature_names) |
+            set(previous.preprocessor.drop_columns) |
+            set(previous.preprocessor.target_columns)
+        )
+
+        return bool(
+            set(new_data.columns) - known_columns or
+            set(previous.preprocessor.feature_names) - set(new_data.columns)
+        )
+
+    def choose_mode(self,
+                    previous: Optional[RegisteredModel],
+                    new_data: pd.DataFrame,
+                    oos_rmse: Optional[float],
+                    data_drift: bool = False) -> Tuple[str, str]:
+        """Decide between a warm start and a full retrain
+
+        Args:
+            previous: the previous registered model, if any
+
+            new_data: model data of the new rounds
+
+            oos_rmse: the previous model's RMSE on the new rounds
+
+            data_drift: whether the DataMonitor flagged drift in a new round
+
+        Returns:
+            mode: FULL_RETRAIN or WARM_START
+
+            reason: why the mode was chosen
+
+        """
+
+        if previous is None:
+            return FULL_RETRAIN, 'no previous model'
+        if self.model_module != 'catboost':
+            return FULL_RETRAIN, 'warm start is only supported for catboost'
+
+        retraining = previous.metadata.get('retraining', {})
+        if retraining.get('warm_starts', 0) >= self.full_retrain_every:
+            return FULL_RETRAIN, 'schedule'
+
+        if self.schema_changed(previous, new_data):
+            return FULL_RETRAIN, 'schema change'
+
+        if data_drift:
+            return FULL_RETRAIN, 'data drift'
+
+        reference_rmse = retraining.get('reference_rmse')
+        if (reference_rmse is not None and oos_rmse is not None and
+                oos_rmse > self.drift_threshold * reference_rmse):
+            return FULL_RETRAIN, 'drift'
+
+        return WARM_START, 'new rounds'
+
+    def fit_full(self) -> Tuple[Any, FeaturePreprocessor, pd.DataFrame]:
+        """Train a new model on every stored round"""
+
+        data = self.partitions.read().dropna(subset=[self.target])
+        preprocessor = FeaturePreprocessor().fit(data)
+
+        model = self.model_class(**self.params)
+        features = preprocessor.transform_for(data, self.model_module)
+        weights = self.season_weights(data)
+        if weights is not None:
+            model.fit(features, data[self.target], sample_weight=weights)
+        else:
+            model.fit(features, data[self.target])
+
+        return model, preprocessor, data
+
+    def fit_warm_start(self,
+                       previous: RegisteredModel,
+                       new_data: pd.DataFrame) -> Any:
+        """Add trees to the previous model on the new rounds only"""
+
+        warm_params = {
+            key: value for key, value in self.params.items()
+            if key not in GPU_PARAMS
+        }
+        warm_params['iterations'] = self.warm_start_iterations
+
+        pool = previous.preprocessor.to_pool(new_data, new_data[self.target])
+        model = self.model_class(**warm_params)
+        model.fit(pool, init_model=previous.model)
+
+        return model
+
+    def retrain(self, version: Optional[str] = 'production') -> str:
+        """Retrain after new rounds have been added to the partitions
+
+        Args:
+            version: the previous model version or alias. Falls back to the
+                     latest version if the alias does not exist
+
+        Returns:
+            version: the new model version, or the previous version when
+                     there are no new rounds
+
+        """
+
+        previous = None
+        if self.registry.versions():
+            try:
+                previous = self.registry.load(version)
+            except ValueError:
+                previous = self.registry.load()
+
+        new_data = pd.DataFrame()
+        oos_rmse = None
+        data_drift = False
+        if previous is not None:
+            new_rounds = self.new_rounds(previous)
+            if len(new_rounds) == 0:
+                return previous.version
+
+            new_data = (
+                self.partitions.read(new_rounds)
+                .dropna(subset=[self.target])
+            )
+            if len(new_data) == 0:
+                return previous.version
+
+            # Flag bad rounds before they reach the model
+            if self.monitor is not None:
+                report = self.monitor.update(new_data)
+                bad_rounds = report[report['Flags'].str.len() > 0]
+                if len(bad_rounds) > 0:
+                    raise ValueError(
+                        "Bad rounds, not retraining: " +
+                        '; '.join(
+                            f"{season}-{round_number}: {', '.join(flags)}"
+                            for season, round_number, flags
+                            in zip(bad_rounds['SeasonYear'],
+                                   bad_rounds['RoundNumber'],
+                                   bad_rounds['Flags'])
+                        )
+                    )
+
+                # Drifted rounds are retrained on from scratch
+                data_drift = bool((report['DriftFlags'].str.len() > 0).any())
+
+            # The previous model can not predict data with another schema
+            if not self.schema_changed(previous, new_data):
+                oos_rmse = self.out_of_sample_rmse(previous, new_data)
+
+        mode, reason = self.choose_mode(previous,
+                                        new_data,
+                                        oos_rmse,
+                                        data_drift)
+
+        if mode == FULL_RETRAIN:
+            model, preprocessor, data = self.fit_full()
+            retraining = {
+                'mode': mode,
+                'reason': reason,
+                'warm_starts': 0,
+                'reference_rmse': None,
+                'out_of_sample_rmse': oos_rmse
+            }
+            watermark = get_data_watermark(data)
+            if self.monitor is not None:
+                training_rounds = (
+                    data[['SeasonYear', 'RoundNumber']]
+                    .drop_duplicates()
+                    .itertuples(index=False, name=None)
+                )
+                self.monitor.set_baseline(list(training_rounds))
+        else:
+            model = self.fit_warm_start(previous, new_data)
+            preprocessor = previous.preprocessor
+            retraining = previous.metadata.get('retraining', {})
+            reference_rmse = retraining.get('reference_rmse')
+            retraining = {
+                'mode': mode,
+                'reason': reason,
+                'warm_starts': retraining.get('warm_starts', 0) + 1,
+                'reference_rmse': (
+                    reference_rmse if reference_rmse is not None else oos_rmse
+                ),
+                'out_of_sample_rmse': oos_rmse
+            }
+            watermark = get_data_watermark(new_data)
+            watermark['Rows'] += previous.data_watermark['Rows']
+
+        return self.registry.register(
+            model,
+            preprocessor,
+            self.model_module,
+            self.model_class_str,
+            self.params,
+            watermark,
+            parent_version=previous.version if previous else None,
+            retraining=retraining
+        )
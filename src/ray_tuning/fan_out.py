@@ -0,0 +1,515 @@
+from typing import Any, Dict, List, Optional
+from importlib import import_module
+import time
+import numpy as np
+import pandas as pd
+
+import ray
+from ray import tune
+from ray.air import RunConfig
+
+from src.ray_tuning.ray_tune import RayTune
+from src.ray_tuning.trial_cache import TrialCache
+
+
+# Data keys that belong to a model family, not to the shared data
+FAMILY_KEYS: List[str] = ['model_module', 'model_class_str', 'fit_params']
+
+# Fit params and params that need an evaluation set, left out of the
+# out-of-fold and final fits
+EVAL_SET_PARAMS: List[str] = [
+    'eval_set',
+    'early_stopping_rounds',
+    'early_stopping',
+    'use_best_model'
+]
+
+
+def data_kind(model_module: str, has_preprocessor: bool) -> str:
+    """Input type of a model library, families of the same kind share data"""
+
+    if not has_preprocessor:
+        return 'raw'
+
+    return 'catboost' if model_module == 'catboost' else 'encoded'
+
+
+def take_rows(features, index: np.ndarray):
+    """Select rows of a DataFrame, array or catboost FeaturesData"""
+
+    if hasattr(features, 'iloc'):
+        return features.iloc[index]
+    elif hasattr(features, 'num_feature_data'):
+        # catboost FeaturesData, either part can be None
+        FeaturesData = getattr(import_module('catboost'), 'FeaturesData')
+        num_feature_data = features.num_feature_data
+        cat_feature_data = features.cat_feature_data
+        return FeaturesData(
+            num_feature_data=(
+                np.ascontiguousarray(num_feature_data[index])
+                if num_feature_data is not None else None
+            ),
+            cat_feature_data=(
+                np.ascontiguousarray(cat_feature_data[index])
+                if cat_feature_data is not None else None
+            ),
+            num_feature_names=features.num_feature_names,
+            cat_feature_names=features.cat_feature_names
+        )
+
+    return np.asarray(features)[index]
+
+
+def model_spec(family: Dict) -> Dict:
+    """Model part of a family spec, the part sent to the Ray workers"""
+
+    return {key: family.get(key) for key in FAMILY_KEYS}
+
+
+def family_fit_params(family: Dict, data: Dict) -> Dict:
+    """Fit params of a family for the prepared (shared) data"""
+
+    fit_params = dict(family.get('fit_params') or {})
+    if data.get('has_preprocessor'):
+        fit_params.pop('cat_features', None)
+    if 'eval_set' in fit_params:
+        if data.get('validation_data'):
+            fit_params['eval_set'] = data['validation_data']
+        elif data.get('has_preprocessor'):
+            # The raw eval_set does not match the transformed features
+            raise ValueError(f"Family {family.get('model_class_str')} has an "
+                             f"eval_set, but the data has no validation_data")
+
+    return fit_params
+
+
+def family_objective(config: Dict, data_ref: Any, family: Dict) -> None:
+    """RayTune.objective() on the shared data of the family's kind
+
+    The data is read from the Ray object store by reference, so every trial
+    of every family reads the same copy
+    """
+
+    data = ray.get(data_ref)
+    family_data = {
+        **data,
+        'model_module': family['model_module'],
+        'model_class_str': family['model_class_str'],
+        'fit_params': family_fit_params(family, data)
+    }
+
+    RayTune.objective(config, family_data)
+
+
+def fit_predict(data: Dict,
+                family: Dict,
+                config: Dict,
+                train_index: Optional[np.ndarray],
+                predict_index: Optional[np.ndarray]):
+    """Fit a family's model on rows of the training data and predict rows
+
+    Args:
+        data: prepared shared data of the family's kind
+
+        family: the model spec of the family, see model_spec()
+
+        config: params of the model
+
+        train_index: rows to fit on, all rows when None
+
+        predict_index: rows to predict, None to return the fitted model
+
+    Returns:
+        predictions of the predict rows, or the fitted model
+
+    """
+
+    # Allow for dynamic model definitions
+    model_class = getattr(import_module(family['model_module']),
+                          family['model_class_str'])
+
+    train_features, train_label = data['train_data']
+    train_label = np.asarray(train_label)
+    if train_index is not None:
+        train_features = take_rows(train_features, train_index)
+        train_label = train_label[train_index]
+
+    # Out-of-fold fits have no separate evaluation set, so no early stopping
+    fit_params = {
+        key: value for key, value in family_fit_params(family, data).items()
+        if key not in EVAL_SET_PARAMS
+    }
+    config = {key: value for key, value in config.items()
+              if key not in EVAL_SET_PARAMS}
+
+    model = model_class(**config)
+    model.fit(train_features, train_label, **fit_params)
+
+    if predict_index is None:
+        return model
+
+    return model.predict(take_rows(data['train_data'][0], predict_index))
+
+
+class StackedEnsemble:
+    """Blend of the best model of every family
+
+    The prediction is intercept + sum(weight * family prediction). Weights
+    are non-negative and fitted on the out-of-fold predictions of the
+    training data (see FanOutTuner.fit_ensemble())
+
+    Args:
+        models: family name to fitted model
+
+        model_modules: family name to model module, used to transform raw
+                       model data with the preprocessor
+
+        weights: family name to blend weight
+
+        intercept: blend intercept
+
+        preprocessor: optional fitted FeaturePreprocessor. When given,
+                      predict() takes raw model data
+
+    """
+
+    def __init__(self,
+                 models: Dict[str, Any],
+                 model_modules: Dict[str, str],
+                 weights: Dict[str, float],
+                 intercept: float,
+                 preprocessor=None) -> None:
+        self.models: Dict[str, Any] = models
+        self.model_modules: Dict[str, str] = model_modules
+        self.weights: Dict[str, float] = weights
+        self.intercept: float = intercept
+        self.preprocessor = preprocessor
+
+    def predict_families(self, data) -> pd.DataFrame:
+        """Predictions of every family's model
+
+        Args:
+            data: raw model data when the ensemble has a preprocessor, else
+                  the model features
+
+        Returns:
+            predictions: one column per family
+
+        """
+
+        features = {}
+        predictions = {}
+        for family, model in self.models.items():
+            model_module = self.model_modules[family]
+            kind = data_kind(model_module, self.preprocessor is not None)
+
+            # Transform once per input type
+            if kind not in features:
+                features[kind] = (
+                    self.preprocessor.transform_for(data, model_module)
+                    if self.preprocessor is not None else data
+                )
+            predictions[family] = np.asarray(model.predict(features[kind]))
+
+        return pd.DataFrame(predictions)
+
+    def predict(self, data) -> np.ndarray:
+        family_predictions = self.predict_families(data)
+        weights = np.array([self.weights[family]
+                            for family in family_predictions.columns])
+
+        return self.intercept + family_predictions.to_numpy() @ weights
+
+
+class FanOutTuner:
+    """Tune several model families on one Ray cluster and blend them
+
+    RayTune tunes one model_module/model_class_str per call, so comparing
+    model families means repeating the setup for each. The fan-out tuner:
+        1) Starts one Ray cluster
+        2) Prepares the shared data once per input type (FeaturesData for
+           catboost, the encoded array for other libraries, see
+           FeaturePreprocessor.transform_for()) and puts it in the Ray object
+           store once. Every trial of every family reads it by reference
+        3) Tunes the families one after the other, each with its own
+           search space, search algorithm and budget (num_samples, optional
+           time_budget_s and resources). A Tuner must run in the driver's
+           main thread, so families are not tuned at the same time, but
+           every family's trials run concurrently on the whole cluster
+           (max_concurrent_trials and cpu_per_trial of the family)
+        4) Computes out-of-fold predictions of every family's best config
+           (contiguous folds, so folds follow the round order of the data)
+           and the final fits as Ray tasks on the same cluster
+        5) Fits a stacked ensemble on the out-of-fold predictions, see
+           StackedEnsemble
+
+    The validation data scores every family's best model and the ensemble
+
+    Args:
+        families: family name to family spec, each with:
+                      model_module, model_class_str (required)
+                      search_algorithm, search_space (required)
+                      num_samples (required): trials of the family
+                      cpu_per_trial (optional, default 1)
+                      gpu_per_trial (optional)
+                      max_concurrent_trials (optional, default 1)
+                      time_budget_s (optional): time budget of the family
+                      fit_params (optional): fit params of the family
+
+        data: the tuning data dictionary of RayTune without the family keys
+              (model_module, model_class_str, fit_params). With a
+              preprocessor, train_data and validation_data are raw model data
+
+        metric_mode: "min" or "max" for the tuned metric
+
+    Returns:
+        tuning results, best configs, scores and the StackedEnsemble, see
+        tune()
+
+    """
+
+    def __init__(self,
+                 families: Dict[str, Dict],
+                 data: Dict,
+                 metric_mode: str = 'min') -> None:
+        self.families: Dict[str, Dict] = families
+        self.data: Dict = {key: value for key, value in data.items()
+                           if key not in FAMILY_KEYS}
+        self.metric_mode: str = metric_mode
+
+        if self.data.get('probability'):
+            raise ValueError("FanOutTuner blends regression predictions only")
+
+    @property
+    def metric_name(self) -> str:
+        return (
+            self.data.get('metric_name') or self.data.get('metric_class_str')
+        )
+
+    def prepare_data(self) -> Dict[str, Dict]:
+        """Prepare the shared data once per input type of the families
+
+        Args:
+            None
+
+        Returns:
+            prepared: data kind to prepared data dictionary
+
+        """
+
+        has_preprocessor = self.data.get('preprocessor') is not None
+
+        prepared = {}
+        for family in self.families.values():
+            kind = data_kind(family['model_module'], has_preprocessor)
+            if kind in prepared:
+                continue
+
+            kind_data = RayTune.preprocess_data(
+                {**self.data, 'model_module': family['model_module']}
+            )
+            kind_data = {key: value for key, value in kind_data.items()
+                         if key not in FAMILY_KEYS}
+            kind_data['has_preprocessor'] = has_preprocessor
+            if kind_data.get('trial_cache'):
+                kind_data['data_hash'] = TrialCache.hash_data(kind_data)
+
+            prepared[kind] = kind_data
+
+        return prepared
+
+    def score(self, y_true: np.ndarray, y_pred: np.ndarray) -> float:
+        metric_class = getattr(import_module('sklearn.metrics'),
+                               self.data.get('metric_class_str'))
+        metric_params = self.data.get('metric_params') or {}
+
+        return float(metric_class(y_true, y_pred, **metric_params))
+
+    def tune_family(self,
+                    family: Dict,
+                    data_ref: Any,
+                    experiment_name: Optional[str] = None):
+        """Tune one family on the shared data
+
+        Args:
+            family: the family spec, see class docstring
+
+            data_ref: object store reference of the family's prepared data
+
+            experiment_name: optional name of the Tune experiment, unique
+                             per family so their results are kept apart
+
+        Returns:
+            results: ray tune ResultGrid
+
+        """
+
+        trainable = tune.with_resources(
+            family_objective,
+            {'cpu': family.get('cpu_per_trial', 1),
+             'gpu': family.get('gpu_per_trial')}
+        )
+
+        tuner = tune.Tuner(
+            tune.with_parameters(trainable,
+                                 data_ref=data_ref,
+                                 family=model_spec(family)),
+            tune_config=tune.TuneConfig(
+                search_alg=family['search_algorithm'],
+                max_concurrent_trials=family.get('max_concurrent_trials', 1),
+                num_samples=family['num_samples'],
+                time_budget_s=family.get('time_budget_s')
+            ),
+            param_space=family['search_space'],
+            run_config=RunConfig(name=experiment_name)
+        )
+
+        return tuner.fit()
+
+    def fit_ensemble(self,
+                     prepared_refs: Dict[str, Any],
+                     best_configs: Dict[str, Dict],
+                     n_folds: int) -> StackedEnsemble:
+        """Fit the stacked ensemble from out-of-fold predictions
+
+        Args:
+            prepared_refs: data kind to object store reference of the data
+
+            best_configs: family name to best config
+
+            n_folds: number of out-of-fold folds
+
+        Returns:
+            ensemble: the StackedEnsemble with every family fitted on all of
+                      the training data
+
+        """
+
+        has_preprocessor = self.data.get('preprocessor') is not None
+        n_rows = len(self.data['train_data'][1])
+        folds = np.array_split(np.arange(n_rows), n_folds)
+
+        remote_fit_predict = ray.remote(fit_predict)
+
+        def family_ref(name: str) -> Any:
+            return prepared_refs[data_kind(self.families[name]['model_module'],
+                                           has_preprocessor)]
+
+        def num_cpus(name: str) -> int:
+            return self.families[name].get('cpu_per_trial', 1)
+
+        # Every (family, fold) fit at once, plus the final fits
+        oof_refs = {
+            name: [
+                remote_fit_predict.options(num_cpus=num_cpus(name)).remote(
+                    family_ref(name),
+                    model_spec(self.families[name]),
+                    best_configs[name],
+                    np.concatenate([fold for other, fold in enumerate(folds)
+                                    if other != index]),
+                    folds[index]
+                )
+                for index in range(n_folds)
+            ]
+            for name in best_configs
+        }
+        model_refs = {
+            name: remote_fit_predict.options(num_cpus=num_cpus(name)).remote(
+                family_ref(name),
+                model_spec(self.families[name]),
+                best_configs[name],
+                None,
+                None
+            )
+            for name in best_configs
+        }
+
+        oof_predictions = np.column_stack([
+            np.concatenate(ray.get(oof_refs[name])) for name in best_configs
+        ])
+
+        # Non-negative stacking weights
+        linear_model = import_module('sklearn.linear_model')
+        blender = linear_model.LinearRegression(positive=True)
+        blender.fit(oof_predictions, np.asarray(self.data['train_data'][1]))
+
+        return StackedEnsemble(
+            models={name: ray.get(model_refs[name]) for name in best_configs},
+            model_modules={name: self.families[name]['model_module']
+                           for name in best_configs},
+            weights=dict(zip(best_configs, blender.coef_.tolist())),
+            intercept=float(blender.intercept_),
+            preprocessor=self.data.get('preprocessor')
+        )
+
+    def tune(self, init_config: Dict, n_folds: int = 5) -> Dict[str, Any]:
+        """Tune every family, then fit and score the stacked ensemble
+
+        Args:
+            init_config: dictionary passed in to ray.init(), see
+                         RayTune.tuner()
+
+            n_folds: number of out-of-fold folds for the ensemble
+
+        Returns:
+            fan_out: dictionary with
+                         results: family name to ray tune ResultGrid
+                         best_configs: family name to best config
+                         scores: validation score of every family and the
+                                 ensemble (if there is validation data)
+                         ensemble: the StackedEnsemble
+
+        """
+
+        # In case ray is already initialized
+        ray.shutdown()
+        ray.init(**init_config)
+
+        try:
+            # Data prep once per input type, one object store copy each
+            prepared = self.prepare_data()
+            prepared_refs = {kind: ray.put(kind_data)
+                             for kind, kind_data in prepared.items()}
+            has_preprocessor = self.data.get('preprocessor') is not None
+
+            # One Tuner per family, in the driver's main thread
+            run_id = time.strftime('%Y-%m-%d_%H-%M-%S')
+            results = {
+                name: self.tune_family(
+                    family,
+                    prepared_refs[data_kind(family['model_module'],
+                                            has_preprocessor)],
+                    f'fan_out_{name}_{run_id}'
+                )
+                for name, family in self.families.items()
+            }
+
+            best_configs = {
+                name: (
+                    results[name]
+                    .get_best_result(self.metric_name, self.metric_mode)
+                    .config
+                )
+                for name in self.families
+            }
+
+            ensemble = self.fit_ensemble(prepared_refs, best_configs, n_folds)
+        finally:
+            ray.shutdown()
+
+        scores = {}
+        validation_data = self.data.get('validation_data')
+        if validation_data:
+            y_true = np.asarray(validation_data[1])
+            family_predictions = ensemble.predict_families(validation_data[0])
+            for name in family_predictions.columns:
+                scores[name] = self.score(y_true, family_predictions[name])
+            scores['ensemble'] = self.score(y_true,
+                                            ensemble.predict(validation_data[0]))
+
+        return {
+            'results': results,
+            'best_configs': best_configs,
+            'scores': scores,
+            'ensemble': ensemble
+        }
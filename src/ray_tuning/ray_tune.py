@@ -1,11 +1,23 @@
 from typing import Dict, Union, Optional
 from importlib import import_module
+import pickle
+import time
+import numpy as np
+import pandas as pd
 
 import ray
 from ray import tune
 from ray.air import session
 from ray.tune import ResultGrid
 
+from src.ray_tuning.resources import auto_pack
+from src.ray_tuning.trial_cache import TrialCache
+
+
+# Cost metrics reported by every trial next to the score
+FIT_TIME = 'fit_time_seconds'
+MODEL_SIZE = 'model_size_bytes'
+PREDICT_TIME = 'predict_ms_per_1000_rows'
 
 class RayTune:
     """Perform distributed hyperparameter optimization via ray tune
@@ -20,6 +32,14 @@ class RayTune:
         2) tuner() - The tuning procedure that runs all tuning trials using the 
                      objective function
     
+    Every trial reports the cost of the model next to its score: the fit time 
+    (FIT_TIME), the size of the pickled model (MODEL_SIZE) and the prediction 
+    time per 1000 rows (PREDICT_TIME). These can be optimized together with 
+    the score by a multi-objective search algorithm (e.g. OptunaSearch with a 
+    list of metrics and modes), and pareto_front() returns the trials that 
+    are not beaten on every objective by another trial, optionally within 
+    budgets such as a maximum prediction latency
+
     Ray tune allows the user to run concurrent trials, utilizing available 
     computing power. Ray creates a "cluster", that is initialized, which sets 
     up the necessary requirements to run tuning jobs. This cluster can take up 
@@ -89,6 +109,24 @@ class RayTune:
                                           output. If not used, name will be 
                                           metric_class_str
 
+                  preprocessor (optional): fitted FeaturePreprocessor (see 
+                                           src/model_training/preprocessing.py). 
+                                           When passed in, train_data and 
+                                           validation_data are raw model data 
+                                           and are transformed once, before 
+                                           any trial runs (see 
+                                           preprocess_data())
+
+                  trial_cache (optional): path of a TrialCache database on 
+                                          a local disk (single-node cache). 
+                                          Trials with a config that was 
+                                          already evaluated on the same data 
+                                          report the cached metrics instead 
+                                          of fitting again
+
+                  trial_cache_size (optional): maximum number of cached trial 
+                                               results, defaults to 10000
+
     Returns:
         results: the output of tuner.fit() -> ResultGrid. Contains tuning 
                  results/information
@@ -104,6 +142,58 @@ class RayTune:
         self.space: Dict = search_space
         self.data: Dict = data
 
+    @staticmethod
+    def preprocess_data(data: Dict) -> Dict:
+        """Transform the tuning data once with the data's preprocessor
+
+        Every trial gets the already transformed data from the Ray object 
+        store, so the conversion is not repeated per trial. For catboost the 
+        features are FeaturesData, which carries the categorical features 
+        itself, so "cat_features" is removed from the fit params and the 
+        "eval_set" is replaced with the transformed validation data
+
+        Args:
+            data: the tuning data dictionary, see class docstring
+
+        Returns:
+            data: copy of the tuning data with transformed features, or the 
+                  data itself if it has no preprocessor
+                
+        """
+
+        preprocessor = data.get('preprocessor')
+        if preprocessor is None:
+            return data
+
+        data = {key: value for key, value in data.items() 
+                if key != 'preprocessor'}
+        model_module = data.get('model_module')
+
+        train_data = data.get('train_data')
+        data['train_data'] = (
+            preprocessor.transform_for(train_data[0], model_module),
+            np.asarray(train_data[1])
+        )
+
+        validation_data = data.get('validation_data')
+        if validation_data:
+            data['validation_data'] = (
+                preprocessor.transform_for(validation_data[0], model_module),
+                np.asarray(validation_data[1])
+            )
+
+        fit_params = dict(data.get('fit_params') or {})
+        fit_params.pop('cat_features', None)
+        if 'eval_set' in fit_params:
+            # The raw eval_set does not match the transformed features
+            if not validation_data:
+                raise ValueError("fit_params has an eval_set, but the data has "
+                                 "no validation_data to transform")
+            fit_params['eval_set'] = data['validation_data']
+        data['fit_params'] = fit_params
+
+        return data
+
     @staticmethod
     def objective(config: Dict, data: Dict) -> None:
         """Definition of objective function used to train each tuning trial
@@ -133,6 +223,26 @@ class RayTune:
         model_class_str = data.get('model_class_str')
         model_class = getattr(model_module, model_class_str)
 
+        # Report cached metrics if this config was already evaluated
+        trial_cache = None
+        if data.get('trial_cache'):
+            trial_cache = TrialCache(data.get('trial_cache'),
+                                     data.get('trial_cache_size', 10000))
+            cache_key = trial_cache.key(
+                data.get('data_hash'),
+                data.get('model_module'),
+                model_class_str,
+                config,
+                metric={key: data.get(key)
+                        for key in ['metric_class_str', 'metric_params',
+                                    'metric_name', 'probability']},
+                fit_params=data.get('fit_params')
+            )
+            cached_metrics = trial_cache.get(cache_key)
+            if cached_metrics is not None:
+                session.report({**cached_metrics, "cached": True, "done": True})
+                return
+
         # Optional fit params
         fit_params = data.get('fit_params')
 
@@ -143,6 +253,7 @@ class RayTune:
         model = model_class(**config)
 
         # Train the model
+        fit_start = time.perf_counter()
         if fit_params: # If fit params defined
             model.fit(train_data[0],
                       train_data[1],
@@ -150,6 +261,7 @@ class RayTune:
         else:
             model.fit(train_data[0],
                       train_data[1])
+        fit_time = time.perf_counter() - fit_start
 
         # Import Scikit-Learn Metric - TODO: Make work for other packages (or 
         # custom metrics)
@@ -166,9 +278,13 @@ class RayTune:
             'y_true': validation_data[1] if validation_data else train_data[1],
         }
 
+        n_rows = len(all_data['y_true'])
+        predict_start = time.perf_counter()
+
         # predict_proba for probability metrics (e.g. logloss)
         if probability:
             y_pred = model.predict_proba(all_data.pop('X'))
+            predict_time = time.perf_counter() - predict_start
             all_data['y_pred'] = y_pred
             score = (
                 (lambda: metric_class(**all_data, **metric_params))() 
@@ -178,6 +294,7 @@ class RayTune:
         # Other metrics use predict (class prediction)
         else:
             y_pred = model.predict(all_data.pop('X'))
+            predict_time = time.perf_counter() - predict_start
             all_data['y_pred'] = y_pred
             score = (
                 (lambda: metric_class(**all_data, **metric_params))() 
@@ -187,17 +304,26 @@ class RayTune:
         # Optional Metric Name
         metric_name = data.get('metric_name')
 
-        # Report score to Ray Tune Session            
-        session.report(
-            {metric_name if metric_name else metric_class_str: score, 
-             "done": True})
+        metrics = {
+            metric_name if metric_name else metric_class_str: float(score),
+            FIT_TIME: fit_time,
+            MODEL_SIZE: len(pickle.dumps(model)),
+            PREDICT_TIME: 1000 * predict_time / max(n_rows, 1)
+        }
+
+        if trial_cache is not None:
+            trial_cache.put(cache_key, metrics)
+
+        # Report score and model cost to Ray Tune Session            
+        session.report({**metrics, "cached": False, "done": True})
 
     def tuner(self,
               init_config: Dict,
               max_concurrent_trials: int,
               num_samples: int,
-              cpu_per_trial: int,
-              gpu_per_trail: Optional[Union[float, int]] = None) -> ResultGrid:
+              cpu_per_trial: Optional[int],
+              gpu_per_trail: Optional[Union[float, int]] = None,
+              auto_pack_trials: bool = False) -> ResultGrid:
         """Tuning procedure
 
         Args:
@@ -220,15 +346,62 @@ class RayTune:
 
             gpu_per_trail: proportion of gpu(s) to use for each trial
 
+            auto_pack_trials: for CPU-only hosts. Rewrites GPU params in the 
+                              search space to CPU-safe settings and picks 
+                              cpu_per_trial, max_concurrent_trials and the 
+                              model thread count from the detected cpus and 
+                              memory and short calibration fits (see 
+                              resources.py). The passed in cpu_per_trial, 
+                              max_concurrent_trials and gpu_per_trail are 
+                              ignored
+
             NOTE: cpu_per_trial * max_concurrent_trials <= num_cpus
                   gpu_per_trial * max_concurrent_trials <= num_gpus
+                  A ValueError is raised otherwise, only when num_cpus or 
+                  num_gpus is given in init_config. Without them (e.g. 
+                  connecting to an existing cluster with address), trials 
+                  that do not fit are queued by Ray
 
         Returns:
             results: ray tune ResultGrid type that holds tuning job information 
                      and results
                 
         """
-        
+
+        # Transform features once for all trials
+        data = self.preprocess_data(self.data)
+        space = self.space
+
+        # Data part of the trial cache key, hashed once for all trials
+        if data.get('trial_cache'):
+            data = {**data, 'data_hash': TrialCache.hash_data(data)}
+        num_cpus = init_config.get('num_cpus')
+
+        # Calibrate before ray starts, so nothing else competes for the cpus
+        if auto_pack_trials:
+            space, cpu_per_trial, max_concurrent_trials = (
+                auto_pack(data, space, num_cpus)
+            )
+            gpu_per_trail = None
+        elif cpu_per_trial is None:
+            raise ValueError("cpu_per_trial is required without "
+                             "auto_pack_trials")
+
+        if num_cpus and cpu_per_trial * max_concurrent_trials > num_cpus:
+            raise ValueError(
+                f"cpu_per_trial * max_concurrent_trials "
+                f"({cpu_per_trial} * {max_concurrent_trials}) is more than "
+                f"num_cpus ({num_cpus})"
+            )
+        num_gpus = init_config.get('num_gpus')
+        if (gpu_per_trail and num_gpus is not None and 
+                gpu_per_trail * max_concurrent_trials > num_gpus):
+            raise ValueError(
+                f"gpu_per_trial * max_concurrent_trials "
+                f"({gpu_per_trail} * {max_concurrent_trials}) is more than "
+                f"num_gpus ({num_gpus})"
+            )
+
          # In case ray is already initialized 
         ray.shutdown()
         # Initialize ray cluster
@@ -243,13 +416,13 @@ class RayTune:
 
         # Create Tuner object
         tuner = tune.Tuner(
-            tune.with_parameters(trainable_with_cpu_gpu, data=self.data),
+            tune.with_parameters(trainable_with_cpu_gpu, data=data),
             tune_config=tune.TuneConfig(
                 search_alg=self.search_alg,
                 max_concurrent_trials=max_concurrent_trials, 
                 num_samples=num_samples
             ),
-            param_space=self.space,
+            param_space=space,
         )
 
         # Fit Tuner
@@ -257,3 +430,58 @@ class RayTune:
         ray.shutdown()
 
         return results
+
+    @staticmethod
+    def pareto_front(results: ResultGrid,
+                     objectives: Dict[str, str],
+                     budgets: Optional[Dict[str, float]] = None
+                     ) -> pd.DataFrame:
+        """Obtain the Pareto front of the tuning trials
+
+        A trial is on the Pareto front if no other trial is at least as good 
+        on every objective and better on at least one. E.g. with the score, 
+        FIT_TIME and PREDICT_TIME as objectives, the front holds the fastest 
+        model for every level of error
+
+        Args:
+            results: ray tune ResultGrid returned by tuner()
+
+            objectives: metric name to "min" or "max", e.g. 
+                        {'root_mean_squared_error': 'min', 
+                         PREDICT_TIME: 'min'}
+
+            budgets (optional): metric name to maximum allowed value, e.g. 
+                                {PREDICT_TIME: 5}. Trials over budget are left 
+                                out before the front is computed
+
+        Returns:
+            front: one row per Pareto optimal trial with its metrics and 
+                   config (config/ columns), sorted by the first objective
+                
+        """
+
+        trials = results.get_dataframe()
+        trials = trials.dropna(subset=list(objectives))
+
+        for metric, budget in (budgets if budgets else {}).items():
+            trials = trials[trials[metric] <= budget]
+
+        # Minimize every objective
+        values = np.column_stack([
+            trials[metric].to_numpy(dtype=float) * (1 if mode == 'min' else -1)
+            for metric, mode in objectives.items()
+        ])
+
+        # Trial i is dominated if some trial j is <= on all and < on any
+        no_worse = (values[None, :, :] <= values[:, None, :]).all(axis=2)
+        better = (values[None, :, :] < values[:, None, :]).any(axis=2)
+        dominated = (no_worse & better).any(axis=1)
+
+        first_metric, first_mode = next(iter(objectives.items()))
+        front = (
+            trials[~dominated]
+            .sort_values(first_metric, ascending=first_mode == 'min')
+            .reset_index(drop=True)
+        )
+
+        return front
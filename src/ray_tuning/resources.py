@@ -0,0 +1,298 @@
+from typing import Any, Dict, List, Optional, Tuple
+from importlib import import_module
+import os
+import time
+import numpy as np
+import psutil
+from ray import tune
+from ray.tune.search.sample import Categorical, Domain, Integer
+
+
+# Params that only apply to GPU training, removed for CPU-only hosts
+GPU_ONLY_PARAMS: List[str] = [
+    'gpu_ram_part',
+    'devices',
+    'gpu_cat_features_storage',
+    'gpu_id',
+    'gpu_device_id',
+    'gpu_platform_id'
+]
+
+# Params whose GPU values are rewritten to their CPU counterparts
+CPU_REWRITES: Dict[str, Dict[Any, Any]] = {
+    'task_type': {'GPU': 'CPU'},
+    'device': {'gpu': 'cpu', 'cuda': 'cpu'},
+    'device_type': {'gpu': 'cpu', 'cuda': 'cpu'},
+    'tree_method': {'gpu_hist': 'hist'}
+}
+
+# Name of the thread count param per model module
+THREAD_PARAMS: Dict[str, str] = {'catboost': 'thread_count'}
+
+# Number of boosting iterations used for calibration fits
+CALIBRATION_ITERATIONS: int = 20
+
+
+def detect_resources() -> Dict[str, int]:
+    """Detect the cpus and memory available to this process
+
+    Args:
+        None
+
+    Returns:
+        resources: dictionary with cpus (usable by this process) and
+                   memory_bytes (currently available)
+
+    """
+
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count()
+
+    return {
+        'cpus': cpus,
+        'memory_bytes': psutil.virtual_memory().available
+    }
+
+
+def cpu_safe_config(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Rewrite GPU params in a config (or search space) to CPU-safe settings
+
+    Args:
+        config: model params or ray tune search space
+
+    Returns:
+        cpu_config: copy of the config without GPU-only params and with GPU
+                    values rewritten, e.g. task_type GPU -> CPU
+
+    """
+
+    cpu_config = {
+        key: value for key, value in config.items()
+        if key not in GPU_ONLY_PARAMS
+    }
+
+    for key, rewrites in CPU_REWRITES.items():
+        value = cpu_config.get(key)
+        if isinstance(value, str) and value in rewrites:
+            cpu_config[key] = rewrites[value]
+        elif isinstance(value, Categorical):
+            # e.g. tune.choice(['GPU', 'CPU']) -> tune.choice(['CPU'])
+            categories = [
+                rewrites.get(category, category)
+                if isinstance(category, str) else category
+                for category in value.categories
+            ]
+            cpu_config[key] = tune.choice(list(dict.fromkeys(categories)))
+
+    return cpu_config
+
+
+def representative_config(space: Dict[str, Any]) -> Dict[str, Any]:
+    """Obtain one fixed config from a ray tune search space
+
+    Numeric search domains are replaced by the middle of their range (the
+    geometric middle for log domains), categorical domains by their first
+    category and other domains by a sample. Constants are kept. Used to time
+    calibration fits of a typical trial
+
+    Args:
+        space: ray tune search space
+
+    Returns:
+        config: config with a fixed value for every param
+
+    """
+
+    config = {}
+    for key, value in space.items():
+        if not isinstance(value, Domain):
+            config[key] = value
+        elif isinstance(value, Categorical):
+            config[key] = value.categories[0]
+        elif hasattr(value, 'lower') and hasattr(value, 'upper'):
+            # Quantized samplers wrap the actual sampler
+            sampler = value.get_sampler()
+            sampler = getattr(sampler, 'sampler', sampler)
+            is_log = 'LogUniform' in type(sampler).__name__
+            middle = (
+                np.sqrt(value.lower * value.upper) if is_log
+                else (value.lower + value.upper) / 2
+            )
+            config[key] = (
+                int(middle) if isinstance(value, Integer) else float(middle)
+            )
+        else:
+            config[key] = value.sample()
+
+    return config
+
+
+def calibrate_thread_scaling(data: Dict,
+                             config: Dict[str, Any],
+                             thread_counts: List[int]) -> Dict[int, float]:
+    """Time a short fit for each thread count
+
+    Args:
+        data: the (preprocessed) tuning data dictionary, see RayTune
+
+        config: a fixed, CPU-safe model config
+
+        thread_counts: thread counts to time
+
+    Returns:
+        fit_times: thread count to fit time in seconds
+
+    """
+
+    # Allow for dynamic model definitions
+    model_module = data.get('model_module')
+    model_class = getattr(import_module(model_module),
+                          data.get('model_class_str'))
+    thread_param = THREAD_PARAMS.get(model_module, 'n_jobs')
+
+    fit_params = {
+        key: value for key, value in (data.get('fit_params') or {}).items()
+        if key in ['cat_features', 'verbose']
+    }
+    train_data = data.get('train_data')
+
+    fit_times = {}
+    for thread_count in thread_counts:
+        calibration_config = dict(config)
+        calibration_config[thread_param] = thread_count
+        if 'iterations' in calibration_config:
+            calibration_config['iterations'] = CALIBRATION_ITERATIONS
+
+        model = model_class(**calibration_config)
+        fit_start = time.perf_counter()
+        model.fit(train_data[0], train_data[1], **fit_params)
+        fit_times[thread_count] = time.perf_counter() - fit_start
+
+    return fit_times
+
+
+def plan_trial_packing(cpus: int,
+                       fit_times: Dict[int, float],
+                       max_trials_by_memory: int) -> Tuple[int, int]:
+    """Choose the threads per trial and trial concurrency
+
+    Trials per hour for t threads per trial is proportional to
+    (cpus // t) / fit_time(t), so the thread count with the best ratio wins.
+    Concurrency is capped by the number of trials that fit in memory
+
+    Args:
+        cpus: available cpus
+
+        fit_times: thread count to calibration fit time
+
+        max_trials_by_memory: maximum trials that fit in memory at once
+
+    Returns:
+        threads_per_trial: cpus (threads) given to each trial
+
+        max_concurrent_trials: trials to run at the same time
+
+    """
+
+    def throughput(thread_count: int) -> float:
+        concurrent = min(cpus // thread_count, max_trials_by_memory)
+        return concurrent / fit_times[thread_count]
+
+    threads_per_trial = max(fit_times, key=throughput)
+    max_concurrent_trials = max(
+        1, min(cpus // threads_per_trial, max_trials_by_memory)
+    )
+
+    return threads_per_trial, max_concurrent_trials
+
+
+def estimate_trial_memory(data: Dict) -> int:
+    """Rough memory needed by one trial
+
+    Each trial holds the training data, the library's internal copy of it
+    (e.g. catboost's quantized pool) and the model. Estimated as three times
+    the size of the training and validation data plus 256MB of overhead
+
+    Args:
+        data: the (preprocessed) tuning data dictionary, see RayTune
+
+    Returns:
+        trial_memory: estimated bytes per trial
+
+    """
+
+    def size(value) -> int:
+        if hasattr(value, 'memory_usage'):
+            return int(np.sum(value.memory_usage(deep=True)))
+        elif hasattr(value, 'nbytes'):
+            return int(value.nbytes)
+        elif hasattr(value, 'num_feature_data'):
+            # catboost FeaturesData, either part can be None
+            return sum(
+                int(part.nbytes)
+                for part in [value.num_feature_data, value.cat_feature_data]
+                if part is not None
+            )
+        return 0
+
+    data_bytes = sum(
+        size(part)
+        for key in ['train_data', 'validation_data']
+        for part in (data.get(key) or ())
+    )
+
+    return 3 * data_bytes + 256 * 1024 ** 2
+
+
+def auto_pack(data: Dict,
+              space: Dict[str, Any],
+              num_cpus: Optional[int] = None) -> Tuple[Dict[str, Any], int, int]:
+    """Pack tuning trials onto a CPU-only host
+
+    Detects the cpus and memory, rewrites GPU params in the search space to
+    CPU-safe settings, times short calibration fits for several thread counts
+    and picks the thread count and concurrency with the most trials per hour.
+    The thread count is set in the search space
+
+    Args:
+        data: the (preprocessed) tuning data dictionary, see RayTune
+
+        space: ray tune search space
+
+        num_cpus (optional): cpus to use, defaults to all detected cpus
+
+    Returns:
+        cpu_space: CPU-safe search space with the thread count set
+
+        cpu_per_trial: cpus per trial
+
+        max_concurrent_trials: trials to run at the same time
+
+    """
+
+    resources = detect_resources()
+    cpus = min(num_cpus, resources['cpus']) if num_cpus else resources['cpus']
+
+    cpu_space = cpu_safe_config(space)
+
+    # Powers of two up to all cpus
+    thread_counts = sorted(
+        {2 ** power for power in range(int(np.log2(cpus)) + 1)} | {cpus}
+    )
+    fit_times = calibrate_thread_scaling(data,
+                                         representative_config(cpu_space),
+                                         thread_counts)
+
+    max_trials_by_memory = max(
+        1, resources['memory_bytes'] // estimate_trial_memory(data)
+    )
+    cpu_per_trial, max_concurrent_trials = (
+        plan_trial_packing(cpus, fit_times, max_trials_by_memory)
+    )
+
+    thread_param = THREAD_PARAMS.get(data.get('model_module'), 'n_jobs')
+    cpu_space[thread_param] = cpu_per_trial
+
+    return cpu_space, cpu_per_trial, max_concurrent_trials
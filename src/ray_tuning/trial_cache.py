@@ -0,0 +1,197 @@
+from typing import Any, Dict, Iterator, Optional
+from contextlib import contextmanager
+import hashlib
+import json
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+
+
+class TrialCache:
+    """Bounded cache of tuning trial results shared between Ray workers
+
+    Search algorithms such as HyperOpt often propose a config that has
+    already been evaluated, especially for integer params like depth,
+    l2_leaf_reg and min_data_in_leaf. The cache stores the reported metrics
+    of every trial under a key made of:
+        1) A hash of the training and validation data (see hash_data())
+        2) The model module and class
+        3) The metric (class, params, name and probability) and the fit
+           params, so a changed metric or fit never reads stale results
+        4) The canonical config (see canonical_config()). Floats are rounded
+           to float_precision significant digits, so near-duplicate configs
+           share a key
+
+    The cache is a SQLite database, so every trial process on the host (and
+    every later tuning run) reads and writes the same cache safely. When the
+    cache holds more than max_entries results, the least recently used are
+    evicted
+
+    The cache is for single-node tuning: SQLite's file locking is not
+    reliable on network file systems, so the database must be on a local
+    disk. On a multi-node cluster, every node that runs trials then keeps
+    its own cache at the same local path
+
+    Args:
+        path: location of the SQLite database, on a local disk
+
+        max_entries: maximum number of cached results
+
+        float_precision: significant digits kept for float params
+
+    """
+
+    def __init__(self,
+                 path: str,
+                 max_entries: int = 10000,
+                 float_precision: int = 4) -> None:
+        self.path: str = path
+        self.max_entries: int = max_entries
+        self.float_precision: int = float_precision
+
+        with self.connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS trials ('
+                'key TEXT PRIMARY KEY, result TEXT, last_used REAL)'
+            )
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """Connection in a transaction, closed when the block ends"""
+
+        # Concurrent trials wait on each other's writes instead of failing.
+        # Default rollback journal, WAL needs shared memory on one host
+        connection = sqlite3.connect(self.path, timeout=60)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def hash_data(data: Dict) -> str:
+        """Hash the training and validation data of a tuning data dictionary
+
+        Computed once by RayTune.tuner() and passed to every trial
+
+        Args:
+            data: the (preprocessed) tuning data dictionary, see RayTune
+
+        Returns:
+            data_hash: sha256 hex digest of the data
+
+        """
+
+        def array_bytes(value) -> bytes:
+            if isinstance(value, (pd.DataFrame, pd.Series)):
+                return pd.util.hash_pandas_object(value, index=False).values
+            elif hasattr(value, 'num_feature_data'):
+                # catboost FeaturesData, either part can be None
+                return b''.join(
+                    bytes(array_bytes(part))
+                    for part in [value.num_feature_data,
+                                 value.cat_feature_data,
+                                 value.num_feature_names,
+                                 value.cat_feature_names]
+                    if part is not None
+                )
+            value = np.asarray(value)
+            if value.dtype == object:
+                return pd.util.hash_array(value.ravel())
+            return value.tobytes()
+
+        data_hash = hashlib.sha256()
+        for key in ['train_data', 'validation_data']:
+            for part in (data.get(key) or ()):
+                data_hash.update(bytes(array_bytes(part)))
+
+        return data_hash.hexdigest()
+
+    def canonical_config(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        canonical = {}
+        for key in sorted(config):
+            value = config[key]
+            if isinstance(value, (float, np.floating)):
+                if float(value).is_integer():
+                    value = int(value)
+                else:
+                    value = float(f'{value:.{self.float_precision}g}')
+            elif isinstance(value, np.integer):
+                value = int(value)
+            canonical[key] = value
+
+        return canonical
+
+    def key(self,
+            data_hash: str,
+            model_module: str,
+            model_class_str: str,
+            config: Dict[str, Any],
+            metric: Optional[Dict[str, Any]] = None,
+            fit_params: Optional[Dict[str, Any]] = None) -> str:
+        """Cache key of a trial
+
+        Args:
+            data_hash: see hash_data()
+
+            model_module: string name of the module of the model
+
+            model_class_str: string name of the model class
+
+            config: the trial's hyperparameter config
+
+            metric: metric_class_str, metric_params, metric_name and
+                    probability of the tuning data
+
+            fit_params: fit params of the trial. The eval_set is left out,
+                        the validation data is part of the data hash
+
+        Returns:
+            key: sha256 hex digest
+
+        """
+
+        fit_params = {
+            key: value for key, value in (fit_params or {}).items()
+            if key != 'eval_set'
+        }
+        key_parts = json.dumps([data_hash,
+                                model_module,
+                                model_class_str,
+                                metric or {},
+                                self.canonical_config(fit_params),
+                                self.canonical_config(config)],
+                               sort_keys=True,
+                               default=str)
+
+        return hashlib.sha256(key_parts.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.connect() as connection:
+            row = connection.execute(
+                'SELECT result FROM trials WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            connection.execute(
+                'UPDATE trials SET last_used = ? WHERE key = ?',
+                (time.time(), key)
+            )
+
+        return json.loads(row[0])
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        with self.connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO trials VALUES (?, ?, ?)',
+                (key, json.dumps(result, default=float), time.time())
+            )
+
+            # Least recently used eviction
+            connection.execute(
+                'DELETE FROM trials WHERE key NOT IN ('
+                'SELECT key FROM trials ORDER BY last_used DESC LIMIT ?)',
+                (self.max_entries,)
+            )
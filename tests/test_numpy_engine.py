@@ -0,0 +1,254 @@
+"""Parity of the numpy and pandas prepare engines on synthetic sessions
+
+The sessions only provide what the prepare_data functions use (laps,
+weather_data, race_control_messages, drivers, results and get_driver()), so
+no fastf1 data is needed
+"""
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('fastf1')
+
+from src.model_data.prepare_data.numpy_engine import (
+    AGGREGATIONS,
+    WEATHER_COLUMNS,
+    check_engine_parity,
+    prepare_session_dataset,
+    prepare_session_features,
+    segment_aggregates
+)
+
+
+DRIVERS: List[Tuple[str, str, str, str]] = [
+    ('VER', '1', 'red_bull', 'NED'),
+    ('HAM', '44', 'mercedes', 'GBR'),
+    ('LEC', '16', 'ferrari', 'MON'),
+    ('ALO', '14', 'aston_martin', 'ESP'),
+    ('NOR', '4', 'mclaren', 'GBR')
+]
+
+
+class SyntheticSession:
+    """Session with the attributes used by the prepare_data functions"""
+
+    def __init__(self,
+                 laps: pd.DataFrame,
+                 weather_data: pd.DataFrame,
+                 race_control_messages: pd.DataFrame) -> None:
+        self.laps: pd.DataFrame = laps
+        self.weather_data: pd.DataFrame = weather_data
+        self.race_control_messages: pd.DataFrame = race_control_messages
+        self.drivers: List[str] = [number for _, number, _, _ in DRIVERS]
+        self.results: pd.DataFrame = pd.DataFrame({
+            'DriverNumber': self.drivers,
+            'Abbreviation': [driver for driver, _, _, _ in DRIVERS],
+            'TeamId': [team for _, _, team, _ in DRIVERS],
+            'CountryCode': [country for _, _, _, country in DRIVERS]
+        })
+
+    def get_driver(self, driver_number: str) -> pd.Series:
+        return (
+            self.results[self.results['DriverNumber'] == driver_number]
+            .iloc[0]
+        )
+
+
+def make_session(seed: int,
+                 laps_per_driver: Optional[Dict[str, int]] = None,
+                 missing_rate: float = 0.2) -> SyntheticSession:
+    """Synthetic session with shuffled laps and missing values
+
+    Args:
+        seed: random seed
+
+        laps_per_driver: optional number of laps per driver abbreviation,
+                         drivers with 0 laps have no lap rows
+
+        missing_rate: share of missing lap/sector times and speeds
+
+    Returns:
+        session: SyntheticSession
+
+    """
+
+    rng = np.random.default_rng(seed)
+
+    def maybe_missing(value):
+        return value if rng.random() >= missing_rate else None
+
+    rows = []
+    for driver, number, _, _ in DRIVERS:
+        n_laps = (
+            laps_per_driver.get(driver, 5) if laps_per_driver
+            else int(rng.integers(1, 10))
+        )
+        start = rng.uniform(100, 500)
+        for lap_number in rng.permutation(np.arange(1, n_laps + 1)):
+            lap_time = maybe_missing(rng.uniform(80, 95))
+            rows.append({
+                'Driver': driver,
+                'DriverNumber': number,
+                'LapNumber': float(lap_number),
+                'Time': pd.Timedelta(seconds=start + lap_number * 90),
+                'LapTime': (
+                    pd.NaT if lap_time is None
+                    else pd.Timedelta(seconds=lap_time)
+                ),
+                **{
+                    f'Sector{sector}Time': (
+                        pd.NaT if rng.random() < missing_rate
+                        else pd.Timedelta(seconds=rng.uniform(20, 35))
+                    )
+                    for sector in [1, 2, 3]
+                },
+                'SpeedI1': maybe_missing(rng.uniform(200, 300)),
+                'SpeedI2': maybe_missing(rng.uniform(200, 300)),
+                'SpeedFL': maybe_missing(rng.uniform(200, 300)),
+                'SpeedST': maybe_missing(rng.uniform(280, 340)),
+                'IsPersonalBest': bool(rng.random() < 0.3)
+            })
+
+    laps = pd.DataFrame(rows, columns=[
+        'Driver', 'DriverNumber', 'LapNumber', 'Time', 'LapTime',
+        'Sector1Time', 'Sector2Time', 'Sector3Time',
+        'SpeedI1', 'SpeedI2', 'SpeedFL', 'SpeedST', 'IsPersonalBest'
+    ])
+    for column in ['SpeedI1', 'SpeedI2', 'SpeedFL', 'SpeedST']:
+        laps[column] = laps[column].astype(float)
+
+    weather_data = pd.DataFrame({
+        'Time': pd.to_timedelta(np.arange(0, 1500, 60), unit='s'),
+        **{column: rng.uniform(0, 1000, 25) for column in WEATHER_COLUMNS}
+    })
+    weather_data.loc[rng.integers(0, 25, 3), 'Humidity'] = np.nan
+
+    # Messages without a driver, and for a driver not in the session
+    racing_numbers = [number for _, number, _, _ in DRIVERS] + [None, '99']
+    race_control_messages = pd.DataFrame({
+        'RacingNumber': rng.choice(np.array(racing_numbers, dtype=object), 12),
+        'Category': rng.choice(['Other', 'Flag', 'Drs', 'CarEvent'], 12)
+    })
+
+    return SyntheticSession(laps, weather_data, race_control_messages)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_engines_match(seed):
+    check_engine_parity(make_session(seed))
+
+
+def test_engines_match_without_missing_values():
+    check_engine_parity(make_session(0, missing_rate=0))
+
+
+def test_engines_match_single_lap_drivers():
+    # std of a single lap is NaN. Lap times on a weather sample, so the
+    # single-instant weather windows are not empty
+    session = make_session(1, {driver: 1 for driver, _, _, _ in DRIVERS})
+    session.laps['Time'] = session.laps['Time'].dt.floor('60s')
+
+    check_engine_parity(session)
+
+
+def test_engines_match_without_weather_samples():
+    # No driver's window holds a weather sample, both engines keep the
+    # weather columns as missing values
+    session = make_session(1, {driver: 1 for driver, _, _, _ in DRIVERS})
+    session.laps['Time'] = session.laps['Time'].dt.floor('60s') + pd.Timedelta(
+        seconds=30
+    )
+
+    check_engine_parity(session)
+    full_dataset, _ = prepare_session_features(session, 'pandas')
+    weather_columns = [f'{column}_{aggregation}'
+                       for column in WEATHER_COLUMNS
+                       for aggregation in AGGREGATIONS]
+    assert full_dataset[weather_columns].isna().all().all()
+
+
+def test_engines_match_latest_control_message():
+    # Complete rows, so no driver is left out of the combined dataset
+    session = make_session(5, {driver: 4 for driver, _, _, _ in DRIVERS},
+                           missing_rate=0)
+    session.race_control_messages = pd.DataFrame({
+        'RacingNumber': ['1', None, '44', '1', '99'],
+        'Category': ['Flag', 'Other', 'CarEvent', 'Drs', 'Flag']
+    })
+
+    check_engine_parity(session)
+    dataset = prepare_session_dataset(session, 'numpy')
+    categories = dict(zip(dataset['DriverNumber'], dataset['Category']))
+    assert categories[1] == 'Drs'
+    assert categories[44] == 'CarEvent'
+    assert pd.isna(categories[16])
+    assert list(dataset['Driver']) == sorted(dataset['Driver'])
+
+
+def test_engines_match_without_control_messages():
+    session = make_session(6, missing_rate=0)
+    session.race_control_messages = session.race_control_messages.iloc[:0]
+
+    check_engine_parity(session)
+
+
+def test_engines_match_driver_without_laps():
+    # Driver in the results, but without any lap
+    session = make_session(2, {'VER': 6, 'HAM': 0, 'LEC': 3, 'ALO': 1,
+                               'NOR': 4})
+
+    check_engine_parity(session)
+    full_dataset, driver_data = prepare_session_features(session, 'numpy')
+    assert 44 not in set(full_dataset['DriverNumber'])
+    assert 44 in set(driver_data['DriverNumber'])
+
+
+def test_engines_match_driver_without_lap_times():
+    # Every lap and sector time and speed of a driver is missing
+    session = make_session(3)
+    no_times = session.laps['Driver'] == 'LEC'
+    for column in ['LapTime', 'Sector1Time', 'Sector2Time', 'Sector3Time']:
+        session.laps.loc[no_times, column] = pd.NaT
+    for column in ['SpeedI1', 'SpeedI2', 'SpeedFL', 'SpeedST']:
+        session.laps.loc[no_times, column] = np.nan
+
+    check_engine_parity(session)
+    full_dataset, _ = prepare_session_features(session, 'numpy')
+    driver_row = full_dataset[full_dataset['DriverNumber'] == 16]
+    assert (driver_row['LapTimeSeconds_count'] == 0).all()
+    assert driver_row['LapTimeSeconds_mean'].isna().all()
+
+
+def test_engines_match_driver_outside_weather_window():
+    # Laps after the last weather sample give an empty weather window
+    session = make_session(4)
+    late_laps = session.laps['Driver'] == 'NOR'
+    session.laps.loc[late_laps, 'Time'] += pd.Timedelta(hours=2)
+
+    check_engine_parity(session)
+    full_dataset, _ = prepare_session_features(session, 'numpy')
+    driver_row = full_dataset[full_dataset['DriverNumber'] == 4]
+    assert driver_row['AirTemp_mean'].isna().all()
+
+
+def test_segment_aggregates_empty_and_missing():
+    values = np.array([[1.0], [np.nan], [3.0], [np.nan]])
+    aggregates = segment_aggregates(values,
+                                    np.array([0, 1, 3, 2]),
+                                    np.array([3, 2, 4, 2]))
+
+    np.testing.assert_array_equal(aggregates['count'][:, 0], [2, 0, 0, 0])
+    np.testing.assert_allclose(aggregates['mean'][:, 0],
+                               [2, np.nan, np.nan, np.nan])
+    np.testing.assert_allclose(aggregates['std'][:, 0],
+                               [np.sqrt(2), np.nan, np.nan, np.nan])
+    np.testing.assert_allclose(aggregates['min'][:, 0],
+                               [1, np.nan, np.nan, np.nan])
+    np.testing.assert_allclose(aggregates['max'][:, 0],
+                               [3, np.nan, np.nan, np.nan])
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        prepare_session_features(make_session(0), 'polars')